@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+'''
+benchmark the shape to tile assignment used by splitFile on a synthetic scene.
+
+the naive way tests every shape against every tile, the indexed way registers
+every shape once on a TileGridIndex and only looks at the shapes of each tile.
+
+    python benchmarks/bench_tile_assignment.py --size 40000 --tile 1000 --shapes 20000
+'''
+
+from __future__ import print_function
+
+import argparse
+import os.path as osp
+import random
+import sys
+import time
+
+sys.path.insert(0, osp.join(osp.dirname(osp.abspath(__file__)), '..'))
+
+from labelme.spatial_index import TileGridIndex  # NOQA
+from labelme.spatial_index import bbox_of  # NOQA
+
+
+def synthetic_scene(size, count, max_extent, seed=0):
+    '''random building like polygons (image coordination) over a size x size scene.'''
+    rnd = random.Random(seed)
+    shapes = []
+    for _ in range(count):
+        x = rnd.uniform(0, size - max_extent)
+        y = rnd.uniform(0, size - max_extent)
+        w = rnd.uniform(5, max_extent)
+        h = rnd.uniform(5, max_extent)
+        shapes.append([(x, y), (x + w, y), (x + w, y + h), (x, y + h)])
+    return shapes
+
+
+def intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def tile_rect(tileSz, row, col):
+    return (col * tileSz, row * tileSz, (col + 1) * tileSz, (row + 1) * tileSz)
+
+
+def assign_naive(shapes, size, tileSz):
+    tiles = {}
+    count = (size + tileSz - 1) // tileSz
+    bboxes = [bbox_of(s) for s in shapes]
+    for row in range(count):
+        for col in range(count):
+            rect = tile_rect(tileSz, row, col)
+            hits = [i for i, bbox in enumerate(bboxes) if intersects(bbox, rect)]
+            if hits:
+                tiles[(row, col)] = hits
+    return tiles
+
+
+def assign_indexed(shapes, size, tileSz):
+    tiles = {}
+    index = TileGridIndex(tileSz, size, size)
+    bboxes = []
+    for i, s in enumerate(shapes):
+        bbox = bbox_of(s)
+        bboxes.append(bbox)
+        index.insert(i, bbox)
+    for row, col in index.cells():
+        rect = tile_rect(tileSz, row, col)
+        hits = [i for i in index.query(row, col) if intersects(bboxes[i], rect)]
+        if hits:
+            tiles[(row, col)] = hits
+    return tiles
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--size', type=int, default=40000, help='scene width and height')
+    parser.add_argument('--tile', type=int, default=1000, help='tile size')
+    parser.add_argument('--shapes', type=int, default=5000, help='number of polygons')
+    parser.add_argument('--extent', type=float, default=60, help='max polygon extent')
+    args = parser.parse_args()
+
+    shapes = synthetic_scene(args.size, args.shapes, args.extent)
+    print('scene {0}x{0}, tile {1}, {2} shapes'.format(args.size, args.tile, len(shapes)))
+
+    t0 = time.time()
+    indexed = assign_indexed(shapes, args.size, args.tile)
+    t_indexed = time.time() - t0
+    print('indexed: {:.3f}s'.format(t_indexed))
+
+    t0 = time.time()
+    naive = assign_naive(shapes, args.size, args.tile)
+    t_naive = time.time() - t0
+    print('naive:   {:.3f}s'.format(t_naive))
+
+    assert naive == indexed, 'indexed assignment differs from the naive one'
+    print('speedup: {:.1f}x'.format(t_naive / max(t_indexed, 1e-9)))
+
+
+if __name__ == '__main__':
+    main()
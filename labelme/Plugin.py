@@ -13,24 +13,39 @@ from .utils import fmtShortcut
 from .utils import newAction
 from .utils import newIcon
 from .color_dialog import *
+from .annotation_index import annotation_index
+from .annotation_index import parse_query
+from .export_manifest import MANIFEST_NAME
+from .exporter import ExportEngine
+from .dir_index import dir_index
+from .file_list_model import FileListModel
+from .prefetch import Prefetcher
+from .raster_stats import omd_path
+from .raster_stats import stats_cache
+from .raster_stats import write_omd
+from .trace import span
+from .trace import start_trace
+from .trace import stop_trace
+import concurrent.futures
 import webbrowser
 import glob 
 import shutil
 import copy
 import functools
-import lxml.builder
-import lxml.etree
 import os.path as osp
 import yaml
 import gdal
 import math
 from . import get_config
+from . import logger
 from rslabel.gui import qtMouseListener
 from rslabel.gui import LabelmeEditor
 from rslabel.gui import LabelmeShape  
 
 __appname__ = 'RSLabel'
 
+log = logger.getChild('plugin')
+
 
 DEFAULT_LINE_COLOR = QtGui.QColor(0, 255, 0, 128)
 DEFAULT_FILL_COLOR = QtGui.QColor(255, 0, 0, 128)
@@ -68,13 +83,37 @@ class LabelmePlugin:
         self._noSelectionSlot = False
         self.imageWidth = 0
         self.imageHeight = 0
+        # rasters and label files of the next/previous images, loaded ahead
+        self.prefetcher = None
+        if self._config['prefetch']:
+            self.prefetcher = Prefetcher(
+                lambda filename: PreparedFile(
+                    filename, self.labelFilePath(filename),
+                    use_sidecar=self._config['label_sidecar']),
+                lambda filename: [filename, self.labelFilePath(filename)],
+                capacity=2 * self._config['prefetch'] + 2)
+        if self._config['log_level']:
+            logger.setLevel(self._config['log_level'].upper())
+        if self._config['trace']:
+            start_trace(self._config['trace'])
+        # keeps the annotation index of the open directory up to date
+        self.indexer = concurrent.futures.ThreadPoolExecutor(1)
+        # writes the label files, in the order they are saved
+        self.saver = concurrent.futures.ThreadPoolExecutor(1)
+        self._saving = {}  # label file -> future of its last background save
+        self._autoSaving = None  # (future, LabelFile) of the current image
+        # auto save once no edit came for auto_save_delay ms
+        self.autoSaveTimer = QTimer()
+        self.autoSaveTimer.setSingleShot(True)
+        self.autoSaveTimer.setInterval(self._config['auto_save_delay'])
+        self.autoSaveTimer.timeout.connect(self.autoSave)
 
 
 
     def initGui(self):
         """Function initalizes GUI of the OSM Plugin.
         """
-        print('* init Gui')
+        log.debug('init gui')
         self.dockWidgetVisible = False
 
         #mouse listener
@@ -121,7 +160,7 @@ class LabelmePlugin:
         #set grid size
         self.grid_size = self.settings.value('grid_size')
         if(self.grid_size is not None):
-            print('* load grid size configure')
+            log.debug('load grid size configure')
             self.iface.setGridSize(int(self.grid_size))
 
         # Populate the File menu dynamically.
@@ -135,15 +174,23 @@ class LabelmePlugin:
         self.statusBar().show()
       
     def fileSearchChanged(self):
-        self.importDirImages(
-            self.lastOpenDir,
-            pattern=self.fileSearch.text(),
-            load=False,
-        )
+        text = self.fileSearch.text()
+        # 'label:ship prob>8' lists the images with such a shape
+        query = parse_query(text) if self.lastOpenDir else None
+        if query is not None:
+            files = set(annotation_index(self.lastOpenDir).files(**query))
+            self.fileListModel.setPattern(None)
+            self.fileListModel.setFilter(
+                lambda f: osp.normcase(osp.abspath(self.labelFilePath(f))) in files)
+        else:
+            self.fileListModel.setFilter(None)
+            self.fileListModel.setPattern(text)
+        # retain currently selected file
+        self.setCurrentFile(self.filename)
 
     # Message Dialogs. #
     def hasLabels(self):
-        if not self.labelList.itemsToShapes:
+        if not self.labelList.count():
             self.errorMessage(
                 'No objects labeled',
                 'You must label at least one object to save the file.')
@@ -151,6 +198,7 @@ class LabelmePlugin:
         return True
 
     def mayContinue(self):
+        self.flushAutoSave()
         if not self.dirty:
             return True
         mb = QtWidgets.QMessageBox
@@ -169,32 +217,28 @@ class LabelmePlugin:
             return False
 
     def fileSelectionChanged(self):
-        items = self.fileListWidget.selectedItems()
-        if not items:
+        indexes = self.fileListWidget.selectionModel().selectedIndexes()
+        if not indexes:
             return
-        item = items[0]
 
         if not self.mayContinue():
             return
 
-        if(self.shortName):
-            filename = self.short_long_name[str(item.text())]
-            currIndex = self.imageList.index(filename)
-        else:
-            currIndex = self.imageList.index(str(item.text()))
+        filename = self.fileListModel.path(indexes[0].row())
+        if filename:
+            self.loadFile(filename)
 
-        if currIndex < len(self.imageList):
-            filename = self.imageList[currIndex]
-            if filename:
-                self.loadFile(filename)
+    def setCurrentFile(self, filename):
+        """Select filename in the file list, if it is shown."""
+        row = self.fileListModel.row(filename)
+        if row >= 0:
+            self.fileListWidget.setCurrentIndex(self.fileListModel.index(row))
 
 
     def setDirty(self):
         if self._config['auto_save'] or self.actions.saveAuto.isChecked():
-            label_file = osp.splitext(self.imagePath)[0] + '.json'
-            if self.output_dir:
-                label_file = osp.join(self.output_dir, label_file)
-            self.saveLabels(label_file)
+            # edits within auto_save_delay are saved together
+            self.autoSaveTimer.start()
             return
         self.dirty = True
         self.actions.save.setEnabled(True)
@@ -203,9 +247,26 @@ class LabelmePlugin:
         if self.filename is not None:
             title = '{} - {}*'.format(title, self.filename)
         self.mainWnd.setWindowTitle(title)
-        print('* set dirty')
+        log.debug('set dirty')
         
 
+    def autoSave(self):
+        if self.imagePath is None:
+            return
+        self.saveLabels(self.labelFilePath(self.imagePath), wait=False)
+
+    def flushAutoSave(self):
+        '''save now the edits waiting for the auto save timer.'''
+        if self.autoSaveTimer.isActive():
+            self.autoSaveTimer.stop()
+            self.autoSave()
+
+    def waitForSave(self, label_file):
+        '''wait for the background save of label_file, before it is read again.'''
+        future = self._saving.pop(osp.normcase(osp.abspath(label_file)), None)
+        if future is not None:
+            concurrent.futures.wait([future])
+
     # Callback functions:
     def newShape(self):
         """Pop-up and give focus to the label editor.
@@ -240,9 +301,9 @@ class LabelmePlugin:
             self.setDirty()
 
     def  editLabel(self, item=None):
-        print('*editLabel')
+        log.debug('edit label')
         if (not self.editor.isEditing()) and (not self.editor.canBreak()):
-            print('*editLabel, not editing. return')
+            log.debug('edit label: not editing')
             return
         item = item if item else self.currentItem()
         shape = self.labelList.get_shape_from_item(item)
@@ -265,7 +326,7 @@ class LabelmePlugin:
 
     # React to canvas signals.
     def shapeSelectionChanged(self, selected=False):
-        print('* shapeSelectionChanged slot triggered')
+        log.debug('shape selection changed')
         if self._noSelectionSlot:
             self._noSelectionSlot = False
         else:
@@ -281,39 +342,55 @@ class LabelmePlugin:
         self.actions.shapeLineColor.setEnabled(selected)
         self.actions.shapeFillColor.setEnabled(selected)
 
-    def addLabel(self, shape):
+    def labelItem(self, shape):
         item = QtWidgets.QListWidgetItem(shape.getLabel())
         item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
         item.setCheckState(Qt.Checked)
-        self.labelList.itemsToShapes.append((item, shape))
-        self.labelList.addItem(item)
-        if not self.uniqLabelList.findItems(shape.getLabel(), Qt.MatchExactly):
-            self.uniqLabelList.addItem(shape.getLabel())
+        return item
+
+    def addLabel(self, shape):
+        self.labelList.add_shape(self.labelItem(shape), shape)
+        self.addUniqLabels([shape.getLabel()])
+
+    def addUniqLabels(self, labels):
+        '''add labels to the unique label list and the label history, sorted once.'''
+        known = set(self.uniqLabelList.item(i).text()
+                    for i in range(self.uniqLabelList.count()))
+        new = sorted(set(labels) - known)
+        if new:
+            self.uniqLabelList.addItems(new)
             self.uniqLabelList.sortItems()
-        self.labelDialog.addLabelHistory(item.text())
+        self.labelDialog.addLabelsHistory(labels)
         for action in self.actions.onShapesPresent:
             action.setEnabled(True)
 
     def noShapes(self):
-        return not self.labelList.itemsToShapes
+        return not self.labelList.count()
 
     def remLabel(self, shape):
-        item = self.labelList.get_item_from_shape(shape)
-        self.labelList.takeItem(self.labelList.row(item))
+        self.labelList.remove_shape(shape)
 
     def loadShapes(self, shapes):
-        for shape in shapes:
-            self.addLabel(shape)
+        shapes = list(shapes)
+        self.labelList.add_shapes(
+            [(self.labelItem(shape), shape) for shape in shapes])
+        if shapes:
+            self.addUniqLabels([shape.getLabel() for shape in shapes])
         self.editor.loadShapes(shapes)
 
     def loadLabels(self, shapes):
+        with span('shape build', file=self.filename):
+            self._loadLabels(shapes)
+
+    def _loadLabels(self, shapes):
         s = []
         for label, points, line_color, fill_color, shape_type, probability in shapes:
             shape = LabelmeShape(label, shape_type)
             shape.setProbability(probability)
-            for x, y in points:
-                print('*({},{})'.format(x,y))
-                shape.addPoint(QtCore.QPointF(x, y))
+            # json lists and sidecar views alike, converted in one go and
+            # handed to the shape as a whole rather than point by point
+            points = np.asarray(points, dtype=np.float64).reshape(-1, 2).tolist()
+            shape.thePoints = [QtCore.QPointF(x, y) for x, y in points]
             shape.close()
             s.append(shape)
             if line_color:
@@ -324,7 +401,7 @@ class LabelmePlugin:
 
     #*
     def loadFlags(self, flags):
-        print('*load Flags', flags)
+        log.debug('load flags %s', flags)
         self.flag_widget.clear()
         for key, flag in flags.items():
             item = QtWidgets.QListWidgetItem(key)
@@ -334,10 +411,14 @@ class LabelmePlugin:
 
 
     # called by saveFile
-    def saveLabels(self, filename):
-        lf = LabelFile()
+    def saveLabels(self, filename, wait=True):
+        '''
+        write the label file from a snapshot of the shapes, on the saver
+        thread. with wait=False the file is written in the background, a
+        failure is only logged.
+        '''
+        lf = LabelFile(use_sidecar=self._config['label_sidecar'])
         def format_shape(s):
-            print('*',len(s.thePoints))
             return dict(
                 label= s.getLabel(),
                 line_color=s.line_color.getRgb()
@@ -349,46 +430,80 @@ class LabelmePlugin:
                 shape_type=s.getType(),
             )
 
-        shapes = [format_shape(shape) for shape in self.labelList.shapes]
+        with span('save snapshot', file=filename):
+            shapes = [format_shape(shape) for shape in self.labelList.shapes]
         flags = {}
         for i in range(self.flag_widget.count()):
             item = self.flag_widget.item(i)
             key = item.text()
             flag = item.checkState() == Qt.Checked
             flags[key] = flag
-        try:
-            imagePath = osp.relpath(
-                self.imagePath, osp.dirname(filename))
-            imageData = self.imageData if self._config['store_data'] else None
-            if osp.dirname(filename) and not osp.exists(osp.dirname(filename)):
-                os.makedirs(osp.dirname(filename))
-            lf.save(
-                filename=filename,
-                shapes=shapes,
-                imagePath=imagePath,
-                imageData=imageData,
-                imageHeight=self.imageHeight,
-                imageWidth=self.imageWidth,
-                lineColor=self.lineColor.getRgb(),
-                fillColor=self.fillColor.getRgb(),
-                otherData=self.otherData,
-                flags=flags,
-            )
-            print('* save label, imageWidth is {}'.format(self.imageWidth))
+        imagePath = osp.relpath(
+            self.imagePath, osp.dirname(filename))
+        imageData = self.imageData if self._config['store_data'] else None
+        data = dict(
+            filename=filename,
+            shapes=shapes,
+            imagePath=imagePath,
+            imageData=imageData,
+            imageHeight=self.imageHeight,
+            imageWidth=self.imageWidth,
+            lineColor=self.lineColor.getRgb(),
+            fillColor=self.fillColor.getRgb(),
+            otherData=copy.deepcopy(self.otherData),
+            flags=flags,
+        )
+        # the target is known before the write, see currentLabelFile()
+        lf.filename = filename
+        future = self.saver.submit(self._writeLabels, lf, data, self.lastOpenDir)
+        if wait:
+            try:
+                future.result()
+            except LabelFileError as e:
+                self.errorMessage('Error saving label data', '<b>%s</b>' % e)
+                return False
+            self._autoSaving = None
             self.labelFile = lf
-            items = self.fileListWidget.findItems(
-                self.imagePath, Qt.MatchExactly
-            )
-            if len(items) > 0:
-                if len(items) != 1:
-                    raise RuntimeError('There are duplicate files.')
-                items[0].setCheckState(Qt.Checked)
-            # disable allows next and previous image to proceed
-            # self.filename = filename
-            return True
-        except LabelFileError as e:
-            self.errorMessage('Error saving label data', '<b>%s</b>' % e)
-            return False
+        else:
+            future.add_done_callback(functools.partial(self._autoSaved, filename))
+            self._saving = dict((key, f) for key, f in self._saving.items()
+                                if not f.done())
+            self._saving[osp.normcase(osp.abspath(filename))] = future
+            self._autoSaving = (future, lf)
+        self.fileListModel.setLabeled(self.imagePath)
+        # disable allows next and previous image to proceed
+        # self.filename = filename
+        return True
+
+    def _writeLabels(self, lf, data, root):
+        '''on the saver thread.'''
+        filename = data['filename']
+        if osp.dirname(filename) and not osp.exists(osp.dirname(filename)):
+            os.makedirs(osp.dirname(filename))
+        with span('save', file=filename, shapes=len(data['shapes'])):
+            lf.save(**data)
+        if root:
+            dir_index(root).refresh(filename)
+            self.indexer.submit(annotation_index(root).updateFile, filename)
+
+    def currentLabelFile(self):
+        '''
+        the label file of the current image. the one of a background save
+        replaces it once written, and stands for it while it is written.
+        '''
+        if self._autoSaving is not None:
+            future, lf = self._autoSaving
+            if not future.done():
+                return lf
+            self._autoSaving = None
+            if future.exception() is None:
+                self.labelFile = lf
+        return self.labelFile
+
+    def _autoSaved(self, filename, future):
+        e = future.exception()
+        if e is not None:
+            logger.error('Failed to auto save {}: {}'.format(filename, e))
 
 
     def importDirImages(self, dirpath, pattern=None, load=True):
@@ -400,27 +515,12 @@ class LabelmePlugin:
 
         self.lastOpenDir = dirpath
         self.filename = None
-        self.fileListWidget.clear()
-        self.short_long_name = {}
-        for filename in self.scanAllImages(dirpath):
-            if pattern and pattern not in filename:
-                continue
-            filename = filename.replace('\\','/')
-            label_file = osp.splitext(filename)[0] + '.json'
-            if self.output_dir:
-                label_file = osp.join(self.output_dir, label_file)
-            self.short_long_name[osp.basename(filename)] = filename
-            if(self.shortName):
-                item = QtWidgets.QListWidgetItem(osp.basename(filename))
-            else:
-                item = QtWidgets.QListWidgetItem(filename)
-            item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-            if QtCore.QFile.exists(label_file) and \
-                    LabelFile.isLabelFile(label_file):
-                item.setCheckState(Qt.Checked)
-            else:
-                item.setCheckState(Qt.Unchecked)
-            self.fileListWidget.addItem(item)
+        self.fileListModel.setFiles(
+            filename.replace('\\','/') for filename in self.scanAllImages(dirpath))
+        self.fileListModel.setPattern(pattern)
+        # bring the annotation index of the directory up to date
+        # with the directory index scanAllImages just brought up to date
+        self.indexer.submit(annotation_index(dirpath).update, dir_index(dirpath))
         self.openNextImg(load=load)
 
     def undoShapeEdit(self):
@@ -484,7 +584,7 @@ class LabelmePlugin:
             return
         if self.filename is None:
             return
-        currIndex = self.imageList.index(self.filename)
+        currIndex = self.fileListModel.row(self.filename)
         if currIndex - 1 >= 0:
             filename = self.imageList[currIndex - 1]
             if filename:
@@ -505,7 +605,7 @@ class LabelmePlugin:
         if self.filename is None:
             filename = self.imageList[0]
         else:
-            currIndex = self.imageList.index(self.filename)
+            currIndex = self.fileListModel.row(self.filename)
             if currIndex + 1 < len(self.imageList):
                 filename = self.imageList[currIndex + 1]
             else:
@@ -517,17 +617,18 @@ class LabelmePlugin:
 
     def saveFile(self, _value=False):
         if self._config['flags'] or self.hasLabels():
-            print('*save File')
-            if self.labelFile:
+            log.debug('save file')
+            labelFile = self.currentLabelFile()
+            if labelFile:
                 # DL20180323 - overwrite when in directory
-                print('* has label file')
-                self._saveFile(self.labelFile.filename)
+                log.debug('save to the label file')
+                self._saveFile(labelFile.filename)
             elif self.output_file:
-                print('has output file')
+                log.debug('save to the output file')
                 self._saveFile(self.output_file)
                 self.close()
             else:
-                print('*call _saveFile')
+                log.debug('save to a new file')
                 self._saveFile(self.saveFileDialog())
 
     #add toolbar the main window
@@ -634,11 +735,8 @@ class LabelmePlugin:
         current_filename = self.filename
         self.importDirImages(self.lastOpenDir, load=False)
 
-        if current_filename in self.imageList:
-            # retain currently selected file
-            self.fileListWidget.setCurrentRow(
-                self.imageList.index(current_filename))
-            self.fileListWidget.repaint()
+        # retain currently selected file
+        self.setCurrentFile(current_filename)
  
     def _saveFile(self, filename):
         if filename and self.saveLabels(filename):
@@ -690,7 +788,7 @@ class LabelmePlugin:
                 try:
                     data = json.load(f)
                     nodes = parseDict(data)
-                    print('***weps------------------')
+                    log.debug('imported json nodes:')
                     nodes.print()
                 except Exception as e:
                     self.errorMessage('导入文件发生错误', '请检查json文件格式')
@@ -744,7 +842,7 @@ class LabelmePlugin:
 
 
     def copySelectedShape(self):
-        print('*()copy selected shape')
+        log.debug('copy selected shape')
         self.addLabel(self.editor.copySelectedShape())
         # fix copy and delete
         self.shapeSelectionChanged(True)
@@ -755,89 +853,79 @@ class LabelmePlugin:
         self.imagePath = None
         self.imageData = None
         self.labelFile = None
+        self._autoSaving = None
         self.otherData = {} 
         # self.canvas.resetState() *
 
     @property
     def imageList(self):
-        lst = []
-        for i in range(self.fileListWidget.count()):
-            item = self.fileListWidget.item(i)
-            if(self.shortName):
-                lst.append(self.short_long_name[item.text()])
-            else:
-                lst.append(item.text())
-        return lst
+        return self.fileListModel.files()
 
     def isShortName(self, filename):
         return (filename.find('/')==-1) and (filename.find('\\')==-1)
 
     def loadFile(self, filename=None):
         """Load the specified file, or the last opened file if None."""
-        print('* IS short name? ', self.shortName)
         if(self.isShortName(filename)):
-            filename = self.short_long_name[filename]
+            filename = self.fileListModel.fullPath(filename)
         # changing fileListWidget loads file
-        print('\n\n\n*-------------------------------------load a new file --------------------------------------------')
-        if (filename in self.imageList and
-                self.fileListWidget.currentRow() !=
-                self.imageList.index(filename)):
-            self.fileListWidget.setCurrentRow(self.imageList.index(filename))
-            self.fileListWidget.repaint()
+        log.debug('load file %s', filename)
+        row = self.fileListModel.row(filename)
+        if row >= 0 and self.fileListWidget.currentIndex().row() != row:
+            self.setCurrentFile(filename)
             return
-        print('*resetState')
+        self.flushAutoSave()
         self.resetState()
         if filename is None:
             filename = self.settings.value('filename', '')
         filename = str(filename)
+        # an edit of filename may still be written in the background
+        self.waitForSave(self.labelFilePath(filename))
         if not QtCore.QFile.exists(filename):
             self.errorMessage(
                 'Error opening file', 'No such file: <b>%s</b>' % filename)
-            print('*No such file')
+            log.warn('No such file: {}'.format(filename))
             return False
-        # assumes same name, but json extension
         self.status("Loading %s..." % osp.basename(str(filename)))
-        label_file = osp.splitext(filename)[0] + '.json'
-        if self.output_dir:
-            label_file = osp.join(self.output_dir, label_file)
+        # the raster metadata and the label file, from the prefetcher when
+        # it has them ready
+        prepared = None
+        if self.prefetcher is not None:
+            prepared = self.prefetcher.get(filename)
+        if prepared is None:
+            prepared = PreparedFile(filename, self.labelFilePath(filename),
+                                    use_sidecar=self._config['label_sidecar'])
+        label_file = prepared.label_file
         #if find the label file for the image
-        if QtCore.QFile.exists(label_file) and \
-                LabelFile.isLabelFile(label_file):
-            try:
-                self.labelFile = LabelFile(label_file)
-            except LabelFileError as e:
-                self.errorMessage(
-                    '打开文件时发生错误',
-                    "<p><b>%s</b></p>"
-                    "<p>确保 <i>%s</i> 是有效的标记文件"
-                    % (e, label_file))
-                self.status("读文件错误 %s" % label_file)
-                return False
+        if prepared.labelFileError is not None:
+            self.errorMessage(
+                '打开文件时发生错误',
+                "<p><b>%s</b></p>"
+                "<p>确保 <i>%s</i> 是有效的标记文件"
+                % (prepared.labelFileError, label_file))
+            self.status("读文件错误 %s" % label_file)
+            return False
+        if prepared.labelFile is not None:
+            self.labelFile = prepared.labelFile
             self.imagePath = osp.join(
                 osp.dirname(label_file),
                 self.labelFile.imagePath,
             )
             self.lineColor = QtGui.QColor(*self.labelFile.lineColor)
             self.fillColor = QtGui.QColor(*self.labelFile.fillColor)
-            self.otherData = self.labelFile.otherData
+            # the prepared file stays in the prefetch cache, keep it intact
+            self.otherData = copy.deepcopy(self.labelFile.otherData)
             self.geoTrans = self.otherData['geoTrans']
         
         # no matter there has a labelfile. we need to read file here.  some raster must 
         # get statistics
-        print('*call gdal to read file')
-        imageHandle = read(filename) #*
-        if imageHandle is not None:
+        if prepared.geoTrans is not None:
             # the filename is image not JSON
             self.imagePath = filename
-            self.imageWidth = imageHandle.RasterXSize
-            self.imageHeight = imageHandle.RasterYSize
-            geoTrans = imageHandle.GetGeoTransform()
-            if(math.isclose(geoTrans[0], 0)):
-                self.geoTrans = [0,1,0, self.imageHeight, 0, -1]
-            else:
-                self.geoTrans = geoTrans
+            self.imageWidth = prepared.imageWidth
+            self.imageHeight = prepared.imageHeight
+            self.geoTrans = prepared.geoTrans
             self.otherData['geoTrans'] = self.geoTrans
-            del imageHandle
         else:
             formats = ['*.{}'.format(fmt.data().decode())
                     for fmt in QtGui.QImageReader.supportedImageFormats()]
@@ -854,28 +942,48 @@ class LabelmePlugin:
             prev_shapes = self.canvas.shapes
         
         # to display the image
-        print('* clear shape')
         self.editor.clearShapes()
         self.iface.reset() #
         if self._config['flags']:
             self.loadFlags({k: False for k in self._config['flags']})
         if self._config['keep_prev']:
             self.loadShapes(prev_shapes)
-            print('* load shapes prev ~!~')
+            log.debug('kept the shapes of the previous image')
         if self.labelFile:
             self.loadLabels(self.labelFile.shapes) #his shapes is not labelmeShape
             if self.labelFile.flags is not None:
                 self.loadFlags(self.labelFile.flags)
         else:
-            print('*the labelFile is None')
+            log.debug('no label file for %s', filename)
 
         self.setClean()
         self.paintCanvas()
         self.addRecentFile(self.filename)
         self.toggleActions(True)
         self.status("加载 %s" % osp.basename(str(filename)))
+        self.prefetchAround(filename)
         return True 
 
+    def labelFilePath(self, filename):
+        # assumes same name, but json extension
+        label_file = osp.splitext(filename)[0] + '.json'
+        if self.output_dir:
+            label_file = osp.join(self.output_dir, label_file)
+        return label_file
+
+    def prefetchAround(self, filename):
+        """Load the neighbours of filename in the file list in the background."""
+        if self.prefetcher is None:
+            return
+        imageList = self.imageList
+        currIndex = self.fileListModel.row(filename)
+        if currIndex < 0:
+            return
+        count = self._config['prefetch']
+        ahead = imageList[currIndex + 1:currIndex + 1 + count]
+        behind = imageList[max(currIndex - count, 0):currIndex][::-1]
+        self.prefetcher.prefetch(ahead + behind)
+
     def setClean(self):
         self.dirty = False
         self.actions.save.setEnabled(False)
@@ -893,10 +1001,16 @@ class LabelmePlugin:
     def unload(self):
         """Function unloads the OSM Plugin.
         """
+        if self.prefetcher is not None:
+            self.prefetcher.shutdown()
+        self.flushAutoSave()
+        self.saver.shutdown(wait=True)
+        self.indexer.shutdown(wait=False)
+        stop_trace()
         self.dockWidget.close()
 
     def setEditMode(self):
-        print('**set edit mode')
+        log.debug('set edit mode')
         self.toggleDrawMode(True)
  
     def showHideDockWidget(self):
@@ -928,7 +1042,7 @@ class LabelmePlugin:
 
         In the middle of drawing, toggling between modes should be disabled.
         """
-        print('* toggleDrawingSensitive')
+        log.debug('toggle drawing sensitive')
         self.actions.editMode.setEnabled(not drawing)
         self.actions.undoLastPoint.setEnabled(drawing)
         self.actions.undo.setEnabled(not drawing)
@@ -1027,8 +1141,11 @@ class LabelmePlugin:
         layout = QtWidgets.QHBoxLayout()
         layout.addWidget(self.fileSearch)
         layout.addWidget(self.showAllFiles)
-        self.fileListWidget = QtWidgets.QListWidget()
-        self.fileListWidget.itemSelectionChanged.connect(
+        self.fileListModel = FileListModel(self.labelFilePath)
+        self.fileListWidget = QtWidgets.QListView()
+        self.fileListWidget.setUniformItemSizes(True)
+        self.fileListWidget.setModel(self.fileListModel)
+        self.fileListWidget.selectionModel().selectionChanged.connect(
             self.fileSelectionChanged
         )
 
@@ -1074,17 +1191,12 @@ class LabelmePlugin:
 
     def onNoPath(self,e):
         self.shortName =  e
+        self.fileListModel.setShortName(self.shortName)
         if(not self.shortName):
-            for i in range(self.fileListWidget.count()):
-                item = self.fileListWidget.item(i)
-                item.setText(self.short_long_name[item.text()])
             self.noPath.setText('隐藏路径')
         else:
-            for i in range(self.fileListWidget.count()):
-                item = self.fileListWidget.item(i)
-                item.setText(osp.basename(item.text()))
             self.noPath.setText('显示路径')
-        print('* self.shortName', self.shortName)
+        log.debug('short names: %s', self.shortName)
 
     # Actions and menus
     def createActionsAndMenus(self):
@@ -1437,7 +1549,7 @@ class LabelmePlugin:
         self.canvas.adjustSize()
         self.canvas.update()  
         '''
-        print('* call iface to openFile')
+        log.debug('open file through the host')
         self.iface.openFile(self.filename)
         pass
 
@@ -1451,15 +1563,10 @@ class LabelmePlugin:
             action.setEnabled(value)
 
     def scanAllImages(self, folderPath):
-        extensions = self.supportedFmts
-        images = []        
-        for root, dirs, files in os.walk(folderPath):
-            for file in files:
-                if file.lower().endswith(tuple(extensions)):
-                    relativePath = osp.join(root, file)
-                    images.append(relativePath)            
-        images = set(images)
-        images = list(images)
+        index = dir_index(folderPath)
+        index.update()
+        extensions = ['.' + fmt for fmt in self.supportedFmts]
+        images = list(index.images(extensions))
         images.sort(key=lambda x: x.lower())
         return images
 
@@ -1467,19 +1574,18 @@ class LabelmePlugin:
         '''
         scan the tiled image filder. return all tiled image in this folder.
         '''
-        extensions = self.supportedFmts
+        index = dir_index(tiledImagefolder)
+        index.update()
+        extensions = ['.' + fmt for fmt in self.supportedFmts]
         images = []
-        for root, dirs, files in os.walk(tiledImagefolder):
-            for dir in dirs:
-                imgs = []
-                for root_,  _, filess in os.walk(osp.join(root,dir)):
-                    for file in filess:
-                        if file.lower().endswith(tuple(extensions)):
-                            relativePath = osp.join(root_, file)
-                            imgs.append(relativePath)
-                if(len(imgs) > 0):
-                    imgs.sort(key=lambda x: x.lower())
-                    images.append(imgs)
+        for rel in index.dirs():
+            if not rel:
+                continue
+            imgs = list(index.files(
+                extensions, under=osp.join(tiledImagefolder, rel)))
+            if(len(imgs) > 0):
+                imgs.sort(key=lambda x: x.lower())
+                images.append(imgs)
         return images
 
     def validateLabel(self, label):
@@ -1513,17 +1619,16 @@ class LabelmePlugin:
             self.editor.moveToSelectedShape()
 
     def labelItemChanged(self, item):
-        print('* labelItemChanged')
+        log.debug('label item changed')
         shape = self.labelList.get_shape_from_item(item)
-        print('* shape type is ', type(shape))
         label = str(item.text())
         if label != shape.getLabel():
-            print('* shape label is not equal, shape.label={}'.format(shape.getLabel()))
+            log.debug('label of shape %s changed', shape.getLabel())
             #shape.label = str(item.text())
             shape.setLabel(str(item.text()))
             self.setDirty()
         else:  # User probably changed item visibility
-            print('*set visible') 
+            log.debug('set shape visibility')
             self.editor.setShapeVisible(shape, item.checkState() == Qt.Checked)
     
     def loadRecent(self, filename):
@@ -1555,15 +1660,15 @@ class LabelmePlugin:
 
     def editorEnabled(self, value):
         if(value):
-            print('** editor is enabled from HOST')
+            log.debug('editor enabled by the host')
         else:
-            print('** editor is disabled from HOST')
+            log.debug('editor disabled by the host')
         self.toggleActions(True)
 
     def chooseGridColor(self):
         color = self.colorDialog.getColor(
                         self.fillColor, 'Choose fill color', default=DEFAULT_FILL_COLOR)
-        print('*',color)
+        log.debug('color %s', color)
         self.grid_dialog.btnColor.setStyleSheet('background-color: rgb({}, {}, {});'.format(color.red(),color.green(),color.blue()))
         self.grid_color = color
 
@@ -1581,7 +1686,7 @@ class LabelmePlugin:
         ret = self.grid_dialog.exec()
         if(ret == 1): #accept
             self.grid_size = int(self.grid_dialog.txtGridSize.text())
-            print('* Grid size', self.grid_size)
+            log.debug('grid size %s', self.grid_size)
             if(self.grid_color is not None):
                 self.iface.setGridColor(self.grid_color)
             self.iface.setGridSize(self.grid_size)
@@ -1591,7 +1696,7 @@ class LabelmePlugin:
     
 
     def closeEvent(self):
-        print('*^^^^^^^^^^^^^^^close')
+        log.debug('close')
         if not self.mayContinue():
             event.ignore()
         self.settings.setValue(
@@ -1681,231 +1786,93 @@ class LabelmePlugin:
         self.export_dialog.txtOutDir.setText(targetDirPath)
         self.exportOutDir = targetDirPath
 
-    def splitFile(self):
-        '''
-        split the files in the lastOpenDir, the raster file is split to sub blocks, and the 
-        json file of labelme is plit too.
-        return the output dir.
-        '''
-        print('\n\n\n*-------------------------------------SPLIT FILES--------------------------------------------')
-        jsons = glob.glob(self.lastOpenDir + '/**/*.json', recursive=True)
-        jsonNum = len(jsons)
-        self.labels = set()
-        exts = ['.tif','.env', '.pix', '.img', '.tiff', '.ecw', '.tga', '.jpg']
-        extension = '.tif'
-        for i, label_file in enumerate(jsons):
-            #base = osp.splitext(osp.basename(label_file))[0]
-            base = my_splitext(osp.basename(label_file))[0]
-            filePathWithoutExt = my_splitext(label_file)[0]
-            findImg = False
-            for ext in exts:
-                img_file = filePathWithoutExt + ext
-                if(osp.exists(img_file)):
-                    findImg = True
-                    extension = ext
-                    break
-            if (findImg): #the json file has raster
-                print('*',extension)
-                tileSz = int(self.export_dialog.txtTileSize.text())      
-                outDir = self.export_dialog.txtOutDir.text()
-                outDir = osp.join(outDir , 'tiles', base)
-                if(not osp.exists(outDir)):
-                    os.makedirs(outDir)
-                self.statusBar().showMessage('正在处理 %s' % img_file)
-                validBlocks = []
-                #load json
-                print('* begin to load json file', label_file)
-                with open(label_file) as f:
-                    data = json.load(f)  #data is json file's content
-                    imagePath = data['imagePath']
-                    lineColor = data['lineColor']
-                    fillColor = data['fillColor']
-                    imageHeight = data['imageHeight']
-                    imageWidth = data['imageWidth']
-                    flags = data['flags']
-                    otherData = {}
-                    keys = [
-                        'imageData',
-                        'imagePath',
-                        'lineColor',
-                        'fillColor',
-                        'shapes',  # polygonal annotations
-                        'flags',   # image level flags
-                        'imageHeight',
-                        'imageWidth',]
-                    for key, value in data.items():
-                        if key not in keys:
-                            otherData[key] = value
-                    geoTrans = otherData['geoTrans']
-                    mapfunc = functools.partial(img2map_p, geoTrans)
-                    tile_x_count = math.ceil(imageWidth/tileSz)
-                    tile_y_count = math.ceil(imageHeight/tileSz)
-                    print('*',extension)
-                    print('* @|@json load, image width is {}, image height is {}, tile_x_count is {}, tile_y_count is {}'.format(imageWidth, imageHeight, tile_x_count,tile_y_count))
-                    for row in range(tile_y_count):
-                        for col in range(tile_x_count):
-                            if(col == (tile_x_count -1)):
-                                iw = imageWidth - col * tileSz
-                            else:
-                                iw = tileSz
-                            if(row == (tile_y_count -1)):
-                                ih = imageHeight - row * tileSz
-                            else:
-                                ih = tileSz
-                            #get the tiles rect (image coordination system)
-                            tileRect = QtCore.QRectF(
-                                col*tileSz,
-                                row*tileSz,
-                                iw, ih)
-                            shapes = []
-                            for s in data['shapes']:
-                                self.labels.add(s['label'])
-                                shape_type = s.get('shape_type', 'polygon')
-                                points = s['points']
-                                if(shape_type == 'rectangle'):
-                                    rect = QtCore.QRectF(QPoint(*map2img(geoTrans,points[0][0],points[0][1])),
-                                        QPoint(*map2img(geoTrans,points[1][0],points[1][1])))
-                                    if(rect.intersects(tileRect)):
-                                        print('* @|@ tile({},{}) get intersected rectangle, write to label ...'.format(row,col))
-                                        intersected = tileRect.intersected(rect)
-                                        if(math.isclose(geoTrans[0], 0)):
-                                            UL = offset(tileSz, row, col, intersected.topLeft().x(), intersected.topLeft().y())
-                                            LR = offset(tileSz, row, col, intersected.bottomRight().x(), intersected.bottomRight().y())
-                                        else:
-                                            UL = img2map(geoTrans,intersected.topLeft().x(), intersected.topLeft().y())
-                                            LR = img2map(geoTrans,intersected.bottomRight().x(), intersected.bottomRight().y())
-                                        copyS = copy.deepcopy(s)
-                                        copyS['points'] = [UL,LR]
-                                        shapes.append(copyS)                                        
-                                elif(shape_type == 'polygon' or shape_type=='slantRectangle' ):
-                                    tilePolygon = QtGui.QPolygonF(tileRect)
-                                    ps = []
-                                    for pnt in points:
-                                        ps.append(QPointF(*map2img(geoTrans,pnt[0],pnt[1])))
-                                    polygon = QtGui.QPolygonF(ps)
-                                    polygon = polygon.intersected(tilePolygon)
-                                    if(len(polygon) > 0):
-                                        print('* @|@ tile({},{}) get intersected polygon, write to label ...'.format(row,col))
-                                        copyS = copy.deepcopy(s)
-                                        if(math.isclose(geoTrans[0], 0)):
-                                            pts = [offset(tileSz, row, col, pnt.x(), pnt.y()) for pnt in polygon]
-                                        else:
-                                            pts = [(pnt.x(), pnt.y()) for pnt in polygon]
-                                            pts = list(map(mapfunc, pts))
-                                        copyS['points'] = pts 
-                                        shapes.append(copyS) 
-                            print('*',self.labels)
-                            if(self.labels is None):
-                                continue
-                            label_file_t = osp.join(outDir, '{}_{}_{}.{}'.format(base, row, col, 'json'))
-                            print('*',extension)
-                            imagePath = '{}_{}_{}.{}'.format(base, row, col, extension[1:])
-                            if (len(shapes) == 0):
-                                continue
-                            validBlocks.append(QtCore.QPoint(col, row))
-                            #begin to create json file for the block file
-                            if(math.isclose(geoTrans[0], 0)):
-                                otherData['geoTrans'] = [0,1,0,ih,0,-1]
-                            else:
-                                otherData['geoTrans'] = [geoTrans[0]+geoTrans[1]*col*tileSz,
-                                                            geoTrans[1],
-                                                            geoTrans[2],
-                                                            geoTrans[3] + geoTrans[5]*row*tileSz,
-                                                            geoTrans[4],
-                                                            geoTrans[5]]
-                            print('* @|@ label_file_t', label_file_t)
-                            lf = LabelFile()
-                            try:
-                                lf.save(
-                                    filename=label_file_t,
-                                    shapes=shapes,
-                                    imagePath=imagePath,
-                                    imageData=None,
-                                    imageHeight=ih,
-                                    imageWidth=iw,
-                                    lineColor=lineColor,
-                                    fillColor=fillColor,
-                                    otherData=otherData,
-                                    flags=flags,
-                                )
-                            except Exception as e:
-                                self.errorMessage(
-                                    '写标签文件失败',
-                                    '关闭数据集文件夹后重试.')
-                                return
-                if(validBlocks):
-                    self.iface.gdal2Tile(img_file,tileSz, outDir, validBlocks)
-            labels_file = osp.join(here, 'labels.txt')
-            with open(labels_file,'w') as f:
-                f.write('__ignore__\n')
-                f.write('_background_\n')
-                for label in self.labels:
-                    f.write(label+'\n')
-
-            #write flags to labels.txt
-        self.statusBar().showMessage('处理完毕')
-        outDir = self.export_dialog.txtOutDir.text()
-        outDir = osp.join(outDir , 'tiles')
-        return outDir
-      
-   
     def export(self):
         self.exportOutDir = self.export_dialog.txtOutDir.text()
         if (not osp.exists(self.exportOutDir)):
             os.makedirs(self.exportOutDir)
 
-        if os.listdir(self.exportOutDir):
-            mb = QtWidgets.QMessageBox
+        mb = QtWidgets.QMessageBox
+        if osp.exists(osp.join(self.exportOutDir, MANIFEST_NAME)):
+            # exported before, the engine only redoes what changed
+            msg = '该目录中有之前导出的数据集,是否只更新有修改的文件 ?\n选择"否"将重新导出全部文件.'
+            answer = mb.question(self.mainWnd,
+                                '增量导出',
+                                msg,
+                                mb.Yes | mb.No | mb.Cancel,
+                                mb.Yes)
+            if(answer == mb.Cancel):
+                return
+            wipe = answer == mb.No
+        elif os.listdir(self.exportOutDir):
             msg = '该目录非空,是否覆盖该文件夹中的内容 ?'
             answer = mb.question(self.mainWnd,
                                 '该目录非空',
                                 msg,
                                 mb.Yes | mb.Cancel,
                                 mb.Yes)
-            if(answer == mb.Yes):
-                try:
-                    #shutil.rmtree(self.exportOutDir,ignore_errors=True)
-                    outdir = self.exportOutDir.replace('/', '\\')
-                    os.system('rd /s /q ' + outdir)
-                except Exception as e:
-                    print('*repr(e):\t', repr(e) )
-                    print('* ^|^ remove file failed')
-        if(self.export_dialog.radVOC.isChecked()):
-            try:
-                os.makedirs(osp.join(self.exportOutDir, 'JPEGImages'))
-                os.makedirs(osp.join(self.exportOutDir, 'Annotations'))
-                os.makedirs(osp.join(self.exportOutDir, 'AnnotationsVisualization'))
-            except Exception:
-                print('*Creating dataset failed:', self.exportOutDir)
+            wipe = answer == mb.Yes
         else:
-            os.makedirs(osp.join(self.exportOutDir, 'Annotations'))
+            wipe = False
+        if wipe:
+            try:
+                #shutil.rmtree(self.exportOutDir,ignore_errors=True)
+                outdir = self.exportOutDir.replace('/', '\\')
+                os.system('rd /s /q ' + outdir)
+            except Exception as e:
+                log.warn('Failed to remove {}: {!r}'.format(self.exportOutDir, e))
 
-        self.isTiled = False
+        tileSz = None
         if(self.export_dialog.chkTiled.isChecked()):  #need to split to tiles
-            out = self.splitFile()
-            dir = out 
-            self.isTiled = True
-        else:
-            jsons = glob.glob(self.lastOpenDir + '/**/*.json', recursive=True)
-            jsonNum = len(jsons)
-            self.labels = set()
-            for label_file in jsons:
-                with open(label_file) as f:
-                    data = json.load(f)  #data is json file's content
-                    for s in data['shapes']:
-                        self.labels.add(s['label'])
-            labels_file = osp.join(here, 'labels.txt')
-            with open(labels_file,'w') as f:
-                f.write('__ignore__\n')
-                f.write('_background_\n')
-                for label in self.labels:
-                    f.write(label+'\n')
-            dir = self.lastOpenDir
-
-        if(self.export_dialog.radVOC.isChecked()):
-            self.exportAsVOC(dir)
+            tileSz = int(self.export_dialog.txtTileSize.text())
+        if self.export_dialog.radVOC.isChecked():
+            format = 'voc'
+        elif self.export_dialog.radYOLO.isChecked():
+            format = 'yolo'
+        elif self.export_dialog.radGPKG.isChecked():
+            format = 'gpkg'
+            if tileSz is not None:
+                self.errorMessage('导出失败', 'GeoPackage格式不支持切块导出.')
+                return
+        elif self.export_dialog.radSeg.isChecked():
+            format = 'seg'
+            if tileSz is None:
+                self.errorMessage('导出失败', '分割PNG格式需要切块导出.')
+                return
         else:
-            self.exportAsCOCO(dir)
+            format = 'coco'
+        engine = ExportEngine(self.exportOutDir, format, tileSz,
+                              instanceDrawer=self.drawInstances,
+                              instances=self.export_dialog.chkInstances.isChecked(),
+                              link=self._config['export_link'])
+        progressDialog = QtWidgets.QProgressDialog(
+            '正在导出...', '取消', 0, 100, self.mainWnd)
+        progressDialog.setWindowModality(Qt.WindowModal)
+        progressDialog.setMinimumDuration(0)
+
+        def progress(done, total):
+            percent = int(done * 100.0 / total)
+            self.iface.setProgress(percent)
+            progressDialog.setValue(percent)
+
+        def cancelled():
+            QtWidgets.QApplication.processEvents()
+            return progressDialog.wasCanceled()
+
+        try:
+            finished = engine.run(self.lastOpenDir, progress, cancelled,
+                                  self.statusBar().showMessage)
+        except Exception as e:
+            log.exception('export failed')
+            self.errorMessage(
+                '写标签文件失败',
+                '关闭数据集文件夹后重试.')
+            return
+        finally:
+            progressDialog.close()
+        self.labels = engine.labels
+        if not finished:
+            self.statusBar().showMessage('已取消')
+            return
         mb = QtWidgets.QMessageBox
         msg =  '导出数据集成功,可查看数据集'
         answer = mb.information(self.mainWnd,
@@ -1913,234 +1880,28 @@ class LabelmePlugin:
                             msg)  
         os.startfile(self.export_dialog.txtOutDir.text())
 
-    def exportAsCOCO(self, dir):
-        if self.isTiled:
-            self.exportTiledResultAsCOCO(dir)
-        else:
-            self.exportNoTiledResultAsCOCO(dir)
-
-    def exportNoTiledResultAsCOCO(self, dir):
-        jsons = glob.glob(dir + '/**/*.json', recursive=True)
-        outdir = self.export_dialog.txtOutDir.text()
-        for json in jsons:
-            js = [json]
-            output_json = osp.join(outdir, '{}.json'.format(my_basename(json)))
-            labelme2coco(js, output_json)
-            # move image files to Annotations folder
-            # find the image file to be move
-            exts = ['.tif','.env', '.pix', '.img', '.tiff', '.ecw', '.tga', '.jpg']
-            e = '.tif'
-            filePathWithoutExt = my_splitext(json)[0]
-            findImg = False
-            for ext in exts:
-                img_file = filePathWithoutExt + ext
-                if(osp.exists(img_file)):
-                    findImg = True
-                    e = ext
-                    break 
-            if findImg:
-                subFolder = osp.join(outdir, 'Annotations')
-                shutil.copy(img_file, subFolder)
-
-    def exportTiledResultAsCOCO(self, dir):
-        cds = childDir(dir)  #get next leve folder name. without path name
-        for child in cds:
-            jsons = glob.glob(osp.join(dir,child) + '/**/*.json', recursive=True)
-            outdir = self.export_dialog.txtOutDir.text()
-            output_json = osp.join(outdir, 'coco_{}.json'.format(child))
-            labelme2coco(jsons, output_json)
-            # move image files to Annotations folder
-            for json in jsons:
-                filePathWithoutExt = my_splitext(json)[0]
-                #for every json file, we create a folder in Annotations
-                subFolder = osp.join(outdir, 'Annotations', child)
-                if(not osp.exists(subFolder)):
-                    os.makedirs(subFolder)
-                #find the image file to be move
-                exts = ['.tif','.env', '.pix', '.img', '.tiff', '.ecw', '.tga', '.jpg']
-                e = '.tif'
-                findImg = False
-                for ext in exts:
-                    img_file = filePathWithoutExt + ext
-                    if(osp.exists(img_file)):
-                        findImg = True
-                        e = ext
-                        break 
-                if findImg:
-                    shutil.copy(img_file, subFolder)
+    def drawInstances(self, img_file, out_viz_file, bboxes, colors, captions):
+        '''instance drawer of the export engine, the tile is drawn by the host.'''
+        # the host stretches non byte rasters with the statistics of the .omd file
+        if(not osp.exists(omd_path(img_file))):
+            img = read(img_file)
+            del img
+        bboxes = [QRect(QPoint(xmin,ymin),QPoint(xmax,ymax)) for xmin, ymin, xmax, ymax in bboxes]
+        colors = [QColor(*color) for color in colors]
+        self.iface.draw_instances(img_file, out_viz_file, bboxes, colors, captions)
 
     def onOpenInExplorer(self):
         if(self.lastOpenDir is not None):
             os.startfile(self.lastOpenDir)
 
-    def exportAsVOC(self, dir):
-        print('\n\n\n*-------------------------------------export as VOC--------------------------------------------')
-        class_names = []
-        class_name_to_id = {}
-        labels_file = osp.join(here, 'labels.txt')
-        print('*labels file:',labels_file)
-        ##########     
-        for i, line in enumerate(open(labels_file).readlines()):
-            class_id = i - 1  # starts with -1
-            class_name = line.strip()
-            class_name_to_id[class_name] = class_id
-            if class_id == -1:
-                assert class_name == '__ignore__'
-                continue
-            elif class_id == 0:
-                assert class_name == '_background_'
-            class_names.append(class_name)
-        class_names = tuple(class_names)
-        print('*class_names:', class_names)
-        out_class_names_file = osp.join(self.exportOutDir, 'class_names.txt')
-        with open(out_class_names_file, 'w') as f:
-            f.writelines('\n'.join(class_names))
-        print('*Saved class_names:', out_class_names_file)
-        #########
-        jsons = glob.glob(dir + '/**/*.json', recursive=True)
-        print('*export dir: {}'.format(dir))
-        jsonNum = len(jsons)
-        for i, label_file in enumerate(jsons):
-            with open(label_file) as f:
-                data = json.load(f)  #data is json file's content
-                #get geo trans parameters from json file
-                otherData = {}
-                keys = [
-                    'imageData',
-                    'imagePath',
-                    'lineColor',
-                    'fillColor',
-                    'shapes',  # polygonal annotations
-                    'flags',   # image level flags
-                    'imageHeight',
-                    'imageWidth',]
-                for key, value in data.items():
-                    if key not in keys:
-                        otherData[key] = value
-                geoTrans = otherData['geoTrans']
-            #make dirs for voc
-            base = osp.splitext(osp.basename(label_file))[0]
-            out_img_file = osp.join(
-                self.exportOutDir, 'JPEGImages', data['imagePath'])
-            out_xml_file = osp.join(
-                self.exportOutDir, 'Annotations', base + '.xml')
-            out_viz_file = osp.join(
-                self.exportOutDir, 'AnnotationsVisualization', base + '.tif')
-            # get the image file to copy to ...
-            img_file = osp.join(osp.dirname(label_file), data['imagePath'])
-            print('*export',img_file)
-            print('*to', out_img_file)
-            shape = gdalCopy(img_file, out_img_file)
-            self.statusBar().showMessage('正在拷贝文件{}'.format(img_file))
-            maker = lxml.builder.ElementMaker()
-            xml = maker.annotation(
-                maker.folder('JPEGImages'),
-                maker.filename(data['imagePath']),
-                maker.path(out_img_file),
-                maker.source(maker.database('Unknown')),    # e.g., The VOC2007 Database
-                maker.size(
-                    maker.height(str(shape[0])),
-                    maker.width(str(shape[1])),
-                    maker.depth(str(shape[2])),
-                ),
-                maker.segmented('0'),
-            )
-            print('*VOC image, size: width {}, height {}, raster {}'.format(shape[0],shape[1],shape[2]))
-            bboxes = []
-            labels = []
-            colors = [] 
-            unkown_class_type = False 
-            for shape in data['shapes']:
-                if shape['shape_type'] != 'rectangle' \
-                    and shape['shape_type'] != 'polygon' \
-                    and shape['shape_type'] != 'slantRectangle':
-                    print('*Skipping shape: label={label}, shape_type={shape_type}'
-                        .format(**shape))
-                    continue
-                class_name = shape['label']
-                print('*class_name', class_name)
-                try:
-                    class_id = class_names.index(class_name)
-                except Exception as e:
-                    unkown_class_type = True
-                    break
-                if(shape['shape_type'] == 'rectangle'):
-                    (xmin_, ymin_), (xmax_, ymax_) = shape['points']
-                elif(shape['shape_type'] == 'polygon'):
-                    (xmin_, ymin_), (xmax_, ymax_) = boundingBox(shape['points'])
-                elif(shape['shape_type'] == 'slantRectangle'):
-                    (xmin_, ymin_), (xmax_, ymax_) = boundingBox(shape['points'])
-
-                #convert to image coordination here
-                xmin = (xmin_ - geoTrans[0]) / geoTrans[1]
-                ymin = (geoTrans[3] - ymin_) / -geoTrans[5]
-                xmax = (xmax_ - geoTrans[0]) / geoTrans[1]
-                ymax = (geoTrans[3] - ymax_) / -geoTrans[5]
-                if xmax < xmin:
-                    xmax, xmin = xmin, xmax
-                if ymax < ymin:
-                    ymax, ymin = ymin, ymax
-
-                bboxes.append(QRect(QPoint(xmin,ymin),QPoint(xmax,ymax))) 
-                labels.append(class_id)
-                xml.append(
-                    maker.object(
-                        maker.name(shape['label']),
-                        maker.pose('Unspecified'),
-                        maker.truncated('0'),
-                        maker.difficult('0'),
-                        maker.probability(str(shape['probability'])),
-                        maker.bndbox(
-                            maker.xmin(str(int(xmin))),
-                            maker.ymin(str(int(ymin))),
-                            maker.xmax(str(int(xmax))),
-                            maker.ymax(str(int(ymax))),
-                        ),
-                    )
-                )
-            if (unkown_class_type):
-                break  #next json file
-            captions = [class_names[l] for l in labels]
-            colormap = labelme.utils.label_colormap(255)
-            for label in labels:
-                color = (colormap[label]*255).astype(np.uint8)
-                colors.append(QColor(*color))
-            print('*captions {},  labels {},  colors {}'.format(captions, labels, colors))
-           
-            if(captions and self.isTiled):
-                self.statusBar().showMessage('正在给文件{}画实例'.format(img_file))
-                (pathName,extension) = os.path.splitext(img_file)
-                omd = pathName + '.omd'
-                if(not osp.exists(omd)):
-                    img = read(img_file)
-                    del img
-                self.iface.draw_instances(img_file, out_viz_file, bboxes, colors, captions)  
-
-            if(not self.isTiled):
-                readme = osp.join(
-                    self.exportOutDir, 'AnnotationsVisualization', 'readme.txt')
-                with open(readme,'w') as f:
-                    f.write('未分块的输入文件不支持draw instance操作')
-            #write xml
-            with open(out_xml_file, 'wb') as f:
-                f.write(lxml.etree.tostring(xml, encoding='utf-8' ,pretty_print=True))
-            self.iface.setProgress((int)((i+1)*100.0/jsonNum))
-            i = i + 1
-
     def map2img(self, x, y):
-        u = (x - self.geoTrans[0]) / self.geoTrans[1]
-        v = (self.geoTrans[3] - y) / -self.geoTrans[5]
-        return u, v
-    
+        return map2img(self.geoTrans, x, y)
+
     def img2map(self, x, y):
-        u = self.geoTrans[0] + self.geoTrans[1]*x
-        v = self.geoTrans[3] + self.geoTrans[5]*y
-        return u ,v 
+        return img2map_p(self.geoTrans, (x, y))
 
     def img2map_p(self, p):
-        u = self.geoTrans[0] + self.geoTrans[1]*p[0]
-        v = self.geoTrans[3] + self.geoTrans[5]*p[1]
-        return u ,v 
+        return img2map_p(self.geoTrans, p)
 
 ########################################################################################################
 #                                          GDAL                                        
@@ -2149,12 +1910,13 @@ import numpy as np
 def read(filename):
     img = None
     try:
-        img = gdal.Open(filename)
+        with span('image open', file=filename):
+            img = gdal.Open(filename)
         if(img is None):
             return None
 
         datatype = img.GetRasterBand(1).DataType
-        print('* @|@ read file, datatype$$$$$$$$$$$$$$$$$$$$$$$$$$$$$', datatype) 
+        log.debug('read %s, data type %s', filename, datatype)
         '''
         desc = img.GetDescription()
         metadata = img.GetMetadata() #
@@ -2164,75 +1926,51 @@ def read(filename):
         print('\n')
         '''
         if (datatype != 1):
-            bandNum = img.RasterCount
-            (filepath,tempfilename) = os.path.split(filename)
-            (shotname,extension) = os.path.splitext(tempfilename)
-            omd = filepath + '/' + shotname + '.omd'
-            print('*the omd file is', omd)
-            if not osp.exists(omd):
-                omdf = open(omd, 'w')
-                omdf.write('number_bands:  {}\n\n'.format(bandNum))
-                for bandIdx in np.arange(1, bandNum+1):
-                    band = img.GetRasterBand(int(bandIdx))
-                    stats = band.GetStatistics(0,1) #if no statistic , it will compute
-                    omdf.write('band{}.min_value:  {}\n'.format(bandIdx, stats[0]))
-                    omdf.write('band{}.max_value:  {}\n'.format(bandIdx, stats[1]))
-                    print('*', stats)
+            # statistics come from the cache, the host reads them from the .omd
+            with span('stats', file=filename):
+                bands, approx = stats_cache().statistics(
+                    filename, img, done=write_omd)
+                if approx or not osp.exists(omd_path(filename)):
+                    write_omd(filename, bands)
     except Exception:
-        print('*gdal read {}, failed'.format(filename))
-        exstr = traceback.format_exc()
-        print (exstr)
+        log.exception('gdal read {} failed'.format(filename))
     return img
         
-def gdalCopy(src_filename, dst_filename):
-    src_ds = gdal.Open( src_filename )
-    #Open output format driver, see gdal_translate --formats for list
-    #format = "GTiff"
-    #driver = gdal.GetDriverByName( format )
-    #Output to new format
-    #dst_ds = driver.CreateCopy( dst_filename, src_ds, 0 )
-    #Properly close the datasets to flush to disk
-    #dst_ds = None
-    w, h, d = src_ds.RasterXSize, src_ds.RasterYSize, src_ds.RasterCount
-    src_ds = None
-    shutil.copy(src_filename, dst_filename)
-    return w,h,d
+class PreparedFile(object):
+    '''
+    what loadFile needs of an image: its label file and the size and
+    geotransform of the raster. made off the GUI thread by the prefetcher, so
+    no Qt objects here.
+    '''
+
+    def __init__(self, filename, label_file, use_sidecar=False):
+        self.filename = filename
+        self.label_file = label_file
+        self.labelFile = None
+        self.labelFileError = None
+        if osp.exists(label_file) and LabelFile.isLabelFile(label_file):
+            try:
+                self.labelFile = LabelFile(label_file, use_sidecar=use_sidecar)
+            except LabelFileError as e:
+                self.labelFileError = e
+        self.imageWidth = None
+        self.imageHeight = None
+        self.geoTrans = None
+        imageHandle = read(filename) #*
+        if imageHandle is not None:
+            self.imageWidth = imageHandle.RasterXSize
+            self.imageHeight = imageHandle.RasterYSize
+            geoTrans = imageHandle.GetGeoTransform()
+            if(math.isclose(geoTrans[0], 0)):
+                self.geoTrans = [0,1,0, self.imageHeight, 0, -1]
+            else:
+                self.geoTrans = geoTrans
+            del imageHandle
 
 ########################################################################################################
 #                                          Utils                                        
 ########################################################################################################
 
-def my_basename(pathname):
-    """splitext for paths with directories that may contain dots."""
-    pathname = pathname.replace('\\', '/')
-    x = pathname.split('/')
-    path = x[-1]
-    ret, _ = my_splitext(path)
-    return ret
-
-
-def my_splitext(pathname):
-    """splitext for paths with directories that may contain dots."""
-    x = pathname.split(os.extsep)
-    path = x[0]
-    for ext in x[1:-1]:
-        path = path + '.' + ext
-    return path, x[-1]
-
-def boundingBox(points):
-    min_x, min_y = np.min(points, 0)[0], np.min(points, 0)[1]
-    max_x, max_y = np.max(points, 0)[0], np.max(points, 0)[1]
-    return (min_x, min_y), (max_x, max_y)
-
-def childDir(dir):
-    dirs = []
-    files = os.listdir(dir)
-    for f in files:
-        fullPathName = osp.join(dir,f)
-        if osp.isdir(fullPathName):
-            dirs.append(f)
-    return dirs
-
 class JsonNode(object):
     def __init__(self, name = None):
         if name is not None:
@@ -2283,8 +2021,7 @@ class JsonNode(object):
 def parseDict(data, root = None):
     root = JsonNode()
     for key, value in data.items():
-        print('*key= ', key)
-        print('*value= ', value)
+        log.debug('key=%s value=%s', key, value)
         node = JsonNode(key)
         value_is_list = isinstance(value, list)
         value_is_dict = isinstance(value, dict)
@@ -22,7 +22,6 @@ def icon():
 
 
 def classFactory(iface):
-    print('*classFactory, begin to load labelme plugin')
     from .Plugin import LabelmePlugin
     # return object of our plugin with reference to QGIS interface as the only argument
     return LabelmePlugin(iface) 
@@ -33,7 +32,6 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('RSLabel')
 del logging
 
-print('__init__ in labelme')
 
 def versionNumber():
     return "0.1"
@@ -50,7 +48,7 @@ def get_default_config():
         try:
             shutil.copy(config_file, user_config_file)
         except Exception:
-            print('Failed to save config: {}'.format(user_config_file))
+            logger.warn('Failed to save config: {}'.format(user_config_file))
 
     return config
 
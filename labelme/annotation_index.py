@@ -0,0 +1,273 @@
+'''
+a sqlite index of every shape of a project, for the queries over the whole
+project: the shapes of a label, above a probability or inside a box.
+
+every shape is a row with its label, type, probability and bounding box in
+map and image coordinates, the map boxes are also in an R*Tree. the index is
+kept next to the directory manifests (~/.labelme_index), it is brought up to
+date with update() from the size and mtime of the label files, and a label
+file just saved is indexed again with updateFile().
+
+    index = annotation_index(root)
+    index.update()
+    index.files(label='ship', minProbability=8)
+    index.query(bbox=(x0, y0, x1, y1))
+
+the file search box of the plugin takes the same queries, see parse_query().
+'''
+
+import collections
+import contextlib
+import json
+import os
+import os.path as osp
+import sqlite3
+import threading
+
+import numpy as np
+
+from .dir_index import DirIndex
+from .dir_index import manifest_path
+from .labelme2COCO import map2img_array
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS shapes (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    idx INTEGER NOT NULL,
+    label TEXT NOT NULL,
+    shape_type TEXT NOT NULL,
+    probability REAL,
+    xmin REAL, ymin REAL, xmax REAL, ymax REAL,
+    img_xmin REAL, img_ymin REAL, img_xmax REAL, img_ymax REAL
+);
+CREATE INDEX IF NOT EXISTS shapes_file ON shapes(file_id);
+CREATE INDEX IF NOT EXISTS shapes_label ON shapes(label, probability);
+CREATE VIRTUAL TABLE IF NOT EXISTS shapes_rtree USING rtree(
+    id, xmin, xmax, ymin, ymax
+);
+'''
+
+# a row of query()
+Shape = collections.namedtuple(
+    'Shape', 'file idx label shape_type probability bbox img_bbox')
+
+
+def index_path(root):
+    return osp.splitext(manifest_path(root))[0] + '.sqlite'
+
+
+def _stamp(filename):
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def shape_rows(data):
+    '''
+    (idx, label, shape_type, probability, map bbox, image bbox) of the shapes
+    of data, a label file, all converted to image coordinates at once.
+    '''
+    shapes = [(i, s) for i, s in enumerate(data['shapes']) if s['points']]
+    if not shapes:
+        return []
+    counts = [len(s['points']) for i, s in shapes]
+    starts = np.cumsum(counts) - counts
+    points = np.array([p for i, s in shapes for p in s['points']],
+                      dtype=np.float64).reshape(-1, 2)
+    mins = np.minimum.reduceat(points, starts)
+    maxs = np.maximum.reduceat(points, starts)
+    geoTrans = data.get('geoTrans')
+    if geoTrans is not None:
+        pixels = map2img_array(geoTrans, points)
+        imgMins = np.minimum.reduceat(pixels, starts)
+        imgMaxs = np.maximum.reduceat(pixels, starts)
+    rows = []
+    for k, (i, s) in enumerate(shapes):
+        bbox = tuple(mins[k].tolist() + maxs[k].tolist())
+        if geoTrans is not None:
+            img_bbox = tuple(imgMins[k].tolist() + imgMaxs[k].tolist())
+        else:
+            img_bbox = (None,) * 4
+        rows.append((i, s['label'], s.get('shape_type') or 'polygon',
+                     s.get('probability'), bbox, img_bbox))
+    return rows
+
+
+class AnnotationIndex(object):
+    '''
+    the index of the label files under root. safe to use from several
+    threads, every call opens its own connection.
+    '''
+
+    def __init__(self, root, db=None):
+        self.root = root
+        self.db = db or index_path(root)
+        self._lock = threading.Lock()
+        os.makedirs(osp.dirname(self.db), exist_ok=True)
+        with self._connect() as conn:
+            # readers are not blocked while the index is updated
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db, timeout=30)
+        try:
+            with conn:  # commit, or roll back on error
+                yield conn
+        finally:
+            conn.close()
+
+    def _path(self, filename):
+        return osp.normcase(osp.abspath(filename))
+
+    def _index(self, conn, filename, stamp):
+        '''(re)index filename in conn, it is removed when it is gone.'''
+        path = self._path(filename)
+        row = conn.execute('SELECT id FROM files WHERE path = ?', (path,)).fetchone()
+        if row is not None:
+            conn.execute('DELETE FROM shapes_rtree WHERE id IN '
+                         '(SELECT id FROM shapes WHERE file_id = ?)', row)
+            conn.execute('DELETE FROM shapes WHERE file_id = ?', row)
+            conn.execute('DELETE FROM files WHERE id = ?', row)
+        if stamp is None:
+            return
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        fileId = conn.execute(
+            'INSERT INTO files (path, size, mtime_ns) VALUES (?, ?, ?)',
+            (path,) + tuple(stamp)).lastrowid
+        for idx, label, shape_type, probability, bbox, img_bbox in shape_rows(data):
+            shapeId = conn.execute(
+                'INSERT INTO shapes (file_id, idx, label, shape_type, probability, '
+                'xmin, ymin, xmax, ymax, img_xmin, img_ymin, img_xmax, img_ymax) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (fileId, idx, label, shape_type, probability) + bbox + img_bbox
+            ).lastrowid
+            conn.execute('INSERT INTO shapes_rtree VALUES (?, ?, ?, ?, ?)',
+                         (shapeId, bbox[0], bbox[2], bbox[1], bbox[3]))
+
+    def update(self, index=None):
+        '''
+        index the label files that changed since the last update, index is a
+        DirIndex of root, a new one is scanned if None. return the number of
+        label files indexed again or removed.
+        '''
+        if index is None:
+            index = DirIndex(self.root, extensions=('.json',))
+            index.update()
+        current = {}
+        for label_file in index.label_files(self.root):
+            current[self._path(label_file)] = (label_file, index.stamp(label_file))
+        under = osp.join(self._path(self.root), '')
+        with self._lock, self._connect() as conn:
+            known = dict((path, (size, mtime_ns)) for path, size, mtime_ns in
+                         conn.execute('SELECT path, size, mtime_ns FROM files'))
+            changed = [(filename, stamp) for path, (filename, stamp) in current.items()
+                       if known.get(path) != stamp]
+            changed.extend((path, None) for path in known
+                           if path not in current and path.startswith(under))
+            for filename, stamp in changed:
+                self._index(conn, filename, stamp)
+        return len(changed)
+
+    def updateFile(self, filename):
+        '''index filename again, e.g. once it is saved.'''
+        with self._lock, self._connect() as conn:
+            self._index(conn, filename, _stamp(filename))
+
+    def query(self, label=None, minProbability=None, bbox=None, limit=None):
+        '''
+        the Shape of the shapes with label, a probability above minProbability
+        and a map bounding box intersecting bbox, (xmin, ymin, xmax, ymax).
+        '''
+        sql = ('SELECT f.path, s.idx, s.label, s.shape_type, s.probability, '
+               's.xmin, s.ymin, s.xmax, s.ymax, '
+               's.img_xmin, s.img_ymin, s.img_xmax, s.img_ymax '
+               'FROM shapes s JOIN files f ON f.id = s.file_id')
+        where, args = [], []
+        if bbox is not None:
+            sql += ' JOIN shapes_rtree r ON r.id = s.id'
+            where.append('r.xmax >= ? AND r.xmin <= ? AND r.ymax >= ? AND r.ymin <= ?')
+            args.extend([bbox[0], bbox[2], bbox[1], bbox[3]])
+        if label is not None:
+            where.append('s.label = ?')
+            args.append(label)
+        if minProbability is not None:
+            where.append('s.probability > ?')
+            args.append(minProbability)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY f.path, s.idx'
+        if limit is not None:
+            sql += ' LIMIT %d' % limit
+        with self._connect() as conn:
+            return [Shape(r[0], r[1], r[2], r[3], r[4], tuple(r[5:9]), tuple(r[9:13]))
+                    for r in conn.execute(sql, args)]
+
+    def files(self, label=None, minProbability=None, bbox=None):
+        '''the label files with a shape matching query(), sorted.'''
+        return sorted(set(s.file for s in self.query(label, minProbability, bbox)))
+
+    def labels(self):
+        '''{label: number of shapes}'''
+        with self._connect() as conn:
+            return dict(conn.execute(
+                'SELECT label, COUNT(*) FROM shapes GROUP BY label ORDER BY label'))
+
+
+def parse_query(text):
+    '''
+    the query() arguments of a search text like 'label:ship prob>8
+    bbox:x0,y0,x1,y1', None when text is not a query.
+    '''
+    query = {}
+    for token in text.split():
+        key, sep, value = token.partition(':')
+        if sep and key == 'label' and value:
+            query['label'] = value
+            continue
+        if sep and key == 'bbox':
+            try:
+                bbox = tuple(float(v) for v in value.split(','))
+            except ValueError:
+                return None
+            if len(bbox) != 4:
+                return None
+            query['bbox'] = bbox
+            continue
+        key, sep, value = token.partition('>')
+        if sep and key in ('prob', 'probability'):
+            try:
+                query['minProbability'] = float(value)
+            except ValueError:
+                return None
+            continue
+        return None
+    return query or None
+
+
+_indexes = {}
+_indexesLock = threading.Lock()
+
+
+def annotation_index(root):
+    '''the index of root shared by the plugin.'''
+    key = osp.normcase(osp.abspath(root))
+    with _indexesLock:
+        if key not in _indexes:
+            _indexes[key] = AnnotationIndex(root)
+        return _indexes[key]
@@ -0,0 +1,357 @@
+'''
+a columnar copy of every shape of a project, one row per shape, for the
+statistics over a whole project (shapes per class, areas, probabilities)
+without reading every label file.
+
+the columns are numpy arrays saved as .npy files in <root>/.labelme_annotations
+and memory-mapped when read, the strings (file, label, shape_type) are
+stored as int32 codes into lists kept in meta.json. the vertices are a list
+column laid out like an Arrow list: the (m, 2) vertices of every shape one
+after the other and vertex_offsets, the n + 1 offsets of the shapes in them.
+to_arrow() and to_pandas() wrap the columns without copying the numbers,
+write_parquet() needs pyarrow.
+
+update() only reads the label files whose size or mtime changed, the rows of
+the files that were removed are dropped.
+
+    python -m labelme.annotation_store project_dir [--parquet out.parquet]
+'''
+
+import argparse
+import collections
+import json
+import math
+import os
+import os.path as osp
+
+import numpy as np
+
+from .dir_index import DirIndex
+
+
+STORE_DIR = '.labelme_annotations'
+STORE_VERSION = 1
+
+# column -> dtype, the rows of every column are the shapes
+COLUMNS = collections.OrderedDict([
+    ('file', np.int32),
+    ('label', np.int32),
+    ('shape_type', np.int32),
+    ('probability', np.float64),
+    ('bbox', np.float64),        # (n, 4) xmin, ymin, xmax, ymax
+    ('area', np.float64),
+    ('n_vertices', np.int32),
+])
+# the list column of the vertices
+LIST_COLUMNS = collections.OrderedDict([
+    ('vertex_offsets', np.int64),  # n + 1
+    ('vertices', np.float64),      # (m, 2)
+])
+
+
+def _empty(name, dtype):
+    if name == 'bbox':
+        return np.zeros((0, 4), dtype)
+    if name == 'vertices':
+        return np.zeros((0, 2), dtype)
+    return np.zeros(0, dtype)
+
+
+def shape_columns(shapes):
+    '''
+    the columns of shapes, the shape dicts of label files, except the codes:
+    probability, bbox, area, n_vertices, vertex_offsets and vertices. the
+    bboxes and areas of all the shapes are computed at once.
+    '''
+    n = len(shapes)
+    counts = np.array([len(s['points']) for s in shapes], dtype=np.int32)
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    vertices = np.array([p for s in shapes for p in s['points']],
+                        dtype=np.float64).reshape(-1, 2)
+    probability = np.array(
+        [s.get('probability') if s.get('probability') is not None else np.nan
+         for s in shapes], dtype=np.float64)
+    bbox = np.full((n, 4), np.nan)
+    area = np.zeros(n)
+    full = counts > 0
+    if full.any():
+        starts = offsets[:-1][full]
+        bbox[full, :2] = np.minimum.reduceat(vertices, starts)
+        bbox[full, 2:] = np.maximum.reduceat(vertices, starts)
+        # shoelace over the rings, the last vertex of a shape goes to its first
+        nxt = np.arange(1, len(vertices) + 1)
+        nxt[offsets[1:][full] - 1] = starts
+        x, y = vertices[:, 0], vertices[:, 1]
+        cross = x * y[nxt] - x[nxt] * y
+        area[full] = np.abs(np.add.reduceat(cross, starts)) / 2
+    types = [s.get('shape_type') or 'polygon' for s in shapes]
+    for i, shape_type in enumerate(types):
+        if shape_type == 'rectangle' and counts[i] == 2:
+            area[i] = (bbox[i, 2] - bbox[i, 0]) * (bbox[i, 3] - bbox[i, 1])
+        elif shape_type == 'circle' and counts[i] == 2:
+            (cx, cy), (px, py) = vertices[offsets[i]:offsets[i] + 2]
+            area[i] = math.pi * ((cx - px) ** 2 + (cy - py) ** 2)
+        elif shape_type not in ('polygon', 'slantRectangle'):
+            area[i] = 0
+    return {
+        'probability': probability,
+        'bbox': bbox,
+        'area': area,
+        'n_vertices': counts,
+        'vertex_offsets': offsets,
+        'vertices': vertices,
+    }
+
+
+def _compact(columns, name, values):
+    used = np.unique(columns[name])
+    if len(used) == len(values):
+        return values
+    remap = np.full(len(values), -1, np.int32)
+    remap[used] = np.arange(len(used), dtype=np.int32)
+    columns[name] = remap[columns[name]]
+    return [values[i] for i in used]
+
+
+class AnnotationStore(object):
+    '''the columns of the shapes of the label files under root.'''
+
+    def __init__(self, root, path=None):
+        self.root = root
+        self.path = path or osp.join(root, STORE_DIR)
+        self.meta = {'version': STORE_VERSION, 'files': [], 'labels': [],
+                     'shape_types': [], 'stamps': {}, 'rows': {}}
+        self._columns = {}
+        try:
+            with open(osp.join(self.path, 'meta.json')) as f:
+                meta = json.load(f)
+            if meta.get('version') == STORE_VERSION:
+                self.meta = meta
+        except (OSError, ValueError):
+            pass
+
+    def __len__(self):
+        return len(self.column('label'))
+
+    def column(self, name):
+        '''column name as a read-only memory-mapped array.'''
+        if name not in self._columns:
+            dtype = COLUMNS.get(name) or LIST_COLUMNS[name]
+            filename = osp.join(self.path, name + '.npy')
+            if osp.exists(filename) and self.meta['files']:
+                try:
+                    self._columns[name] = np.load(filename, mmap_mode='r')
+                except ValueError:  # an empty column on older numpy
+                    self._columns[name] = np.load(filename)
+            elif name == 'vertex_offsets':
+                self._columns[name] = np.zeros(1, dtype)
+            else:
+                self._columns[name] = _empty(name, dtype)
+        return self._columns[name]
+
+    def files(self):
+        return self.meta['files']
+
+    def labels(self):
+        return self.meta['labels']
+
+    def shape_types(self):
+        return self.meta['shape_types']
+
+    def vertices(self, row):
+        '''the (k, 2) vertices of the shape of row.'''
+        offsets = self.column('vertex_offsets')
+        return self.column('vertices')[offsets[row]:offsets[row + 1]]
+
+    def update(self, index=None):
+        '''
+        read the label files that changed since the last update, index is a
+        DirIndex of root, a new one is scanned if None. return (added,
+        removed, modified), the relative paths of the label files.
+        '''
+        if index is None:
+            index = DirIndex(self.root, extensions=('.json',))
+            index.update()
+        stamps = self.meta['stamps']
+        current = {}
+        for label_file in index.label_files(self.root):
+            rel = osp.relpath(label_file, self.root)
+            current[rel] = (label_file, list(index.stamp(label_file) or ()))
+        added = sorted(rel for rel in current if rel not in stamps)
+        removed = sorted(rel for rel in stamps if rel not in current)
+        modified = sorted(rel for rel in current
+                          if rel in stamps and stamps[rel] != current[rel][1])
+        if not (added or removed or modified) and osp.exists(self.path):
+            return added, removed, modified
+
+        # the rows kept, file by file in the order of the files
+        old = dict((name, self.column(name)) for name in
+                   list(COLUMNS) + list(LIST_COLUMNS))
+        oldFiles = self.meta['files']
+        changed = set(modified)
+        keep = [rel for rel in oldFiles
+                if rel in current and rel not in changed and rel in self.meta['rows']]
+        parts = collections.defaultdict(list)
+        for rel in keep:
+            start, stop = self.meta['rows'][rel]
+            for name in COLUMNS:
+                parts[name].append(old[name][start:stop])
+            offsets = old['vertex_offsets']
+            parts['vertices'].append(old['vertices'][offsets[start]:offsets[stop]])
+        # the codes of the kept rows still index the old lists, they are
+        # kept and the new strings appended
+        labels = list(self.meta['labels'])
+        shape_types = list(self.meta['shape_types'])
+        labelCodes = dict((l, i) for i, l in enumerate(labels))
+        typeCodes = dict((t, i) for i, t in enumerate(shape_types))
+        files = keep + sorted(set(added) | set(modified))
+        fileCodes = dict((rel, i) for i, rel in enumerate(files))
+        if keep:
+            remap = np.array([fileCodes.get(rel, -1) for rel in oldFiles], np.int32)
+            parts['file'] = [remap[np.asarray(p)] for p in parts['file']]
+
+        shapes = []
+        shapeFiles = []
+        rows = dict((rel, len(p)) for rel, p in zip(keep, parts['label']))
+        for rel in files[len(keep):]:
+            try:
+                with open(current[rel][0]) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {'shapes': []}
+            shapes.extend(data['shapes'])
+            shapeFiles.extend([fileCodes[rel]] * len(data['shapes']))
+            rows[rel] = len(data['shapes'])
+        new = shape_columns(shapes)
+        for s in shapes:
+            label = s['label']
+            if label not in labelCodes:
+                labelCodes[label] = len(labels)
+                labels.append(label)
+            shape_type = s.get('shape_type') or 'polygon'
+            if shape_type not in typeCodes:
+                typeCodes[shape_type] = len(shape_types)
+                shape_types.append(shape_type)
+        new['file'] = np.array(shapeFiles, dtype=np.int32)
+        new['label'] = np.array([labelCodes[s['label']] for s in shapes], np.int32)
+        new['shape_type'] = np.array(
+            [typeCodes[s.get('shape_type') or 'polygon'] for s in shapes], np.int32)
+
+        columns = {}
+        for name, dtype in COLUMNS.items():
+            columns[name] = np.concatenate(
+                [np.asarray(p) for p in parts[name]] + [new[name]]).astype(dtype)
+        columns['vertices'] = np.concatenate(
+            [np.asarray(p) for p in parts['vertices']] + [new['vertices']])
+        columns['vertex_offsets'] = np.zeros(len(columns['label']) + 1, np.int64)
+        np.cumsum(columns['n_vertices'], out=columns['vertex_offsets'][1:])
+        # drop the strings no row uses any more
+        labels = _compact(columns, 'label', labels)
+        shape_types = _compact(columns, 'shape_type', shape_types)
+
+        start = 0
+        rowRanges = {}
+        for rel in files:
+            rowRanges[rel] = [start, start + rows[rel]]
+            start += rows[rel]
+        # the old columns are memory-mapped, they must be closed before their
+        # files are replaced
+        self._columns = {}
+        old = parts = None
+        self._save(columns, {
+            'version': STORE_VERSION,
+            'files': files,
+            'labels': labels,
+            'shape_types': shape_types,
+            'stamps': dict((rel, current[rel][1]) for rel in files),
+            'rows': rowRanges,
+        })
+        return added, removed, modified
+
+    def _save(self, columns, meta):
+        os.makedirs(self.path, exist_ok=True)
+        # the columns first, meta.json last: a store whose meta does not
+        # match its columns is rebuilt
+        for name, array in columns.items():
+            tmp = osp.join(self.path, name + '.tmp.npy')
+            np.save(tmp, array)
+            os.replace(tmp, osp.join(self.path, name + '.npy'))
+        tmp = osp.join(self.path, 'meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, osp.join(self.path, 'meta.json'))
+        self.meta = meta
+
+    def to_arrow(self):
+        '''the shapes as a pyarrow Table, the strings as dictionary columns.'''
+        import pyarrow as pa
+
+        def dictionary(name, values):
+            return pa.DictionaryArray.from_arrays(
+                pa.array(np.asarray(self.column(name))), pa.array(values))
+
+        bbox = np.asarray(self.column('bbox'))
+        vertices = np.ascontiguousarray(self.column('vertices')).reshape(-1)
+        points = pa.FixedSizeListArray.from_arrays(pa.array(vertices), 2)
+        columns = collections.OrderedDict([
+            ('file', dictionary('file', self.files())),
+            ('label', dictionary('label', self.labels())),
+            ('shape_type', dictionary('shape_type', self.shape_types())),
+            ('probability', pa.array(np.asarray(self.column('probability')))),
+            ('xmin', pa.array(bbox[:, 0])),
+            ('ymin', pa.array(bbox[:, 1])),
+            ('xmax', pa.array(bbox[:, 2])),
+            ('ymax', pa.array(bbox[:, 3])),
+            ('area', pa.array(np.asarray(self.column('area')))),
+            ('n_vertices', pa.array(np.asarray(self.column('n_vertices')))),
+            ('vertices', pa.ListArray.from_arrays(
+                pa.array(np.asarray(self.column('vertex_offsets'))), points)),
+        ])
+        return pa.Table.from_arrays(list(columns.values()), names=list(columns))
+
+    def to_pandas(self):
+        '''the shapes as a DataFrame without the vertices, see vertices().'''
+        import pandas as pd
+        bbox = self.column('bbox')
+        return pd.DataFrame(collections.OrderedDict([
+            ('file', pd.Categorical.from_codes(self.column('file'), self.files())),
+            ('label', pd.Categorical.from_codes(self.column('label'), self.labels())),
+            ('shape_type', pd.Categorical.from_codes(
+                self.column('shape_type'), self.shape_types())),
+            ('probability', self.column('probability')),
+            ('xmin', bbox[:, 0]),
+            ('ymin', bbox[:, 1]),
+            ('xmax', bbox[:, 2]),
+            ('ymax', bbox[:, 3]),
+            ('area', self.column('area')),
+            ('n_vertices', self.column('n_vertices')),
+        ]), copy=False)
+
+    def write_parquet(self, filename):
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(), filename)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='rslabel-annotations',
+        description='update the columnar store of the shapes of a project and '
+                    'print the shapes per class')
+    parser.add_argument('root', help='project dir with labelme json files')
+    parser.add_argument('--parquet', help='also write the shapes to this parquet file')
+    args = parser.parse_args()
+
+    store = AnnotationStore(args.root)
+    added, removed, modified = store.update()
+    print('{} added, {} removed, {} modified label files'.format(
+        len(added), len(removed), len(modified)))
+    counts = np.bincount(store.column('label'), minlength=len(store.labels()))
+    for label, count in zip(store.labels(), counts):
+        print('{}\t{}'.format(label, count))
+    if args.parquet:
+        store.write_parquet(args.parquet)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+'''
+index of the images and label files under a directory.
+
+the directory tree is read with os.scandir and remembered in a manifest (the
+files of every directory with their size and mtime, and the mtime of the
+directory itself). on the next update only the directories whose mtime has
+changed are listed again, the files of the others are taken from the manifest
+and only stat'ed, to catch the ones rewritten in place. the file
+list, the search box and the exporters all read the same index.
+
+the manifest of the indexes shared with dir_index() is kept under
+~/.labelme_index, so that read-only datasets can be indexed too.
+'''
+
+import hashlib
+import json
+import os
+import os.path as osp
+import threading
+
+from . import logger
+
+
+# raster formats of the file list and of the exporters, and the label files
+INDEX_EXTS = ('.img', '.tif', '.tiff', '.png', '.jpg', '.ecw', '.gta', '.pix',
+              '.env', '.tga', '.json')
+
+MANIFEST_DIR = osp.join(osp.expanduser('~'), '.labelme_index')
+MANIFEST_VERSION = 1
+
+
+def manifest_path(root):
+    key = osp.normcase(osp.abspath(root)).encode('utf-8')
+    return osp.join(MANIFEST_DIR, hashlib.sha1(key).hexdigest() + '.json')
+
+
+def _ext(name):
+    return osp.splitext(name)[1].lower()
+
+
+class DirIndex(object):
+    '''
+    the files under root whose extension is in extensions. hidden files and
+    directories (starting with a dot) and symlinked directories are skipped.
+    the index is kept in memory only when manifest is None. safe to use from
+    several threads.
+    '''
+
+    def __init__(self, root, extensions=INDEX_EXTS, manifest=None):
+        self.root = root
+        self.extensions = tuple(e.lower() for e in extensions)
+        self.manifest = manifest
+        # relative dir -> {'mtime_ns': int, 'dirs': [names],
+        #                  'files': {name: [size, mtime_ns]}}
+        self._dirs = {}
+        self._sorted = {}
+        self._lock = threading.RLock()
+        if manifest is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.manifest) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') == MANIFEST_VERSION and \
+                data.get('extensions') == list(self.extensions):
+            self._dirs = data['dirs']
+
+    def save(self):
+        with self._lock:
+            if self.manifest is None:
+                return
+            data = {
+                'version': MANIFEST_VERSION,
+                'root': osp.abspath(self.root),
+                'extensions': list(self.extensions),
+                'dirs': self._dirs,
+            }
+            tmp = self.manifest + '.tmp'
+            try:
+                os.makedirs(osp.dirname(self.manifest), exist_ok=True)
+                with open(tmp, 'w') as f:
+                    json.dump(data, f)
+                os.replace(tmp, self.manifest)
+            except OSError as e:
+                logger.warn('Failed to write {}: {}'.format(self.manifest, e))
+
+    def _list(self, full):
+        files = {}
+        dirs = []
+        with os.scandir(full) as it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                elif _ext(entry.name) in self.extensions:
+                    st = entry.stat()
+                    files[entry.name] = [st.st_size, st.st_mtime_ns]
+        return sorted(dirs), files
+
+    def update(self):
+        '''
+        bring the index up to date with the disk. return (added, removed,
+        modified), the paths of the files that changed since the last update.
+        '''
+        with self._lock:
+            added, removed, modified = [], [], []
+            dirs = {}
+            stack = ['']
+            while stack:
+                rel = stack.pop()
+                full = osp.join(self.root, rel)
+                try:
+                    mtime_ns = os.stat(full).st_mtime_ns
+                    old = self._dirs.get(rel)
+                    if old is not None and old['mtime_ns'] == mtime_ns:
+                        # a file rewritten in place keeps the mtime of its
+                        # directory, the known files are stat'ed again
+                        files = {}
+                        for name, stamp in old['files'].items():
+                            path = osp.join(full, name)
+                            try:
+                                st = os.stat(path)
+                            except OSError:
+                                removed.append(path)
+                                continue
+                            files[name] = [st.st_size, st.st_mtime_ns]
+                            if files[name] != stamp:
+                                modified.append(path)
+                        entry = {'mtime_ns': mtime_ns, 'dirs': old['dirs'],
+                                 'files': files}
+                    else:
+                        subdirs, files = self._list(full)
+                        entry = {'mtime_ns': mtime_ns, 'dirs': subdirs, 'files': files}
+                        oldFiles = old['files'] if old is not None else {}
+                        for name, stamp in files.items():
+                            if name not in oldFiles:
+                                added.append(osp.join(full, name))
+                            elif oldFiles[name] != stamp:
+                                modified.append(osp.join(full, name))
+                        removed.extend(osp.join(full, name)
+                                       for name in oldFiles if name not in files)
+                except OSError:
+                    continue
+                dirs[rel] = entry
+                stack.extend(osp.join(rel, d) for d in entry['dirs'])
+            for rel, entry in self._dirs.items():
+                if rel not in dirs:
+                    removed.extend(osp.join(self.root, rel, name)
+                                   for name in entry['files'])
+            changed = added or removed or modified or dirs.keys() != self._dirs.keys()
+            self._dirs = dirs
+            self._sorted = {}
+            if changed or (self.manifest is not None and not osp.exists(self.manifest)):
+                self.save()
+            return added, removed, modified
+
+    def refresh(self, filename):
+        '''update the entry of one file, e.g. a label file that was just saved.'''
+        with self._lock:
+            rel = osp.relpath(osp.dirname(osp.abspath(filename)), osp.abspath(self.root))
+            if rel == '.':
+                rel = ''
+            entry = self._dirs.get(rel)
+            if entry is None or rel.startswith('..'):
+                return
+            name = osp.basename(filename)
+            try:
+                st = os.stat(filename)
+            except OSError:
+                entry['files'].pop(name, None)
+            else:
+                if _ext(name) in self.extensions:
+                    entry['files'][name] = [st.st_size, st.st_mtime_ns]
+            self._sorted = {}
+
+    def stamp(self, filename):
+        '''(size, mtime_ns) of filename as last seen, None if it is not indexed.'''
+        with self._lock:
+            rel = osp.relpath(osp.dirname(osp.abspath(filename)), osp.abspath(self.root))
+            entry = self._dirs.get('' if rel == '.' else rel)
+            if entry is None:
+                return None
+            stamp = entry['files'].get(osp.basename(filename))
+            return tuple(stamp) if stamp is not None else None
+
+    def files(self, extensions=None, under=None):
+        '''
+        the indexed files with one of extensions (all when None), optionally
+        only those under the directory under, sorted by path.
+        '''
+        with self._lock:
+            key = (tuple(extensions) if extensions is not None else None, under)
+            if key not in self._sorted:
+                exts = tuple(e.lower() for e in extensions) if extensions else None
+                prefix = None
+                if under is not None:
+                    prefix = osp.relpath(osp.abspath(under), osp.abspath(self.root))
+                    prefix = '' if prefix == '.' else prefix
+                paths = []
+                for rel, entry in self._dirs.items():
+                    if prefix and rel != prefix and \
+                            not rel.startswith(prefix + os.sep):
+                        continue
+                    full = osp.join(self.root, rel)
+                    paths.extend(osp.join(full, name) for name in entry['files']
+                                 if exts is None or _ext(name) in exts)
+                paths.sort()
+                self._sorted[key] = paths
+            return self._sorted[key]
+
+    def images(self, extensions=None):
+        exts = extensions or [e for e in self.extensions if e != '.json']
+        return self.files(exts)
+
+    def label_files(self, under=None):
+        return self.files(('.json',), under)
+
+    def dirs(self):
+        '''the relative path of every indexed directory, the root is ''.'''
+        with self._lock:
+            return sorted(self._dirs)
+
+
+_indexes = {}
+_indexesLock = threading.Lock()
+
+
+def dir_index(root):
+    '''the index of root shared by the plugin and the exporters, with a manifest.'''
+    key = osp.normcase(osp.abspath(root))
+    with _indexesLock:
+        if key not in _indexes:
+            _indexes[key] = DirIndex(root, manifest=manifest_path(root))
+        return _indexes[key]
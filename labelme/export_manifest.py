@@ -0,0 +1,191 @@
+'''
+the record of an export, kept in <outDir>/export_manifest.json, so that the
+next export into the same directory only redoes what changed.
+
+every source label file is a scene with the stamp of its label file (size,
+mtime and sha1, a file saved again without changes keeps its scene) and of
+its raster (size and mtime only, rasters are too big to hash), the labels
+it uses and the outputs it produced, relative to outDir: the tiles it was
+split to and the dataset files made from them. a scene is 'split' once its
+tiles are written and 'done' once its dataset files are, the manifest is
+saved as the scenes go (at most every saveInterval seconds) so that a
+cancelled or crashed export resumes where it stopped.
+'''
+
+import hashlib
+import json
+import os
+import os.path as osp
+import shutil
+import threading
+import time
+
+from . import logger
+
+
+MANIFEST_NAME = 'export_manifest.json'
+MANIFEST_VERSION = 1
+
+
+def file_sha1(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _stat(filename):
+    if filename is None:
+        return None
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class ExportManifest(object):
+    '''
+    the scenes of an export by key, the path of their label file relative to
+    the input dir. safe to update from the tile writer thread.
+    '''
+
+    saveInterval = 1.0
+
+    def __init__(self, outDir):
+        self.outDir = outDir
+        self.path = osp.join(outDir, MANIFEST_NAME)
+        self.params = None
+        self.classes = None
+        self.scenes = {}
+        self._lock = threading.RLock()
+        self._saved = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version') != MANIFEST_VERSION:
+            return
+        self.params = data['params']
+        self.classes = data['classes']
+        self.scenes = data['scenes']
+
+    def save(self):
+        with self._lock:
+            data = {
+                'version': MANIFEST_VERSION,
+                'params': self.params,
+                'classes': self.classes,
+                'scenes': self.scenes,
+            }
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+            self._saved = time.time()
+
+    def _autosave(self):
+        if time.time() - self._saved >= self.saveInterval:
+            self.save()
+
+    def stamp(self, label_file, img_file, key=None):
+        '''
+        the stamp of a scene. the sha1 of the label file is only computed when
+        its size or mtime differ from the ones of the scene key.
+        '''
+        label = _stat(label_file)
+        old = self.scenes.get(key, {}).get('stamp') if key is not None else None
+        if old is not None and old['label'][:2] == label:
+            sha1 = old['label'][2]
+        else:
+            sha1 = file_sha1(label_file)
+        return {'label': label + [sha1], 'image': _stat(img_file)}
+
+    def isCurrent(self, key, stamp, stage='done'):
+        '''whether scene key went through stage with the same files.'''
+        entry = self.scenes.get(key)
+        if entry is None or entry['stamp']['image'] != stamp['image'] or \
+                entry['stamp']['label'][2] != stamp['label'][2]:
+            return False
+        if entry['stamp'] != stamp:
+            entry['stamp'] = stamp  # touched only
+        return entry['stage'] == 'done' or entry['stage'] == stage
+
+    def reset(self, params):
+        '''forget every scene and delete its outputs, for new export parameters.'''
+        with self._lock:
+            for key in list(self.scenes):
+                self.remove(key)
+            self.params = params
+            self.classes = None
+
+    def begin(self, key, stamp, stale=()):
+        '''
+        start scene key over, its previous outputs are deleted, as well as the
+        stale paths, what an interrupted run may have left without recording.
+        '''
+        with self._lock:
+            if key in self.scenes:
+                self.remove(key)
+            self._delete(self._relative(p) for p in stale)
+            self.scenes[key] = {'stamp': stamp, 'stage': 'started', 'labels': [],
+                                'tiles': [], 'outputs': []}
+
+    def remove(self, key):
+        '''delete the outputs of scene key and forget it.'''
+        with self._lock:
+            entry = self.scenes.pop(key)
+            self._delete(entry['tiles'] + entry['outputs'])
+
+    def rewind(self, key):
+        '''delete the dataset files of scene key, its tiles are kept.'''
+        with self._lock:
+            entry = self.scenes[key]
+            self._delete(entry['outputs'])
+            entry['outputs'] = []
+            entry['stage'] = 'split'
+
+    def split(self, key, labels, tiles):
+        '''scene key, with labels, is split to the tiles paths and ready to export.'''
+        with self._lock:
+            entry = self.scenes[key]
+            entry['labels'] = sorted(labels)
+            entry['tiles'] = [self._relative(p) for p in tiles]
+            entry['stage'] = 'split'
+            self._autosave()
+
+    def record(self, key, path):
+        '''path is an output of scene key.'''
+        with self._lock:
+            self.scenes[key]['outputs'].append(self._relative(path))
+
+    def done(self, key):
+        with self._lock:
+            self.scenes[key]['stage'] = 'done'
+            self._autosave()
+
+    def labels(self):
+        '''every label of the scenes.'''
+        labels = set()
+        for entry in self.scenes.values():
+            labels.update(entry['labels'])
+        return labels
+
+    def _relative(self, path):
+        return osp.relpath(osp.abspath(path), osp.abspath(self.outDir))
+
+    def _delete(self, paths):
+        for path in paths:
+            path = osp.join(self.outDir, path)
+            try:
+                if osp.isdir(path) and not osp.islink(path):
+                    shutil.rmtree(path)
+                elif osp.lexists(path):
+                    os.remove(path)
+            except OSError as e:
+                logger.warn('Failed to remove {}: {}'.format(path, e))
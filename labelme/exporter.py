@@ -0,0 +1,841 @@
+# -*- coding:utf-8 -*-
+# !/usr/bin/env python
+'''
+export a folder of labelme json files as a VOC or COCO dataset, optionally
+split to tiles first. the RSLabel plugin and the command line both run the
+ExportEngine, it needs neither Qt nor the RSLabel host:
+
+    python -m labelme.exporter --format coco --tile 1024 --workers 8 in_dir out_dir
+'''
+
+import argparse
+import collections
+import functools
+import json
+import os
+import os.path as osp
+import queue
+import shutil
+import sys
+import threading
+
+import lxml.builder
+import lxml.etree
+import numpy as np
+import PIL.Image
+import PIL.ImageDraw
+import PIL.ImageFont
+
+try:
+    from osgeo import gdal
+except ImportError:
+    import gdal
+
+from .dir_index import DirIndex
+from .dir_index import dir_index
+from .export_manifest import MANIFEST_NAME
+from .export_manifest import ExportManifest
+from .labelme2COCO import labelme2coco
+from .labelme2COCO import map2img_array
+from .labelme2COCO import tile_geotransform
+from .materialize import MODES as LINK_MODES
+from .materialize import materialize
+from .raster_stats import stats_cache
+from .tiling import Sampling
+from .tiling import TilingEngine
+from .tiling import find_image
+from .tiling import my_basename
+from .tiling import my_splitext
+from .trace import span
+from .trace import start_trace
+from .utils import lblsave
+from .utils.draw import label_colormap
+from .utils.shape import min_area_rects
+from .utils.shape import rasterize_shapes
+from .vector_export import VectorExporter
+
+
+########################################################################################################
+#                                          Utils
+########################################################################################################
+
+def scan_label_files(dir, index=None):
+    '''
+    all the labelme json files under dir, sorted so that every run sees the
+    same order. index is a DirIndex holding dir, a new one is scanned if None.
+    '''
+    if index is None:
+        index = DirIndex(dir, extensions=('.json',))
+        index.update()
+    return index.label_files(dir)
+
+
+def collect_labels(label_files):
+    labels = set()
+    for label_file in label_files:
+        with open(label_file) as f:
+            data = json.load(f)  #data is json file's content
+            for s in data['shapes']:
+                labels.add(s['label'])
+    return labels
+
+
+def childDir(dir):
+    dirs = []
+    files = os.listdir(dir)
+    for f in files:
+        fullPathName = osp.join(dir,f)
+        if osp.isdir(fullPathName):
+            dirs.append(f)
+    return sorted(dirs)
+
+
+########################################################################################################
+#                                          GDAL
+########################################################################################################
+
+# creation options of the tiles, per GDAL driver
+TILE_CREATION_OPTIONS = {
+    'GTiff': ['COMPRESS=DEFLATE', 'TILED=YES'],
+}
+
+# geotransform GDAL returns for a raster without one
+NO_GEOTRANSFORM = (0.0, 1.0, 0.0, 0.0, 0.0, 1.0)
+
+
+class _StripReader(object):
+    '''
+    read rows of a raster top down in whole block rows. the rows read for a
+    column span are kept, so that the next windows over the same span, or a
+    span inside it, only read the block rows below them. a span reaching
+    outside of it starts a new strip.
+    '''
+
+    def __init__(self, ds):
+        self.ds = ds
+        self.blockHeight = ds.GetRasterBand(1).GetBlockSize()[1]
+        self.y0 = self.y1 = 0
+        self.x0 = self.x1 = None
+        self.data = None
+
+    def read(self, x0, y0, x1, y1):
+        '''the pixels of [x0, x1) x [y0, y1) as a (bands, rows, cols) array.'''
+        if self.x0 is None or x0 < self.x0 or x1 > self.x1 or \
+                y0 < self.y0 or y0 > self.y1:
+            self.x0, self.x1 = x0, x1
+            self.y0 = self.y1 = y0 // self.blockHeight * self.blockHeight
+            self.data = None
+        if y1 > self.y1:
+            end = -(-y1 // self.blockHeight) * self.blockHeight
+            end = min(end, self.ds.RasterYSize)
+            width = self.x1 - self.x0
+            rows = self.ds.ReadAsArray(self.x0, self.y1, width, end - self.y1)
+            rows = rows.reshape(-1, end - self.y1, width)
+            if self.data is None:
+                self.data = rows
+            else:
+                self.data = np.concatenate([self.data, rows], axis=1)
+            self.y1 = end
+        # forget the rows above the window
+        self.data = self.data[:, y0 - self.y0:]
+        self.y0 = y0
+        return self.data[:, :y1 - y0, x0 - self.x0:x1 - self.x0]
+
+
+def gdal_tiles(img_file, outDir, windows, maxStripBytes=256 << 20, metadata=None,
+               cancelled=None):
+    '''
+    write the windows of img_file to outDir as <base>_<window.name>.<ext>, with
+    the driver of the source raster (compressed for GeoTIFF) and the
+    geotransform of the tile. the windows on the same rows are read at once
+    over their columns, in whole source blocks, unless the strip would take
+    more than maxStripBytes. the size of the tiles is stored in metadata, a
+    StatsCache, when given. cancelled() is polled before every tile, return
+    False when it stopped the scene. default tile writer of the ExportEngine.
+    '''
+    src_ds = gdal.Open(img_file)
+    base, ext = my_splitext(osp.basename(img_file))
+    driverName = src_ds.GetDriver().ShortName
+    driver = gdal.GetDriverByName(driverName)
+    options = TILE_CREATION_OPTIONS.get(driverName, [])
+    mem = gdal.GetDriverByName('MEM')
+    width = src_ds.RasterXSize
+    srcBands = [src_ds.GetRasterBand(i) for i in range(1, src_ds.RasterCount + 1)]
+    blockWidth = srcBands[0].GetBlockSize()[0]
+    pixelBytes = len(srcBands) * gdal.GetDataTypeSize(srcBands[0].DataType) // 8
+    geoTrans = tuple(src_ds.GetGeoTransform())
+    projection = src_ds.GetProjection()
+    rows = collections.OrderedDict()
+    for window in sorted(windows, key=lambda w: (w.y, w.x)):
+        rows.setdefault((window.y, window.height), []).append(window)
+    reader = _StripReader(src_ds)
+    infos = []
+    for (y0, ih), row in rows.items():
+        x0 = min(w.x for w in row) // blockWidth * blockWidth
+        x1 = min(-(-max(w.x + w.width for w in row) // blockWidth) * blockWidth, width)
+        if (x1 - x0) * ih * pixelBytes <= maxStripBytes:
+            strip = reader.read(x0, y0, x1, y0 + ih)
+        else:
+            strip = None
+        for window in row:
+            if cancelled is not None and cancelled():
+                return False
+            iw = window.width
+            if strip is not None:
+                data = strip[:, :, window.x - x0:window.x - x0 + iw]
+            else:
+                data = src_ds.ReadAsArray(window.x, y0, iw, ih).reshape(-1, ih, iw)
+            tile_ds = mem.Create('', iw, ih, len(srcBands), srcBands[0].DataType)
+            for i, band in enumerate(srcBands):
+                dst = tile_ds.GetRasterBand(i + 1)
+                dst.WriteArray(data[i])
+                nodata = band.GetNoDataValue()
+                if nodata is not None:
+                    dst.SetNoDataValue(nodata)
+            if geoTrans != NO_GEOTRANSFORM:
+                tile_ds.SetGeoTransform(tile_geotransform(geoTrans, window.x, y0))
+                tile_ds.SetProjection(projection)
+            dst_filename = osp.join(outDir, '{}_{}.{}'.format(base, window.name, ext))
+            driver.CreateCopy(dst_filename, tile_ds, options=options)
+            tile_ds = None
+            infos.append((dst_filename, (iw, ih, len(srcBands))))
+    src_ds = None
+    if metadata is not None and infos:
+        metadata.putInfo(infos)
+    return True
+
+
+def draw_instances_file(img_file, out_viz_file, bboxes, colors, captions):
+    '''
+    draw the boxes and captions over img_file and save it to out_viz_file. the
+    first three bands are stretched to 8 bit with their min and max values.
+    default instance drawer of the ExportEngine.
+    '''
+    src_ds = gdal.Open(img_file)
+    bands = [1, 2, 3] if src_ds.RasterCount >= 3 else [1, 1, 1]
+    channels = []
+    for bandIdx in bands:
+        arr = src_ds.GetRasterBand(bandIdx).ReadAsArray().astype(np.float64)
+        lo, hi = arr.min(), arr.max()
+        if hi > lo:
+            arr = (arr - lo) * 255.0 / (hi - lo)
+        channels.append(arr.astype(np.uint8))
+    src_ds = None
+    viz = PIL.Image.fromarray(np.dstack(channels), mode='RGB')
+    draw = PIL.ImageDraw.Draw(viz)
+    font = PIL.ImageFont.load_default()
+    for bbox, color, caption in zip(bboxes, colors, captions):
+        draw.rectangle(bbox, outline=tuple(color))
+        draw.text(bbox[:2], caption, fill=tuple(color), font=font)
+    viz.save(out_viz_file)
+
+
+########################################################################################################
+#                                         EXPORT
+########################################################################################################
+
+class ExportEngine(object):
+    '''
+    export the labelme json files under a folder as a VOC or COCO dataset, as
+    segmentation masks (format 'seg', tiled only): a palette PNG of the
+    class of every pixel next to each tile, <tile>_class.png, and with
+    instances a 16 bit PNG of the shape covering every pixel, <tile>_instance.png,
+    as YOLO boxes (format 'yolo'), as rotated boxes, DOTA or YOLO-OBB
+    (formats 'dota' and 'yolo_obb'), or as a vector layer of every shape for
+    GIS, a GeoPackage or shapefiles (formats 'gpkg' and 'shp', untiled only,
+    see VectorExporter).
+
+    with a tile size the scenes are first split to <outDir>/tiles by the
+    TilingEngine, on the grid or, with mode, on overlapping sliding windows
+    ('sliding', every tileSz - overlap pixels) or on chips centered on the
+    annotations ('chips'). tileWriter(img_file, outDir, windows, cancelled)
+    cuts the raster tiles of a scene on a writer thread, gdal_tiles by
+    default, and returns False when cancelled() stopped it.
+    the rasters are put in the dataset with link, one of LINK_MODES (see
+    materialize), and their size is read from metadata, a StatsCache.
+    instanceDrawer(img_file, out_viz_file, bboxes, colors, captions) draws the
+    VOC visualization of a tile, the plugin hands in the RSLabel host one, the
+    default uses PIL.
+    '''
+
+    formats = ('coco', 'voc', 'seg', 'yolo', 'dota', 'yolo_obb', 'gpkg', 'shp')
+    # formats whose outputs hold class ids, redone when the classes change
+    classFormats = ('voc', 'seg', 'yolo', 'yolo_obb')
+    # formats written by exportBoxes
+    boxFormats = ('yolo', 'dota', 'yolo_obb')
+    # formats written by exportVector, a single output rewritten every time
+    vectorFormats = ('gpkg', 'shp')
+
+    def __init__(self, outDir, format='coco', tileSz=None, workers=None,
+                 tileWriter=None, instanceDrawer=None, instances=False,
+                 mode='grid', overlap=0, link='copy', metadata=None):
+        if format not in self.formats:
+            raise ValueError('Unsupported export format: %s' % format)
+        if format == 'seg' and not tileSz:
+            raise ValueError('The segmentation export needs a tile size')
+        if format in self.vectorFormats and tileSz:
+            raise ValueError('The vector export is not tiled')
+        if link not in LINK_MODES:
+            raise ValueError('Unsupported link mode: %s' % link)
+        self.outDir = outDir
+        self.format = format
+        self.tileSz = tileSz
+        self.isTiled = bool(tileSz)
+        self.sampling = Sampling(tileSz, mode, overlap) if tileSz else None
+        self.workers = workers
+        self.link = link
+        self.metadata = metadata or stats_cache()
+        self.tileWriter = tileWriter or functools.partial(
+            gdal_tiles, metadata=self.metadata)
+        self.instanceDrawer = instanceDrawer or draw_instances_file
+        self.instances = instances
+        self.writeQueueSize = 2
+        self.labels = set()
+        self.index = None  # DirIndex of the files being exported
+        self.manifest = None
+        self._progress = None
+        self._cancelled = None
+        self._status = None
+
+    def progress(self, done, total):
+        if self._progress is not None:
+            self._progress(done, total)
+
+    def cancelled(self):
+        return self._cancelled is not None and self._cancelled()
+
+    def status(self, message):
+        if self._status is not None:
+            self._status(message)
+
+    def params(self):
+        '''the parameters an export directory is made with.'''
+        return {
+            'format': self.format,
+            'tileSz': self.tileSz,
+            'mode': self.sampling.mode if self.sampling else None,
+            'stride': self.sampling.stride if self.sampling else None,
+            'instances': self.instances,
+            'link': self.link,
+        }
+
+    def run(self, inDir, progress=None, cancelled=None, status=None):
+        '''
+        export the json files under inDir. progress(done, total) reports each
+        stage, cancelled() is polled and stops the export when it returns True,
+        status(message) receives what is being processed.
+
+        an export into a directory exported before with the same parameters
+        only redoes the scenes that changed since, see ExportManifest, the
+        outputs of the scenes that were removed are deleted.
+
+        return False if the export was cancelled.
+        '''
+        self._progress = progress
+        self._cancelled = cancelled
+        self._status = status
+        if self.format == 'voc':
+            for sub in ('JPEGImages', 'Annotations', 'AnnotationsVisualization'):
+                os.makedirs(osp.join(self.outDir, sub), exist_ok=True)
+        elif self.format == 'coco':
+            os.makedirs(osp.join(self.outDir, 'Annotations'), exist_ok=True)
+        elif self.format in self.boxFormats:
+            labelsDir = 'labelTxt' if self.format == 'dota' else 'labels'
+            for sub in ('images', labelsDir):
+                os.makedirs(osp.join(self.outDir, sub), exist_ok=True)
+        else:
+            os.makedirs(self.outDir, exist_ok=True)
+        if self.format in self.vectorFormats:
+            with span('export ' + self.format):
+                finished = self.exportVector(inDir)
+            if finished:
+                self.status('处理完毕')
+            return finished
+
+        self.manifest = ExportManifest(self.outDir)
+        if self.manifest.params != self.params():
+            self.manifest.reset(self.params())
+        self.status('正在检查修改的文件')
+        with span('export scan', dir=inDir):
+            index = dir_index(inDir)
+            index.update()
+            scenes = collections.OrderedDict()  # key -> label file
+            for label_file in scan_label_files(inDir, index):
+                key = osp.relpath(label_file, inDir)
+                img_file, _ = find_image(label_file)
+                stamp = self.manifest.stamp(label_file, img_file, key)
+                if not self.manifest.isCurrent(key, stamp, 'split'):
+                    # a cancelled split leaves tiles it did not record
+                    stale = [self.sceneTilesDir(label_file)] if self.isTiled else []
+                    self.manifest.begin(key, stamp, stale)
+                scenes[key] = label_file
+            for key in list(self.manifest.scenes):
+                if key not in scenes:
+                    self.manifest.remove(key)
+            self.manifest.save()
+        try:
+            return self.export(inDir, index, scenes)
+        finally:
+            self.manifest.save()
+
+    def export(self, inDir, index, scenes):
+        '''split and export the scenes of the manifest that are not done.'''
+        started = [key for key in scenes
+                   if self.manifest.scenes[key]['stage'] == 'started']
+
+        if self.isTiled:  #need to split to tiles
+            with span('export split', scenes=len(started)):
+                dir = self.split(inDir, [(key, scenes[key]) for key in started])
+            if dir is None:
+                return False
+        else:
+            for key in started:
+                self.manifest.split(key, collect_labels([scenes[key]]), [])
+            self.index = index
+            dir = inDir
+
+        self.labels = self.manifest.labels()
+        classes = sorted(self.labels)
+        if self.format in self.classFormats and self.manifest.classes != classes:
+            # the class ids of every scene change
+            for key, entry in self.manifest.scenes.items():
+                if entry['stage'] == 'done':
+                    self.manifest.rewind(key)
+        self.manifest.classes = classes
+        self.manifest.save()
+        todo = [(key, self.sceneFiles(dir, scenes[key])) for key in scenes
+                if self.manifest.scenes[key]['stage'] == 'split']
+
+        with span('export ' + self.format, scenes=len(todo)):
+            if self.format == 'voc':
+                finished = self.exportVOC(todo)
+            elif self.format == 'seg':
+                finished = self.exportSegmentation(todo)
+            elif self.format in self.boxFormats:
+                finished = self.exportBoxes(todo)
+            else:
+                finished = self.exportCOCO(todo)
+        if finished:
+            self.status('处理完毕')
+        return finished
+
+    def sceneTilesDir(self, label_file):
+        '''where the tiles of the scene of label_file are cut.'''
+        base = my_splitext(osp.basename(label_file))[0]
+        return osp.join(self.outDir, 'tiles', base)
+
+    def sceneFiles(self, dir, label_file):
+        '''the json files exported for the scene of label_file.'''
+        if not self.isTiled:
+            return [label_file]
+        base = my_splitext(osp.basename(label_file))[0]
+        return scan_label_files(osp.join(dir, base), self.index)
+
+    def split(self, inDir, scenes):
+        '''
+        split the (key, label file) scenes to tiles, return the tiles dir, None
+        if cancelled. the raster tiles of a scene are cut on a writer thread
+        while the next scenes are clipped, at most writeQueueSize scenes wait
+        for it.
+        '''
+        tilesDir = osp.join(self.outDir, 'tiles')
+        engine = TilingEngine(self.sampling, tilesDir, self.workers)
+        keys = dict((label_file, key) for key, label_file in scenes)
+        queued = queue.Queue(maxsize=self.writeQueueSize)
+        errors = []
+        # set once the split is cancelled, cancelled() is for the GUI thread
+        stop = threading.Event()
+
+        def write():
+            while True:
+                scene = queued.get()
+                if scene is None:
+                    return
+                if errors or stop.is_set():
+                    continue  # drain the queue
+                try:
+                    with span('export tiles', file=scene.img_file,
+                              tiles=len(scene.windows)):
+                        written = self.tileWriter(scene.img_file, scene.outDir,
+                                                  scene.windows, cancelled=stop.is_set)
+                    if written is not False:
+                        self.manifest.split(keys[scene.label_file], scene.labels,
+                                            [scene.outDir])
+                except Exception as e:
+                    errors.append(e)
+
+        def sceneDone(scene):
+            self.status('正在处理 %s' % scene.img_file)
+            if not scene.windows:
+                self.manifest.split(keys[scene.label_file], scene.labels,
+                                    [scene.outDir])
+                return
+            while True:
+                if errors:
+                    raise errors[0]
+                try:
+                    queued.put(scene, timeout=0.1)
+                    return
+                except queue.Full:
+                    if self.cancelled():
+                        return
+
+        # scenes without a raster have nothing to split
+        for key, label_file in scenes:
+            if find_image(label_file)[0] is None:
+                self.manifest.split(key, [], [])
+        writer = threading.Thread(target=write, name='tile-writer', daemon=True)
+        writer.start()
+        finished = False
+        try:
+            finished = engine.run([label_file for key, label_file in scenes],
+                                  self.progress, self.cancelled, sceneDone)
+        finally:
+            if not finished:
+                stop.set()  # the scenes left in the queue are not cut
+            queued.put(None)
+            writer.join()
+        if errors:
+            raise errors[0]
+        if not finished:
+            return None
+        # the tiles are written once, no manifest for them
+        self.index = DirIndex(tilesDir)
+        self.index.update()
+        return tilesDir
+
+    def exportScenes(self, scenes, exportScene):
+        '''
+        run exportScene(key, files) on the (key, files) scenes, it returns False
+        when it was cancelled. a scene is done in the manifest once it ran.
+        '''
+        for i, (key, files) in enumerate(scenes):
+            if self.cancelled() or exportScene(key, files) is False:
+                return False
+            self.manifest.done(key)
+            self.progress(i + 1, len(scenes))
+        return True
+
+    def exportCOCO(self, scenes):
+        if self.isTiled:
+            return self.exportScenes(scenes, self.exportTiledResultAsCOCO)
+        return self.exportScenes(scenes, self.exportNoTiledResultAsCOCO)
+
+    def exportNoTiledResultAsCOCO(self, key, jsons):
+        for json_file in jsons:
+            output_json = osp.join(self.outDir, '{}.json'.format(my_basename(json_file)))
+            labelme2coco([json_file], output_json)
+            self.manifest.record(key, output_json)
+            # copy the image file to the Annotations folder
+            img_file, _ = find_image(json_file)
+            if img_file is not None:
+                out_img_file = osp.join(
+                    self.outDir, 'Annotations', osp.basename(img_file))
+                materialize(img_file, out_img_file, self.link)
+                self.manifest.record(key, out_img_file)
+
+    def exportTiledResultAsCOCO(self, key, jsons):
+        child = my_splitext(osp.basename(key))[0]
+        output_json = osp.join(self.outDir, 'coco_{}.json'.format(child))
+        labelme2coco(jsons, output_json)
+        self.manifest.record(key, output_json)
+        #for every scene, we create a folder in Annotations
+        subFolder = osp.join(self.outDir, 'Annotations', child)
+        if(not osp.exists(subFolder)):
+            os.makedirs(subFolder)
+        self.manifest.record(key, subFolder)
+        # copy the tile images to the Annotations folder
+        for json_file in jsons:
+            if self.cancelled():
+                return False
+            img_file, _ = find_image(json_file)
+            if img_file is not None:
+                materialize(img_file, osp.join(subFolder, osp.basename(img_file)),
+                            self.link)
+
+    def exportVOC(self, scenes):
+        class_names = tuple(['_background_'] + sorted(self.labels))
+        out_class_names_file = osp.join(self.outDir, 'class_names.txt')
+        with open(out_class_names_file, 'w') as f:
+            f.writelines('\n'.join(class_names))
+        if(not self.isTiled):
+            readme = osp.join(
+                self.outDir, 'AnnotationsVisualization', 'readme.txt')
+            with open(readme,'w') as f:
+                f.write('未分块的输入文件不支持draw instance操作')
+
+        colormap = label_colormap(255)
+
+        def exportScene(key, jsons):
+            for label_file in jsons:
+                if self.cancelled():
+                    return False
+                self.exportVOCFile(key, label_file, class_names, colormap)
+
+        return self.exportScenes(scenes, exportScene)
+
+    def exportVOCFile(self, key, label_file, class_names, colormap):
+        with open(label_file) as f:
+            data = json.load(f)  #data is json file's content
+        #get geo trans parameters from json file
+        geoTrans = data['geoTrans']
+        #make dirs for voc
+        base = osp.splitext(osp.basename(label_file))[0]
+        out_img_file = osp.join(
+            self.outDir, 'JPEGImages', data['imagePath'])
+        out_xml_file = osp.join(
+            self.outDir, 'Annotations', base + '.xml')
+        out_viz_file = osp.join(
+            self.outDir, 'AnnotationsVisualization', base + '.tif')
+        # get the image file to copy to ...
+        img_file = osp.join(osp.dirname(label_file), data['imagePath'])
+        self.status('正在拷贝文件{}'.format(img_file))
+        width, height, depth = self.metadata.info(img_file)
+        materialize(img_file, out_img_file, self.link)
+        self.manifest.record(key, out_img_file)
+        maker = lxml.builder.ElementMaker()
+        xml = maker.annotation(
+            maker.folder('JPEGImages'),
+            maker.filename(data['imagePath']),
+            maker.path(out_img_file),
+            maker.source(maker.database('Unknown')),    # e.g., The VOC2007 Database
+            maker.size(
+                maker.height(str(height)),
+                maker.width(str(width)),
+                maker.depth(str(depth)),
+            ),
+            maker.segmented('0'),
+        )
+        bboxes = []
+        labels = []
+        shapes = [shape for shape in data['shapes'] if shape['shape_type']
+                  in ('rectangle', 'polygon', 'slantRectangle')]
+        #convert to image coordination here, all the shapes at once
+        counts = [len(shape['points']) for shape in shapes]
+        if shapes:
+            points = map2img_array(
+                geoTrans, [p for shape in shapes for p in shape['points']])
+            ends = np.cumsum(counts)
+        for i, shape in enumerate(shapes):
+            class_name = shape['label']
+            class_id = class_names.index(class_name)
+            pts = points[ends[i] - counts[i]:ends[i]]
+            xmin, ymin = pts.min(0).tolist()
+            xmax, ymax = pts.max(0).tolist()
+
+            bboxes.append((int(xmin), int(ymin), int(xmax), int(ymax)))
+            labels.append(class_id)
+            xml.append(
+                maker.object(
+                    maker.name(shape['label']),
+                    maker.pose('Unspecified'),
+                    maker.truncated('0'),
+                    maker.difficult('0'),
+                    maker.probability(str(shape['probability'])),
+                    maker.bndbox(
+                        maker.xmin(str(int(xmin))),
+                        maker.ymin(str(int(ymin))),
+                        maker.xmax(str(int(xmax))),
+                        maker.ymax(str(int(ymax))),
+                    ),
+                )
+            )
+        captions = [class_names[l] for l in labels]
+        colors = [tuple(int(c) for c in (colormap[l] * 255).astype(np.uint8))
+                  for l in labels]
+        if(captions and self.isTiled):
+            self.status('正在给文件{}画实例'.format(img_file))
+            self.instanceDrawer(img_file, out_viz_file, bboxes, colors, captions)
+            self.manifest.record(key, out_viz_file)
+        #write xml
+        with open(out_xml_file, 'wb') as f:
+            f.write(lxml.etree.tostring(xml, encoding='utf-8' ,pretty_print=True))
+        self.manifest.record(key, out_xml_file)
+
+    def exportSegmentation(self, scenes):
+        '''
+        write the class (and instance) mask of every tile of scenes next to
+        it. one tile is rasterized at a time, whatever the size of the scene.
+        '''
+        class_names = tuple(['_background_'] + sorted(self.labels))
+        with open(osp.join(self.outDir, 'class_names.txt'), 'w') as f:
+            f.writelines('\n'.join(class_names))
+        label_name_to_value = dict((name, i) for i, name in enumerate(class_names))
+
+        def exportScene(key, jsons):
+            for label_file in jsons:
+                if self.cancelled():
+                    return False
+                with open(label_file) as f:
+                    data = json.load(f)
+                shapes = data['shapes']
+                # shapes to the pixel coordinates of the tile, all at once
+                counts = [len(shape['points']) for shape in shapes]
+                if shapes:
+                    points = map2img_array(
+                        data['geoTrans'], [p for shape in shapes for p in shape['points']])
+                    ends = np.cumsum(counts)
+                shapes = [dict(shape, points=points[ends[k] - counts[k]:ends[k]])
+                          for k, shape in enumerate(shapes)]
+                window = (0, 0, data['imageWidth'], data['imageHeight'])
+                base = osp.splitext(label_file)[0]
+                cls = rasterize_shapes(
+                    shapes, [label_name_to_value[s['label']] for s in shapes], window)
+                lblsave(base + '_class.png', cls)
+                self.manifest.record(key, base + '_class.png')
+                if self.instances:
+                    ins = rasterize_shapes(shapes, range(1, len(shapes) + 1), window)
+                    PIL.Image.fromarray(ins.astype(np.uint16)).save(
+                        base + '_instance.png')
+                    self.manifest.record(key, base + '_instance.png')
+
+        return self.exportScenes(scenes, exportScene)
+
+
+    def exportBoxes(self, scenes):
+        '''
+        write the boxes of the shapes as text files, the images go to images/.
+        the boxes of a file are computed at once from its shape arrays.
+
+        DOTA: labelTxt/<base>.txt, the corners of the rotated box in pixels,
+        the class and difficult. YOLO-OBB: labels/<base>.txt, the class id
+        and the corners normalized to the image (and clamped to it). the
+        rotated box is the minimal area rectangle around the points, so that a
+        slanted rectangle cut at a tile border gets the smallest box around
+        the part in the tile. YOLO: labels/<base>.txt, the class id and the
+        normalized center and size of the box clamped to the image. the YOLO
+        classes are listed in classes.txt, in the order of their ids.
+        '''
+        dota = self.format == 'dota'
+        class_names = sorted(self.labels)
+        if not dota:
+            with open(osp.join(self.outDir, 'classes.txt'), 'w') as f:
+                f.writelines('\n'.join(class_names))
+        class_ids = dict((name, i) for i, name in enumerate(class_names))
+        labelsDir = osp.join(self.outDir, 'labelTxt' if dota else 'labels')
+
+        def lines(data):
+            shapes = []
+            points = []
+            for shape in data['shapes']:
+                shape_type = shape.get('shape_type', 'polygon')
+                if shape_type not in ('rectangle', 'polygon', 'slantRectangle') \
+                        or not shape['points']:
+                    continue
+                pts = shape['points']
+                if shape_type == 'rectangle':
+                    (x0, y0), (x1, y1) = pts
+                    pts = [(x0, y0), (x1, y0), (x1, y1), (x0, y1)]
+                shapes.append(shape)
+                points.append(pts)
+            if not shapes:
+                return []
+            counts = [len(pts) for pts in points]
+            points = map2img_array(
+                data['geoTrans'], [p for pts in points for p in pts])
+            size = np.array([data['imageWidth'], data['imageHeight']],
+                            dtype=np.float64)
+            if dota:
+                boxes = min_area_rects(points, counts).reshape(-1, 8).tolist()
+                return ['{} {} 0'.format(' '.join('{:.1f}'.format(c) for c in box),
+                                         '_'.join(shape['label'].split()))
+                        for shape, box in zip(shapes, boxes)]
+            if self.format == 'yolo_obb':
+                boxes = min_area_rects(points, counts)
+                boxes = np.clip(boxes / size, 0, 1).reshape(-1, 8).tolist()
+                return ['{} {}'.format(class_ids[shape['label']],
+                                       ' '.join('{:.6f}'.format(c) for c in box))
+                        for shape, box in zip(shapes, boxes)]
+            starts = np.cumsum(counts) - counts
+            mins = np.clip(np.minimum.reduceat(points, starts), 0, size) / size
+            maxs = np.clip(np.maximum.reduceat(points, starts), 0, size) / size
+            boxes = np.concatenate([(mins + maxs) / 2, maxs - mins], axis=1)
+            keep = (boxes[:, 2] > 0) & (boxes[:, 3] > 0)
+            return ['{} {:.6f} {:.6f} {:.6f} {:.6f}'.format(
+                        class_ids[shape['label']], *box)
+                    for shape, box, k in zip(shapes, boxes.tolist(), keep) if k]
+
+        def exportScene(key, jsons):
+            for label_file in jsons:
+                if self.cancelled():
+                    return False
+                with open(label_file) as f:
+                    data = json.load(f)
+                base = my_splitext(osp.basename(label_file))[0]
+                out_txt_file = osp.join(labelsDir, base + '.txt')
+                with open(out_txt_file, 'w') as f:
+                    f.writelines(line + '\n' for line in lines(data))
+                self.manifest.record(key, out_txt_file)
+                img_file, _ = find_image(label_file)
+                if img_file is not None:
+                    out_img_file = osp.join(
+                        self.outDir, 'images', osp.basename(img_file))
+                    materialize(img_file, out_img_file, self.link)
+                    self.manifest.record(key, out_img_file)
+
+        return self.exportScenes(scenes, exportScene)
+
+
+    def exportVector(self, inDir):
+        '''write every shape under inDir to <outDir>/annotations.gpkg (or .shp).'''
+        index = dir_index(inDir)
+        index.update()
+        filename = osp.join(self.outDir, 'annotations.' + self.format)
+        writer = VectorExporter(filename, self.format)
+        self.status('正在写入 {}'.format(filename))
+        finished = writer.write(scan_label_files(inDir, index), self.progress,
+                                self.cancelled)
+        self.labels = writer.labels
+        return finished
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='rslabel-export',
+        description='export labelme json files as a VOC, COCO, segmentation, YOLO, DOTA or YOLO-OBB dataset, or as a GeoPackage or shapefiles',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--format', choices=ExportEngine.formats, default='coco')
+    parser.add_argument('--tile', type=int, default=0,
+                        help='tile size in pixels, 0 exports the scenes untiled')
+    parser.add_argument('--mode', choices=Sampling.modes, default='grid',
+                        help='where the tiles are cut: on the grid, on '
+                             'overlapping sliding windows or on chips centered '
+                             'on the annotations')
+    parser.add_argument('--overlap', type=int, default=0,
+                        help='overlap in pixels of the sliding windows')
+    parser.add_argument('--link', choices=LINK_MODES, default='copy',
+                        help='how the rasters are put in the dataset, modes the '
+                             'volume does not support fall back to a copy')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='worker processes used to split the scenes')
+    parser.add_argument('--instances', action='store_true',
+                        help='also write the instance masks of the seg format')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='remove the content of a non empty out_dir')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='write the timings of the export stages to FILE, '
+                             'a chrome trace')
+    parser.add_argument('in_dir', help='input dir with annotated files')
+    parser.add_argument('out_dir', help='output dataset directory')
+    args = parser.parse_args()
+    if args.trace:
+        start_trace(args.trace)
+
+    if osp.exists(args.out_dir) and os.listdir(args.out_dir):
+        if args.overwrite:
+            shutil.rmtree(args.out_dir)
+        elif not osp.exists(osp.join(args.out_dir, MANIFEST_NAME)):
+            print('Output directory is not empty:', args.out_dir)
+            sys.exit(1)
+
+    def progress(done, total):
+        print('{}/{}'.format(done, total))
+
+    engine = ExportEngine(args.out_dir, args.format, args.tile or None,
+                          args.workers, instances=args.instances,
+                          mode=args.mode, overlap=args.overlap, link=args.link)
+    engine.run(args.in_dir, progress=progress, status=print)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+import os.path as osp
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import Qt
+
+
+class FileListModel(QtCore.QAbstractListModel):
+    '''
+    the images of the opened directory, for the file list view.
+
+    rows are looked up by path with a dict, whether an image has a label file
+    is only checked when its row is painted, and the search text filters the
+    rows of the model instead of scanning the directory again.
+    '''
+
+    def __init__(self, labelFileOf, parent=None):
+        super(FileListModel, self).__init__(parent)
+        # image path -> path of its label file
+        self.labelFileOf = labelFileOf
+        self.shortName = False
+        self._pattern = None
+        self._keep = None
+        self._files = []      # every image, sorted
+        self._byName = {}     # basename -> image path
+        self._rows = []       # the images shown, _files filtered by _pattern
+        self._index = {}      # image path -> row
+        self._labeled = {}    # image path -> has a label file, checked lazily
+
+    def setFiles(self, files):
+        self.beginResetModel()
+        self._files = list(files)
+        self._byName = dict((osp.basename(f), f) for f in self._files)
+        self._labeled = {}
+        self._filter()
+        self.endResetModel()
+
+    def setPattern(self, pattern):
+        '''show only the images whose path contains pattern.'''
+        if (pattern or None) == self._pattern:
+            return
+        self.beginResetModel()
+        self._pattern = pattern or None
+        self._filter()
+        self.endResetModel()
+
+    def setFilter(self, keep):
+        '''show only the images for which keep(path) is True, all when None.'''
+        self.beginResetModel()
+        self._keep = keep
+        self._filter()
+        self.endResetModel()
+
+    def _filter(self):
+        rows = self._files
+        if self._pattern:
+            rows = [f for f in rows if self._pattern in f]
+        if self._keep is not None:
+            rows = [f for f in rows if self._keep(f)]
+        self._rows = rows
+        self._index = dict((f, row) for row, f in enumerate(self._rows))
+
+    def setShortName(self, shortName):
+        '''show the basename of the images instead of their path.'''
+        self.shortName = shortName
+        if self._rows:
+            self.dataChanged.emit(
+                self.index(0), self.index(len(self._rows) - 1),
+                [Qt.DisplayRole])
+
+    def setLabeled(self, filename, labeled=True):
+        row = self.row(filename)
+        self._labeled[filename] = labeled
+        if row >= 0:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+
+    def files(self):
+        '''the paths of the images shown, do not modify.'''
+        return self._rows
+
+    def row(self, filename):
+        '''the row of the image filename, -1 when it is not shown.'''
+        return self._index.get(filename, -1)
+
+    def path(self, row):
+        return self._rows[row]
+
+    def fullPath(self, name):
+        '''the path of the image named name (a basename), None if unknown.'''
+        return self._byName.get(name)
+
+    def isLabeled(self, filename):
+        labeled = self._labeled.get(filename)
+        if labeled is None:
+            labeled = osp.exists(self.labelFileOf(filename))
+            self._labeled[filename] = labeled
+        return labeled
+
+    # QAbstractListModel
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._rows):
+            return None
+        filename = self._rows[index.row()]
+        if role == Qt.DisplayRole:
+            return osp.basename(filename) if self.shortName else filename
+        if role == Qt.CheckStateRole:
+            return Qt.Checked if self.isLabeled(filename) else Qt.Unchecked
+        if role == Qt.ToolTipRole:
+            return filename
+        return None
+
+    def flags(self, index):
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
@@ -95,9 +95,20 @@ class LabelDialog(QtWidgets.QDialog):
         self.edit.setCompleter(completer)
 
     def addLabelHistory(self, label):
-        if self.labelList.findItems(label, QtCore.Qt.MatchExactly):
+        self.addLabelsHistory([label])
+
+    def addLabelsHistory(self, labels):
+        '''add the labels not in the history yet, sorted once.'''
+        known = set(self.labelList.item(i).text()
+                    for i in range(self.labelList.count()))
+        new = []
+        for label in labels:
+            if label not in known:
+                known.add(label)
+                new.append(label)
+        if not new:
             return
-        self.labelList.addItem(label)
+        self.labelList.addItems(new)
         if self._sort_labels:
             self.labelList.sortItems()
 
@@ -2,26 +2,98 @@ import base64
 import json
 import os.path
 
+from . import label_sidecar
 from . import logger
 from . import utils
+from .trace import span
 
 
 class LabelFileError(Exception):
     pass
 
 
+def _shape_tuple(s, points):
+    return (
+        s['label'],
+        points,
+        s['line_color'],
+        s['fill_color'],
+        s.get('shape_type', 'polygon'),
+        s['probability'],
+    )
+
+
+class _SidecarShapeTuples(object):
+    '''
+    the shapes of a sidecar as LabelFile.shapes tuples, made when accessed.
+    their points are (N, 2) float64 views on the mapped coordinates.
+    '''
+
+    def __init__(self, shapes):
+        self._shapes = shapes
+
+    def __len__(self):
+        return len(self._shapes)
+
+    def __getitem__(self, i):
+        return _shape_tuple(self._shapes.meta(i), self._shapes.points(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
 class LabelFile(object):
 
     suffix = '.json'
 
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, use_sidecar=False):
         self.shapes = ()
         self.imagePath = None
         self.imageData = None
+        # read and write the binary sidecar (see label_sidecar) next to the json
+        self.use_sidecar = use_sidecar
         if filename is not None:
             self.load(filename)
         self.filename = filename
 
+    @property
+    def imageData(self):
+        # the image next to the label file is only read when asked for, it
+        # can be a multi GB raster.
+        if self._imageData is None and self._imageFile is not None:
+            with open(self._imageFile, 'rb') as f:
+                self._imageData = f.read()
+        return self._imageData
+
+    @imageData.setter
+    def imageData(self, value):
+        self._imageData = value
+        self._imageFile = None
+
+    def _read(self, filename):
+        '''the content of the json file, from its sidecar when it is up to date.'''
+        if self.use_sidecar:
+            try:
+                data = label_sidecar.load_sidecar(
+                    label_sidecar.sidecar_path(filename), source=filename)
+                if data is not None:
+                    return data
+            except Exception as e:
+                logger.warn('Failed to read sidecar of {}: {}'.format(filename, e))
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        if self.use_sidecar:
+            self._write_sidecar(data, filename)
+        return data
+
+    def _write_sidecar(self, data, filename):
+        try:
+            label_sidecar.write_sidecar(
+                data, label_sidecar.sidecar_path(filename), source=filename)
+        except Exception as e:
+            logger.warn('Failed to write sidecar of {}: {}'.format(filename, e))
+
     def load(self, filename):
         keys = [
             'imageData',
@@ -34,31 +106,25 @@ class LabelFile(object):
             'imageWidth',
         ]
         try:
-            with open(filename, 'r') as f:
-                data = json.load(f)
+            with span('json parse', file=filename):
+                data = self._read(filename)
+            imageFile = None
             if data['imageData'] is not None:
                 imageData = base64.b64decode(data['imageData'])
             else:
                 # relative path from label file to relative path from cwd
-                imagePath = os.path.join(os.path.dirname(filename),
+                imageData = None
+                imageFile = os.path.join(os.path.dirname(filename),
                                          data['imagePath'])
-                with open(imagePath, 'rb') as f:
-                    imageData = f.read()
             flags = data.get('flags')
             imagePath = data['imagePath']
             lineColor = data['lineColor']
             fillColor = data['fillColor']
-            shapes = (
-                (
-                    s['label'],
-                    s['points'],
-                    s['line_color'],
-                    s['fill_color'],
-                    s.get('shape_type', 'polygon'),
-                    s['probability'],
-                )
-                for s in data['shapes']
-            )
+            # a sequence, a prefetched label file is loaded each time its image is
+            if isinstance(data['shapes'], label_sidecar.SidecarShapes):
+                shapes = _SidecarShapeTuples(data['shapes'])
+            else:
+                shapes = [_shape_tuple(s, s['points']) for s in data['shapes']]
         except Exception as e:
             raise LabelFileError(e)
 
@@ -72,6 +138,7 @@ class LabelFile(object):
         self.shapes = shapes
         self.imagePath = imagePath
         self.imageData = imageData
+        self._imageFile = imageFile
         self.lineColor = lineColor
         self.fillColor = fillColor
         self.filename = filename
@@ -131,11 +198,18 @@ class LabelFile(object):
         )
         for key, value in otherData.items():
             data[key] = value
+        # written aside then renamed, a crash never leaves a truncated file
+        tmp = filename + '.tmp'
         try:
-            with open(filename, 'w') as f:
+            with open(tmp, 'w') as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, filename)
             self.filename = filename
+            if self.use_sidecar:
+                self._write_sidecar(data, filename)
         except Exception as e:
+            if os.path.exists(tmp):
+                os.remove(tmp)
             raise LabelFileError(e)
 
     @staticmethod
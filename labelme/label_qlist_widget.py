@@ -3,25 +3,64 @@ from PyQt5 import QtGui
 from PyQt5 import QtWidgets
 
 class LabelQListWidget(QtWidgets.QListWidget):
+    '''
+    the labels of the shapes of the canvas, an item per shape. items and
+    shapes are mapped by identity both ways, so that looking one up from the
+    other does not scan the list.
+    '''
 
     def __init__(self, *args, **kwargs):
         super(LabelQListWidget, self).__init__(*args, **kwargs)
         self.canvas = None
-        self.itemsToShapes = []
+        self._shapes = {}  # id(item) -> (item, shape)
+        self._items = {}   # id(shape) -> (shape, item)
+
+    @property
+    def itemsToShapes(self):
+        '''(item, shape) pairs in the order they were added.'''
+        return list(self._shapes.values())
 
     def get_shape_from_item(self, item):
-        for index, (item_, shape) in enumerate(self.itemsToShapes):
-            if item_ is item:
-                return shape
+        entry = self._shapes.get(id(item))
+        if entry is not None:
+            return entry[1]
 
     def get_item_from_shape(self, shape):
-        for index, (item, shape_) in enumerate(self.itemsToShapes):
-            if shape_ is shape:
-                return item
+        entry = self._items.get(id(shape))
+        if entry is not None:
+            return entry[1]
+
+    def add_shape(self, item, shape):
+        self._shapes[id(item)] = (item, shape)
+        self._items[id(shape)] = (shape, item)
+        self.addItem(item)
+
+    def add_shapes(self, pairs):
+        '''
+        add (item, shape) pairs in one block, without a repaint or a signal
+        per item.
+        '''
+        self.setUpdatesEnabled(False)
+        blocked = self.blockSignals(True)
+        try:
+            for item, shape in pairs:
+                self.add_shape(item, shape)
+        finally:
+            self.blockSignals(blocked)
+            self.setUpdatesEnabled(True)
+
+    def remove_shape(self, shape):
+        entry = self._items.pop(id(shape), None)
+        if entry is None:
+            return
+        item = entry[1]
+        del self._shapes[id(item)]
+        self.takeItem(self.row(item))
 
     def clear(self):
         super(LabelQListWidget, self).clear()
-        self.itemsToShapes = []
+        self._shapes = {}
+        self._items = {}
 
     def setParent(self, parent):
         self.parent = parent
@@ -38,9 +77,4 @@ class LabelQListWidget(QtWidgets.QListWidget):
 
     @property
     def shapes(self):
-        shapes = []
-        for i in range(self.count()):
-            item = self.item(i)
-            shape = self.get_shape_from_item(item)
-            shapes.append(shape)
-        return shapes
+        return [self.get_shape_from_item(self.item(i)) for i in range(self.count())]
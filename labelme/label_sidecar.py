@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+'''
+compact binary sidecar of a labelme json file.
+
+the sidecar <name>.lbin lives next to <name>.json. it holds the point
+coordinates of every shape as one contiguous float64 array with an offset per
+shape, and a small json header with everything else (labels, shape types,
+probabilities, colors, geoTrans...). the arrays are memory mapped and a shape
+is only decoded when it is accessed.
+
+the json stays the interchange format: a sidecar remembers the size and mtime
+of the json it was made from and is ignored once the json changes.
+
+layout (little endian):
+
+    8 bytes   magic, b'RSLBIN01'
+    uint64    header length
+    header    utf-8 json
+    padding   to a multiple of 8 bytes
+    int64     offsets, one per shape plus one
+    float64   coordinates, (offsets[-1], 2)
+'''
+
+import argparse
+import json
+import os
+import os.path as osp
+import struct
+
+import numpy as np
+
+
+MAGIC = b'RSLBIN01'
+SUFFIX = '.lbin'
+
+# how the points of a shape are stored
+FLOAT_POINTS = 'f'   # float64 array
+INT_POINTS = 'i'     # float64 array, written back to json as int
+INLINE_POINTS = 'j'  # mixed int/float coordinates, kept in the header
+
+
+def sidecar_path(filename):
+    return osp.splitext(filename)[0] + SUFFIX
+
+
+def _stamp(filename):
+    st = os.stat(filename)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def _points_kind(points):
+    values = [v for p in points for v in p]
+    if all(isinstance(v, float) for v in values):
+        return FLOAT_POINTS
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        return INT_POINTS
+    return INLINE_POINTS
+
+
+def write_sidecar(data, filename, source=None):
+    '''
+    write the labelme json content data to the sidecar filename. source is the
+    json file data comes from, its size and mtime are stored to detect when
+    the sidecar is out of date.
+    '''
+    shapes = []
+    kinds = []
+    offsets = [0]
+    arrays = []
+    for s in data['shapes']:
+        s = dict(s)
+        kind = _points_kind(s['points'])
+        if kind != INLINE_POINTS:
+            arr = np.asarray(s['points'], dtype='<f8').reshape(-1, 2)
+            arrays.append(arr)
+            s['points'] = None
+            offsets.append(offsets[-1] + len(arr))
+        else:
+            offsets.append(offsets[-1])
+        shapes.append(s)
+        kinds.append(kind)
+    # keep the key order of the json, the shapes are put back in place on decode
+    other = dict((key, None if key == 'shapes' else value)
+                 for key, value in data.items())
+    header = {
+        'source': _stamp(source) if source is not None else None,
+        'data': other,
+        'shapes': shapes,
+        'kinds': kinds,
+    }
+    header = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    pad = (-(len(MAGIC) + 8 + len(header))) % 8
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        f.write(b'\0' * pad)
+        f.write(np.asarray(offsets, dtype='<i8').tobytes())
+        for arr in arrays:
+            f.write(arr.tobytes())
+    os.replace(tmp, filename)
+
+
+class SidecarShapes(object):
+    '''the shapes of a sidecar, points are decoded from the mapped arrays on access.'''
+
+    def __init__(self, shapes, kinds, offsets, coords):
+        self._shapes = shapes
+        self._kinds = kinds
+        self.offsets = offsets
+        self.coords = coords
+
+    def __len__(self):
+        return len(self._shapes)
+
+    def meta(self, i):
+        '''the header of shape i, its points are None unless kept inline.'''
+        return self._shapes[i]
+
+    def points(self, i):
+        '''the points of shape i as a (N, 2) float64 array, a view on the sidecar.'''
+        if self._kinds[i] == INLINE_POINTS:
+            return np.asarray(self._shapes[i]['points'], dtype=np.float64)
+        return self.coords[self.offsets[i]:self.offsets[i + 1]]
+
+    def __getitem__(self, i):
+        shape = dict(self._shapes[i])
+        kind = self._kinds[i]
+        if kind != INLINE_POINTS:
+            points = self.points(i).tolist()
+            if kind == INT_POINTS:
+                points = [[int(x), int(y)] for x, y in points]
+            shape['points'] = points
+        return shape
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class Sidecar(object):
+
+    def __init__(self, filename, header, shapes):
+        self.filename = filename
+        self.source = header['source']
+        self._data = header['data']
+        self.shapes = shapes
+
+    def get(self, key, default=None):
+        if key == 'shapes':
+            return self.shapes
+        return self._data.get(key, default)
+
+    def __getitem__(self, key):
+        if key == 'shapes':
+            return self.shapes
+        return self._data[key]
+
+    def keys(self):
+        return self._data.keys()
+
+    def items(self):
+        for key, value in self._data.items():
+            yield key, self.shapes if key == 'shapes' else value
+
+    def to_dict(self):
+        '''the content of the json file, every shape decoded.'''
+        data = dict(self._data)
+        data['shapes'] = list(self.shapes)
+        return data
+
+
+def load_sidecar(filename, source=None):
+    '''
+    map the sidecar filename. when source is given and the json has changed
+    since the sidecar was written, or the sidecar is missing, return None.
+    '''
+    if not osp.exists(filename):
+        return None
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('Not a label sidecar: {}'.format(filename))
+        size, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(size).decode('utf-8'))
+    if source is not None and header['source'] != _stamp(source):
+        return None
+    start = len(MAGIC) + 8 + size
+    start += (-start) % 8
+    count = len(header['shapes'])
+    offsets = np.memmap(filename, dtype='<i8', mode='r',
+                        offset=start, shape=(count + 1,))
+    total = int(offsets[-1])
+    if total:
+        coords = np.memmap(filename, dtype='<f8', mode='r',
+                           offset=start + 8 * (count + 1), shape=(total, 2))
+    else:
+        coords = np.zeros((0, 2), dtype=np.float64)
+    shapes = SidecarShapes(header['shapes'], header['kinds'], offsets, coords)
+    return Sidecar(filename, header, shapes)
+
+
+def json_to_sidecar(json_file, filename=None):
+    filename = filename or sidecar_path(json_file)
+    with open(json_file) as f:
+        data = json.load(f)
+    write_sidecar(data, filename, source=json_file)
+    return filename
+
+
+def sidecar_to_json(filename, json_file=None):
+    '''write the sidecar back to a json file, formatted like LabelFile.save.'''
+    json_file = json_file or osp.splitext(filename)[0] + '.json'
+    data = load_sidecar(filename).to_dict()
+    with open(json_file, 'w') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    return json_file
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='convert labelme json files to and from binary sidecars')
+    parser.add_argument('direction', choices=['to-sidecar', 'to-json'])
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args()
+    for filename in args.files:
+        if args.direction == 'to-sidecar':
+            print(json_to_sidecar(filename))
+        else:
+            print(sidecar_to_json(filename))
+
+
+if __name__ == '__main__':
+    main()
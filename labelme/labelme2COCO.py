@@ -4,31 +4,89 @@
 import argparse
 import json
 import numpy as np
+import os
 import glob
-import functools
+import shutil
+import tempfile
+
+
+def img2map_array(geoTrans, points):
+    '''
+    convert a (N, 2) array of image coordinates (pixel, line) to map
+    coordinates with the GDAL geotransform, rotation terms included:
+
+        X = geoTrans[0] + pixel * geoTrans[1] + line * geoTrans[2]
+        Y = geoTrans[3] + pixel * geoTrans[4] + line * geoTrans[5]
+    '''
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    x, y = points[:, 0], points[:, 1]
+    out = np.empty_like(points)
+    out[:, 0] = geoTrans[0] + x * geoTrans[1] + y * geoTrans[2]
+    out[:, 1] = geoTrans[3] + x * geoTrans[4] + y * geoTrans[5]
+    return out
+
+
+def map2img_array(geoTrans, points):
+    '''inverse of img2map_array, (N, 2) map coordinates to image coordinates.'''
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    dx = points[:, 0] - geoTrans[0]
+    dy = points[:, 1] - geoTrans[3]
+    out = np.empty_like(points)
+    if geoTrans[2] == 0 and geoTrans[4] == 0:  # north up
+        out[:, 0] = dx / geoTrans[1]
+        out[:, 1] = dy / geoTrans[5]
+    else:
+        det = geoTrans[1] * geoTrans[5] - geoTrans[2] * geoTrans[4]
+        out[:, 0] = (geoTrans[5] * dx - geoTrans[2] * dy) / det
+        out[:, 1] = (geoTrans[1] * dy - geoTrans[4] * dx) / det
+    return out
+
+
+def window_offset_array(x0, y0, height, points):
+    '''
+    (N, 2) image coordinates to the coordinates of the window of the image
+    starting at pixel (x0, y0), with y up from the bottom of the window.
+    '''
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    out = np.empty_like(points)
+    out[:, 0] = points[:, 0] - x0
+    out[:, 1] = (y0 + height) - points[:, 1]
+    return out
+
+
+def tile_geotransform(geoTrans, x, y):
+    '''geotransform of the window of a raster starting at pixel (x, y).'''
+    return [geoTrans[0] + geoTrans[1] * x + geoTrans[2] * y,
+            geoTrans[1],
+            geoTrans[2],
+            geoTrans[3] + geoTrans[4] * x + geoTrans[5] * y,
+            geoTrans[4],
+            geoTrans[5]]
 
 
 def map2img(geoTrans, x, y):
-    u = (x - geoTrans[0]) / geoTrans[1]
-    v = (geoTrans[3] - y) / -geoTrans[5]
+    dx = x - geoTrans[0]
+    dy = y - geoTrans[3]
+    if geoTrans[2] == 0 and geoTrans[4] == 0:
+        return dx / geoTrans[1], dy / geoTrans[5]
+    det = geoTrans[1] * geoTrans[5] - geoTrans[2] * geoTrans[4]
+    u = (geoTrans[5] * dx - geoTrans[2] * dy) / det
+    v = (geoTrans[1] * dy - geoTrans[4] * dx) / det
     return u, v
 
 
 def map2img_p(geoTrans, p):
-    u = (p[0] - geoTrans[0]) / geoTrans[1]
-    v = (geoTrans[3] - p[1]) / -geoTrans[5]
-    return u, v
+    return map2img(geoTrans, p[0], p[1])
 
 
 def img2map(geoTrans, x, y):
-    u = geoTrans[0] + geoTrans[1]*x
-    v = geoTrans[3] + geoTrans[5]*y
+    u = geoTrans[0] + x * geoTrans[1] + y * geoTrans[2]
+    v = geoTrans[3] + x * geoTrans[4] + y * geoTrans[5]
     return [u, v]
 
 
 def img2map_p(geoTrans, p):
-    u = geoTrans[0] + geoTrans[1]*p[0]
-    v = geoTrans[3] + geoTrans[5]*p[1]
+    u, v = img2map(geoTrans, p[0], p[1])
     return u, v
 
 
@@ -44,6 +102,65 @@ def offset_p(tileSz, row, col, p):
     return u, v
 
 
+class COCOWriter(object):
+    '''
+    write a COCO json incrementally: images are written to the output file as
+    they come, annotations go to a temporary file that is appended after the
+    categories on close. the output is the same as json.dump(..., indent=4) of
+    {'images': ..., 'categories': ..., 'annotations': ...}. it is written
+    aside and only renamed to save_json_path by close(), discard() drops it.
+    '''
+
+    indent = 4
+
+    def __init__(self, save_json_path):
+        self.save_json_path = save_json_path
+        self.tmp = save_json_path + '.tmp'
+        self.f = open(self.tmp, 'w')
+        self.annotations_file = tempfile.TemporaryFile('w+')
+        self.num_images = 0
+        self.num_annotations = 0
+        self.f.write('{\n' + ' ' * self.indent + '"images": [')
+
+    def _write_item(self, f, item, count):
+        pad = ' ' * (2 * self.indent)
+        text = json.dumps(item, indent=self.indent).replace('\n', '\n' + pad)
+        f.write((',\n' if count else '\n') + pad + text)
+
+    def _close_list(self, f, count):
+        f.write(('\n' + ' ' * self.indent + ']') if count else ']')
+
+    def add_image(self, image):
+        self._write_item(self.f, image, self.num_images)
+        self.num_images += 1
+
+    def add_annotation(self, annotation):
+        self._write_item(self.annotations_file, annotation, self.num_annotations)
+        self.num_annotations += 1
+
+    def close(self, categories):
+        pad = ' ' * self.indent
+        self._close_list(self.f, self.num_images)
+        self.f.write(',\n' + pad + '"categories": [')
+        for i, categorie in enumerate(categories):
+            self._write_item(self.f, categorie, i)
+        self._close_list(self.f, len(categories))
+        self.f.write(',\n' + pad + '"annotations": [')
+        self.annotations_file.seek(0)
+        shutil.copyfileobj(self.annotations_file, self.f)
+        self.annotations_file.close()
+        self._close_list(self.f, self.num_annotations)
+        self.f.write('\n}')
+        self.f.close()
+        os.replace(self.tmp, self.save_json_path)
+
+    def discard(self):
+        '''drop what was written, after an error.'''
+        self.annotations_file.close()
+        self.f.close()
+        os.remove(self.tmp)
+
+
 class labelme2coco(object):
     def __init__(self, labelme_json=[], save_json_path='./new.json'):
         '''
@@ -52,53 +169,52 @@ class labelme2coco(object):
         '''
         self.labelme_json = labelme_json
         self.save_json_path = save_json_path
-        self.images = []
         self.categories = []
-        self.annotations = []
-        # self.data_coco = {}
-        self.labels = []
+        # category name -> category id
+        self.labels = {}
         self.annID = 1
         self.height = 0
         self.width = 0
         self.save_json()
 
-    def data_transfer(self):
+    def data_transfer(self, writer):
         for num, json_file in enumerate(self.labelme_json):
             with open(json_file, 'r') as fp:
                 data = json.load(fp)  #
-                self.images.append(self.image(data, num))
-                otherData = {}
-                keys = [
-                    'imageData',
-                    'imagePath',
-                    'lineColor',
-                    'fillColor',
-                    'shapes',  # polygonal annotations
-                    'flags',   # image level flags
-                    'imageHeight',
-                    'imageWidth', ]
-                for key, value in data.items():
-                    if key not in keys:
-                        otherData[key] = value
-                geoTrans = otherData['geoTrans']
-                mapfunc = functools.partial(map2img_p, geoTrans)
-                for shape in data['shapes']:
-                    label = shape['label'].split('_')
-                    if(len(label) == 2):  # *
-                        if label[1] not in self.labels:
-                            self.categories.append(self.categorie(label))
-                            self.labels.append(label[1])
-                    else:
-                        if label[0] not in self.labels:
-                            self.categories.append(self.categorie(label))
-                            self.labels.append(label[0])
-                    points = shape['points']
-                    prob = shape['probability']
-                    # convert to image coord
-                    points = list(map(mapfunc, points))
-                    self.annotations.append(
-                        self.annotation(points, label, prob, num))
-                    self.annID += 1
+            writer.add_image(self.image(data, num))
+            otherData = {}
+            keys = [
+                'imageData',
+                'imagePath',
+                'lineColor',
+                'fillColor',
+                'shapes',  # polygonal annotations
+                'flags',   # image level flags
+                'imageHeight',
+                'imageWidth', ]
+            for key, value in data.items():
+                if key not in keys:
+                    otherData[key] = value
+            geoTrans = otherData['geoTrans']
+            # convert the points of the whole file to image coord in one call
+            shapes = data['shapes']
+            counts = [len(shape['points']) for shape in shapes]
+            if shapes:
+                points = map2img_array(
+                    geoTrans, [p for shape in shapes for p in shape['points']])
+                ends = np.cumsum(counts)
+            for i, shape in enumerate(shapes):
+                label = shape['label'].split('_')
+                name = label[1] if len(label) == 2 else label[0]  # *
+                if name not in self.labels:
+                    categorie = self.categorie(label)
+                    self.categories.append(categorie)
+                    self.labels[name] = categorie['id']
+                prob = shape['probability']
+                writer.add_annotation(self.annotation(
+                    points[ends[i] - counts[i]:ends[i]], label, prob, num))
+                self.annID += 1
+            del data
 
     def image(self, data, num):
         image = {}
@@ -136,13 +252,10 @@ class labelme2coco(object):
         return annotation
 
     def getcatid(self, label):
-        for categorie in self.categories:
-            if(len(label) == 2):
-                if label[1] == categorie['name']:
-                    return categorie['id']
-            elif(len(label) == 1):
-                if label[0] == categorie['name']:
-                    return categorie['id']
+        if(len(label) == 2):
+            return self.labels.get(label[1], -1)
+        elif(len(label) == 1):
+            return self.labels.get(label[0], -1)
         return -1
 
     def getbbox(self, points):
@@ -162,15 +275,11 @@ class labelme2coco(object):
         right_bottom_r = np.max(rows)
         right_bottom_c = np.max(clos)
 
-    def data2coco(self):
-        data_coco = {}
-        data_coco['images'] = self.images
-        data_coco['categories'] = self.categories
-        data_coco['annotations'] = self.annotations
-        return data_coco
-
     def save_json(self):
-        self.data_transfer()
-        self.data_coco = self.data2coco()
-        json.dump(self.data_coco, open(self.save_json_path, 'w'),
-                  indent=4)
+        writer = COCOWriter(self.save_json_path)
+        try:
+            self.data_transfer(writer)
+        except Exception:
+            writer.discard()
+            raise
+        writer.close(self.categories)
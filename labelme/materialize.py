@@ -0,0 +1,98 @@
+'''
+put a raster of the dataset into the exported dataset without copying its
+bytes when possible.
+
+hardlink: a second name for the same file, on the same volume only. editing
+    the exported file in place edits the source too.
+reflink: a copy on write clone (btrfs, xfs, APFS), the data blocks are
+    shared until one of the files is modified.
+symlink: a link to the source path, the dataset breaks if the source moves.
+copy: a full copy.
+
+a mode the platform or the volume does not support falls back to a copy (a
+hardlink tries a reflink first), materialize() returns the mode used.
+'''
+
+import errno
+import os
+import os.path as osp
+import shutil
+import sys
+
+from . import logger
+
+
+MODES = ('hardlink', 'reflink', 'symlink', 'copy')
+
+# ioctl cloning a whole file on linux, from linux/fs.h
+FICLONE = 0x40049409
+
+
+def _remove(dst):
+    if osp.lexists(dst):
+        os.remove(dst)
+
+
+def _reflink(src, dst):
+    if sys.platform.startswith('linux'):
+        import fcntl
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return
+            except OSError:
+                pass
+        os.remove(dst)
+    elif sys.platform == 'darwin':
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0:
+            return
+    raise OSError(errno.EOPNOTSUPP, 'reflink is not supported', dst)
+
+
+def _symlink(src, dst):
+    os.symlink(osp.relpath(osp.abspath(src), osp.dirname(osp.abspath(dst))), dst)
+
+
+_ACTIONS = {
+    'hardlink': os.link,
+    'reflink': _reflink,
+    'symlink': _symlink,
+    'copy': shutil.copy,
+}
+
+# the modes tried in order for each mode
+_FALLBACKS = {
+    'hardlink': ('hardlink', 'reflink', 'copy'),
+    'reflink': ('reflink', 'copy'),
+    'symlink': ('symlink', 'copy'),
+    'copy': ('copy',),
+}
+
+# modes seen failing, by (mode, device of the source, device of the target
+# dir), so that a whole export does not try a failing mode once per file
+_unsupported = set()
+
+
+def materialize(src, dst, mode='copy'):
+    '''
+    make dst hold the content of src with mode, dst is replaced if it exists.
+    return the mode used.
+    '''
+    if mode not in MODES:
+        raise ValueError('Unsupported materialization mode: %s' % mode)
+    _remove(dst)
+    devices = (os.stat(src).st_dev, os.stat(osp.dirname(osp.abspath(dst))).st_dev)
+    for m in _FALLBACKS[mode]:
+        if (m, devices) in _unsupported:
+            continue
+        try:
+            _ACTIONS[m](src, dst)
+            return m
+        except OSError as e:
+            if m == 'copy':
+                raise
+            logger.warn('Failed to {} {}: {}, falling back'.format(m, src, e))
+            _unsupported.add((m, devices))
+            _remove(dst)
@@ -0,0 +1,114 @@
+import collections
+import concurrent.futures
+import os
+import threading
+
+from . import logger
+
+
+def file_stamp(filename):
+    '''(size, mtime) of filename, None when it does not exist.'''
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+class Prefetcher(object):
+    '''
+    load entries ahead of time on a worker thread and keep the ready ones in a
+    bounded LRU.
+
+    loader(key) makes the entry of key, it runs on the worker thread and must
+    not touch Qt widgets. files(key) lists the files an entry is made from,
+    their size and mtime are recorded when the load is scheduled and an entry
+    is dropped once any of them has changed on disk.
+    '''
+
+    def __init__(self, loader, files, capacity=8):
+        self.loader = loader
+        self.files = files
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._cache = collections.OrderedDict()  # key -> (stamp, entry)
+        self._pending = {}  # key -> (stamp, future)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def _stamp(self, key):
+        return tuple(file_stamp(f) for f in self.files(key))
+
+    def get(self, key):
+        '''
+        the entry of key if it is ready or being loaded, None otherwise. an
+        entry still loading is waited for rather than loaded a second time.
+        '''
+        stamp = self._stamp(key)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                if cached[0] == stamp:
+                    self._cache.move_to_end(key)
+                    return cached[1]
+                del self._cache[key]
+            pending = self._pending.get(key)
+        if pending is None or pending[0] != stamp:
+            return None
+        try:
+            return pending[1].result()
+        except Exception:
+            return None
+
+    def prefetch(self, keys):
+        '''
+        schedule the loading of keys, in order. pending loads of other keys
+        that have not started yet are cancelled.
+        '''
+        with self._lock:
+            for key in list(self._pending):
+                if key not in keys and self._pending[key][1].cancel():
+                    del self._pending[key]
+        for key in keys:
+            stamp = self._stamp(key)
+            with self._lock:
+                cached = self._cache.get(key)
+                if cached is not None and cached[0] == stamp:
+                    continue
+                pending = self._pending.get(key)
+                if pending is not None and pending[0] == stamp:
+                    continue
+                future = self._executor.submit(self._load, key, stamp)
+                self._pending[key] = (stamp, future)
+
+    def _load(self, key, stamp):
+        try:
+            entry = self.loader(key)
+        except Exception as e:
+            logger.warn('Failed to prefetch {}: {}'.format(key, e))
+            with self._lock:
+                self._pending.pop(key, None)
+            raise
+        with self._lock:
+            if self._pending.get(key, (None,))[0] == stamp:
+                del self._pending[key]
+            self._cache[key] = (stamp, entry)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.capacity:
+                self._cache.popitem(last=False)
+        return entry
+
+    def invalidate(self, key=None):
+        '''forget the entry of key, or every entry when key is None.'''
+        with self._lock:
+            if key is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(key, None)
+
+    def shutdown(self):
+        with self._lock:
+            for stamp, future in self._pending.values():
+                future.cancel()
+            self._pending.clear()
+            self._cache.clear()
+        self._executor.shutdown(wait=False)
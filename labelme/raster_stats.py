@@ -0,0 +1,235 @@
+'''
+per band statistics of rasters, cached in a local sqlite database.
+
+statistics are keyed by the path, size and mtime of the raster, a raster that
+changes on disk is measured again. a raster seen for the first time gets
+approximate statistics right away (from its overviews when it has some, GDAL
+samples it otherwise) and the exact statistics of every band are computed in
+the background, one band per worker, replacing the approximate ones when they
+are done.
+
+the size and band count of rasters are cached the same way, the exporters
+read them from here rather than opening every raster they write out.
+
+the host stretches non byte rasters with a .omd file next to the image, it is
+written from the cached statistics when possible and skipped on read-only
+directories.
+'''
+
+import concurrent.futures
+import contextlib
+import os
+import os.path as osp
+import sqlite3
+import threading
+
+from . import logger
+
+try:
+    from osgeo import gdal
+except ImportError:
+    import gdal
+
+
+DEFAULT_DB = osp.join(osp.expanduser('~'), '.labelme_stats.sqlite')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS stats (
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    band INTEGER NOT NULL,
+    approx INTEGER NOT NULL,
+    min REAL, max REAL, mean REAL, std REAL,
+    PRIMARY KEY (path, band)
+);
+CREATE TABLE IF NOT EXISTS info (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    width INTEGER, height INTEGER, bands INTEGER
+);
+'''
+
+
+def _key(filename):
+    st = os.stat(filename)
+    return osp.normcase(osp.abspath(filename)), st.st_size, st.st_mtime_ns
+
+
+def compute_band_stats(filename, bandIdx, approx=False):
+    '''(min, max, mean, std) of band bandIdx (1 based), with its own dataset.'''
+    img = gdal.Open(filename)
+    stats = img.GetRasterBand(bandIdx).ComputeStatistics(approx)
+    del img
+    return tuple(stats)
+
+
+class StatsCache(object):
+    '''
+    the statistics store. safe to use from several threads, every call opens
+    its own sqlite connection.
+    '''
+
+    def __init__(self, db=None, workers=None):
+        self.db = db or DEFAULT_DB
+        self.workers = workers or os.cpu_count() or 1
+        self._lock = threading.Lock()
+        self._running = {}  # raster key -> futures of the exact statistics
+        self._executor = None
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db, timeout=30)
+        try:
+            with conn:  # commit, or roll back on error
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, filename):
+        '''
+        (bands, approx) for filename, bands is a list of (min, max, mean, std)
+        per band. None when nothing valid is cached.
+        '''
+        path, size, mtime_ns = _key(filename)
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT band, approx, min, max, mean, std FROM stats '
+                'WHERE path = ? AND size = ? AND mtime_ns = ? ORDER BY band',
+                (path, size, mtime_ns)).fetchall()
+        if not rows or [r[0] for r in rows] != list(range(1, len(rows) + 1)):
+            return None
+        return [tuple(r[2:]) for r in rows], any(r[1] for r in rows)
+
+    def put(self, filename, bands, approx=False, key=None):
+        path, size, mtime_ns = key or _key(filename)
+        with self._lock, self._connect() as conn:
+            conn.execute('DELETE FROM stats WHERE path = ?', (path,))
+            conn.executemany(
+                'INSERT INTO stats VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                [(path, size, mtime_ns, i + 1, int(approx)) + tuple(b)
+                 for i, b in enumerate(bands)])
+
+    def info(self, filename):
+        '''(width, height, bands) of filename, the raster is opened on a miss.'''
+        path, size, mtime_ns = key = _key(filename)
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT width, height, bands FROM info '
+                'WHERE path = ? AND size = ? AND mtime_ns = ?',
+                (path, size, mtime_ns)).fetchone()
+        if row is not None:
+            return tuple(row)
+        img = gdal.Open(filename)
+        info = img.RasterXSize, img.RasterYSize, img.RasterCount
+        del img
+        self.putInfo([(filename, info)], keys=[key])
+        return info
+
+    def putInfo(self, infos, keys=None):
+        '''store the (filename, (width, height, bands)) of infos at once.'''
+        keys = keys or [_key(filename) for filename, info in infos]
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO info VALUES (?, ?, ?, ?, ?, ?)',
+                [key + tuple(info) for key, (filename, info) in zip(keys, infos)])
+
+    def statistics(self, filename, img=None, done=None):
+        '''
+        the statistics of every band of filename, as get() returns them.
+        when nothing is cached, approximate statistics are computed on img (or
+        a dataset opened here) and returned, and the exact ones are scheduled
+        in the background. done(filename, bands) is called on a worker thread
+        once the exact statistics are stored.
+        '''
+        cached = self.get(filename)
+        if cached is not None:
+            bands, approx = cached
+            if approx:
+                self.computeExact(filename, done)
+            return cached
+        key = _key(filename)
+        if img is None:
+            img = gdal.Open(filename)
+        bands = [tuple(img.GetRasterBand(i).ComputeStatistics(True))
+                 for i in range(1, img.RasterCount + 1)]
+        self.put(filename, bands, approx=True, key=key)
+        self.computeExact(filename, done)
+        return bands, True
+
+    def computeExact(self, filename, done=None):
+        '''compute and store the exact statistics of filename in the background.'''
+        key = _key(filename)
+        img = gdal.Open(filename)
+        count = img.RasterCount
+        del img
+        if count == 0:
+            return
+        with self._lock:
+            if key in self._running:
+                return
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.workers)
+            futures = [self._executor.submit(compute_band_stats, filename, i)
+                       for i in range(1, count + 1)]
+            self._running[key] = futures
+
+        def bandDone(future):
+            with self._lock:
+                if not all(f.done() for f in futures) or \
+                        self._running.pop(key, None) is None:
+                    return
+            # the last band, on its worker thread
+            try:
+                bands = [f.result() for f in futures]
+                if _key(filename) == key:
+                    self.put(filename, bands, approx=False, key=key)
+                    if done is not None:
+                        done(filename, bands)
+            except Exception as e:
+                logger.warn('Failed to compute statistics of {}: {}'
+                            .format(filename, e))
+
+        for future in futures:
+            future.add_done_callback(bandDone)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+
+def omd_path(filename):
+    return osp.splitext(filename)[0] + '.omd'
+
+
+def write_omd(filename, bands):
+    '''write the .omd the host reads, False when the directory is read-only.'''
+    try:
+        with open(omd_path(filename), 'w') as omdf:
+            omdf.write('number_bands:  {}\n\n'.format(len(bands)))
+            for bandIdx, stats in enumerate(bands, 1):
+                omdf.write('band{}.min_value:  {}\n'.format(bandIdx, stats[0]))
+                omdf.write('band{}.max_value:  {}\n'.format(bandIdx, stats[1]))
+    except OSError as e:
+        logger.warn('Failed to write {}: {}'.format(omd_path(filename), e))
+        return False
+    return True
+
+
+_cache = None
+_cacheLock = threading.Lock()
+
+
+def stats_cache():
+    '''the StatsCache shared by the plugin.'''
+    global _cache
+    with _cacheLock:
+        if _cache is None:
+            _cache = StatsCache()
+    return _cache
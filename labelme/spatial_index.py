@@ -0,0 +1,80 @@
+import math
+
+
+class TileGridIndex(object):
+    '''
+    uniform grid index over the tiles of a scene.
+
+    every cell of the grid is one tile (row, col) of size ``tileSz``. items are
+    registered with their bounding box in image coordinates and can then be
+    queried per tile, so a tile only looks at the items whose bounding box
+    touches it instead of at every item of the scene.
+    '''
+
+    def __init__(self, tileSz, imageWidth, imageHeight):
+        self.tileSz = tileSz
+        self.cols = max(int(math.ceil(imageWidth / tileSz)), 1)
+        self.rows = max(int(math.ceil(imageHeight / tileSz)), 1)
+        self._cells = {}
+
+    def _clamp(self, value, count):
+        return min(max(int(math.floor(value / self.tileSz)), 0), count - 1)
+
+    def cellRange(self, bbox):
+        '''
+        return the (row0, row1, col0, col1) range of tiles touched by bbox,
+        bbox is (xmin, ymin, xmax, ymax) in image coordinates. the range is
+        inclusive and clamped to the grid. None if bbox is outside the grid.
+        '''
+        xmin, ymin, xmax, ymax = bbox
+        extentX = self.cols * self.tileSz
+        extentY = self.rows * self.tileSz
+        if xmax < 0 or ymax < 0 or xmin > extentX or ymin > extentY:
+            return None
+        col0 = self._clamp(xmin, self.cols)
+        col1 = self._clamp(xmax, self.cols)
+        row0 = self._clamp(ymin, self.rows)
+        row1 = self._clamp(ymax, self.rows)
+        return row0, row1, col0, col1
+
+    def insert(self, item, bbox):
+        cells = self.cellRange(bbox)
+        if cells is None:
+            return
+        row0, row1, col0, col1 = cells
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                self._cells.setdefault((row, col), []).append(item)
+
+    def query(self, row, col):
+        '''items registered on the tile (row, col), in insertion order.'''
+        return self._cells.get((row, col), [])
+
+    def queryRect(self, bbox):
+        '''
+        items registered on the tiles touched by bbox (xmin, ymin, xmax, ymax),
+        each once, in insertion order when items are inserted in increasing
+        order (e.g. shape indexes).
+        '''
+        cells = self.cellRange(bbox)
+        if cells is None:
+            return []
+        row0, row1, col0, col1 = cells
+        items = set()
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                items.update(self._cells.get((row, col), ()))
+        return sorted(items)
+
+    def cells(self):
+        '''the non empty tiles as (row, col), row by row.'''
+        return sorted(self._cells)
+
+    def __len__(self):
+        return len(self._cells)
+
+
+def bbox_of(points):
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
@@ -0,0 +1,480 @@
+import collections
+import concurrent.futures
+import copy
+import json
+import math
+import multiprocessing
+import os
+import os.path as osp
+import sys
+
+import numpy as np
+
+from .label_file import LabelFile
+from .labelme2COCO import img2map_array
+from .labelme2COCO import map2img_array
+from .labelme2COCO import tile_geotransform
+from .labelme2COCO import window_offset_array
+from .spatial_index import TileGridIndex
+
+
+# raster formats looked up next to a labelme json, in order of preference
+IMAGE_EXTS = ['.tif', '.env', '.pix', '.img', '.tiff', '.ecw', '.tga', '.jpg']
+
+LABEL_FILE_KEYS = [
+    'imageData',
+    'imagePath',
+    'lineColor',
+    'fillColor',
+    'shapes',  # polygonal annotations
+    'flags',   # image level flags
+    'imageHeight',
+    'imageWidth',
+]
+
+
+def my_basename(pathname):
+    """splitext for paths with directories that may contain dots."""
+    pathname = pathname.replace('\\', '/')
+    x = pathname.split('/')
+    path = x[-1]
+    ret, _ = my_splitext(path)
+    return ret
+
+
+def my_splitext(pathname):
+    """splitext for paths with directories that may contain dots."""
+    x = pathname.split(os.extsep)
+    path = x[0]
+    for ext in x[1:-1]:
+        path = path + '.' + ext
+    return path, x[-1]
+
+
+def find_image(label_file):
+    '''the raster next to a labelme json as (img_file, ext), (None, None) if missing.'''
+    filePathWithoutExt = my_splitext(label_file)[0]
+    for ext in IMAGE_EXTS:
+        img_file = filePathWithoutExt + ext
+        if osp.exists(img_file):
+            return img_file, ext
+    return None, None
+
+
+def clip_rect(rect, tileRect):
+    '''
+    intersection of two (xmin, ymin, xmax, ymax) rectangles, None when they do
+    not overlap (touching edges do not overlap).
+    '''
+    xmin = max(rect[0], tileRect[0])
+    ymin = max(rect[1], tileRect[1])
+    xmax = min(rect[2], tileRect[2])
+    ymax = min(rect[3], tileRect[3])
+    if xmin >= xmax or ymin >= ymax:
+        return None
+    return xmin, ymin, xmax, ymax
+
+
+def _clip_edge(points, inside, intersect):
+    clipped = []
+    if not points:
+        return clipped
+    prev = points[-1]
+    for cur in points:
+        if inside(cur):
+            if not inside(prev):
+                clipped.append(intersect(prev, cur))
+            clipped.append(cur)
+        elif inside(prev):
+            clipped.append(intersect(prev, cur))
+        prev = cur
+    return clipped
+
+
+def _at_x(x):
+    return lambda p, q: (x, p[1] + (q[1] - p[1]) * (x - p[0]) / (q[0] - p[0]))
+
+
+def _at_y(y):
+    return lambda p, q: (p[0] + (q[0] - p[0]) * (y - p[1]) / (q[1] - p[1]), y)
+
+
+def polygon_area(points):
+    area = 0.0
+    n = len(points)
+    for i in range(n):
+        x0, y0 = points[i]
+        x1, y1 = points[(i + 1) % n]
+        area += x0 * y1 - x1 * y0
+    return abs(area) / 2.0
+
+
+def clip_polygon(points, tileRect):
+    '''
+    clip a polygon to the (xmin, ymin, xmax, ymax) rectangle with the
+    Sutherland-Hodgman algorithm. like QPolygonF.intersected the result is
+    closed, its last point repeats the first one, and it is empty when the
+    polygon does not overlap the rectangle.
+    '''
+    xmin, ymin, xmax, ymax = tileRect
+    pts = [(p[0], p[1]) for p in points]
+    if len(pts) > 1 and pts[0] == pts[-1]:
+        pts = pts[:-1]
+    pts = _clip_edge(pts, lambda p: p[0] >= xmin, _at_x(xmin))
+    pts = _clip_edge(pts, lambda p: p[0] <= xmax, _at_x(xmax))
+    pts = _clip_edge(pts, lambda p: p[1] >= ymin, _at_y(ymin))
+    pts = _clip_edge(pts, lambda p: p[1] <= ymax, _at_y(ymax))
+    if len(pts) < 3 or polygon_area(pts) == 0:
+        return []
+    return pts + [pts[0]]
+
+
+# a window of a scene written as one tile, in image pixels. name is the
+# suffix of the tile files, <base>_<name>.json
+Window = collections.namedtuple('Window', 'name x y width height')
+
+
+class Sampling(object):
+    '''
+    where the tiles of a scene are cut.
+
+    grid: the non overlapping tileSz grid, tiles are named <row>_<col>.
+    sliding: tileSz windows every stride pixels (tileSz - overlap), they
+        overlap so that objects cut by a window border are whole in a
+        neighbour, named <row>_<col> in the stride grid.
+    chips: tileSz chips centered on the annotations, an annotation already
+        inside a chip does not get its own, named chip_<y>_<x>.
+
+    the windows are found with a spatial index of the shapes, only the ones
+    touching a shape are ever clipped and read from the raster.
+    '''
+
+    modes = ('grid', 'sliding', 'chips')
+
+    def __init__(self, tileSz, mode='grid', overlap=0):
+        if mode not in self.modes:
+            raise ValueError('Unsupported sampling mode: %s' % mode)
+        if mode == 'sliding' and not 0 <= overlap < tileSz:
+            raise ValueError('The overlap must be in [0, %d)' % tileSz)
+        self.tileSz = tileSz
+        self.mode = mode
+        self.stride = tileSz - overlap if mode == 'sliding' else tileSz
+
+    def windows(self, imageWidth, imageHeight, index, bboxes):
+        '''
+        the windows touching the shapes, row by row. index is a TileGridIndex
+        of stride cells, bboxes the bounding boxes of the indexed shapes.
+        '''
+        tileSz = self.tileSz
+        if self.mode == 'chips':
+            return self._chips(imageWidth, imageHeight, bboxes)
+        stride = self.stride
+        cols = max(int(math.ceil((imageWidth - tileSz) / stride)), 0) + 1
+        rows = max(int(math.ceil((imageHeight - tileSz) / stride)), 0) + 1
+        starts = set()
+        for row, col in index.cells():
+            # the windows whose [start, start + tileSz) covers the cell
+            for r in range(max(row - (tileSz - 1) // stride, 0), min(row, rows - 1) + 1):
+                for c in range(max(col - (tileSz - 1) // stride, 0), min(col, cols - 1) + 1):
+                    starts.add((r, c))
+        windows = []
+        for row, col in sorted(starts):
+            x, y = col * stride, row * stride
+            windows.append(Window('{}_{}'.format(row, col), x, y,
+                                  min(tileSz, imageWidth - x),
+                                  min(tileSz, imageHeight - y)))
+        return windows
+
+    def _chips(self, imageWidth, imageHeight, bboxes):
+        tileSz = self.tileSz
+        width, height = min(tileSz, imageWidth), min(tileSz, imageHeight)
+        chips = TileGridIndex(tileSz, imageWidth, imageHeight)
+        windows = []
+        for bbox in sorted(b for b in bboxes if b is not None):
+            xmin, ymin, xmax, ymax = bbox
+            covered = False
+            for window in chips.queryRect(bbox):
+                if window.x <= xmin and xmax <= window.x + window.width and \
+                        window.y <= ymin and ymax <= window.y + window.height:
+                    covered = True
+                    break
+            if covered:
+                continue
+            x = int(round((xmin + xmax - width) / 2.0))
+            y = int(round((ymin + ymax - height) / 2.0))
+            x = min(max(x, 0), imageWidth - width)
+            y = min(max(y, 0), imageHeight - height)
+            window = Window('chip_{}_{}'.format(y, x), x, y, width, height)
+            windows.append(window)
+            chips.insert(window, (x, y, x + width, y + height))
+        windows.sort(key=lambda w: (w.y, w.x))
+        return windows
+
+
+def split_scene(label_file, outDir, sampling, extension, band=None, bandSize=None):
+    '''
+    clip the shapes of one labelme json to the windows of its raster chosen by
+    sampling (a Sampling, or a tile size for the grid) and write one json per
+    non empty window into outDir, named <base>_<window.name>.json.
+
+    when band is None and the scene has more than bandSize windows nothing is
+    written, the scene is cut into bands instead so that they can run on
+    several workers. a band is (windows, data): bandSize windows and the label
+    json with only the shapes touching them, the json is parsed once per scene.
+
+    return (labels, windows, bands), windows are the Window written.
+    '''
+    if not isinstance(sampling, Sampling):
+        sampling = Sampling(sampling)
+    base = my_splitext(osp.basename(label_file))[0]
+    if band is not None:
+        windows, data = band
+    else:
+        with open(label_file) as f:
+            data = json.load(f)  #data is json file's content
+    lineColor = data['lineColor']
+    fillColor = data['fillColor']
+    imageHeight = data['imageHeight']
+    imageWidth = data['imageWidth']
+    flags = data['flags']
+    otherData = {}
+    for key, value in data.items():
+        if key not in LABEL_FILE_KEYS:
+            otherData[key] = value
+    geoTrans = otherData['geoTrans']
+    labels = sorted(set(s['label'] for s in data['shapes']))
+
+    # convert every shape to image coordination once and register its
+    # bounding box on the cells it touches, so that a window only clips
+    # the shapes that can intersect it.
+    index = TileGridIndex(sampling.stride, imageWidth, imageHeight)
+    imgPoints = [None] * len(data['shapes'])
+    bboxes = [None] * len(data['shapes'])
+    indexed = [i_s for i_s, s in enumerate(data['shapes'])
+               if s.get('shape_type', 'polygon') in ('rectangle', 'polygon', 'slantRectangle')
+               and len(s['points']) > 0]
+    if indexed:
+        counts = [len(data['shapes'][i_s]['points']) for i_s in indexed]
+        starts = np.cumsum([0] + counts[:-1])
+        points = map2img_array(
+            geoTrans, [p for i_s in indexed for p in data['shapes'][i_s]['points']])
+        mins = np.minimum.reduceat(points, starts)
+        maxs = np.maximum.reduceat(points, starts)
+        for k, i_s in enumerate(indexed):
+            imgPoints[i_s] = points[starts[k]:starts[k] + counts[k]].tolist()
+            bboxes[i_s] = tuple(mins[k].tolist() + maxs[k].tolist())
+            index.insert(i_s, bboxes[i_s])
+
+    if band is None:
+        windows = sampling.windows(imageWidth, imageHeight, index, bboxes)
+        if bandSize and len(windows) > bandSize:
+            bands = []
+            for start in range(0, len(windows), bandSize):
+                part = windows[start:start + bandSize]
+                touched = set()
+                for w in part:
+                    touched.update(index.queryRect((w.x, w.y, w.x + w.width, w.y + w.height)))
+                sub = dict(data)
+                sub['shapes'] = [data['shapes'][i_s] for i_s in sorted(touched)]
+                bands.append((part, sub))
+            return labels, [], bands
+
+    written = []
+    for window in windows:
+        x, y, iw, ih = window.x, window.y, window.width, window.height
+        #get the window rect (image coordination system)
+        tileRect = (x, y, x + iw, y + ih)
+        shapes = []
+        for i_s in index.queryRect(tileRect):
+            s = data['shapes'][i_s]
+            shape_type = s.get('shape_type', 'polygon')
+            points = imgPoints[i_s]
+            if(shape_type == 'rectangle'):
+                intersected = clip_rect(bboxes[i_s], tileRect)
+                if(intersected is not None):
+                    xmin, ymin, xmax, ymax = intersected
+                    corners = [(xmin, ymin), (xmax, ymax)]
+                    if(math.isclose(geoTrans[0], 0)):
+                        corners = window_offset_array(x, y, ih, corners)
+                    else:
+                        corners = img2map_array(geoTrans, corners)
+                    copyS = copy.deepcopy(s)
+                    copyS['points'] = corners.tolist()
+                    shapes.append(copyS)
+            elif(shape_type == 'polygon' or shape_type=='slantRectangle' ):
+                polygon = clip_polygon(points, tileRect)
+                if(len(polygon) > 0):
+                    copyS = copy.deepcopy(s)
+                    if(math.isclose(geoTrans[0], 0)):
+                        pts = window_offset_array(x, y, ih, polygon)
+                    else:
+                        pts = img2map_array(geoTrans, polygon)
+                    copyS['points'] = pts.tolist()
+                    shapes.append(copyS)
+        if (len(shapes) == 0):
+            continue
+        label_file_t = osp.join(outDir, '{}_{}.{}'.format(base, window.name, 'json'))
+        imagePath = '{}_{}.{}'.format(base, window.name, extension[1:])
+        written.append(window)
+        #begin to create json file for the block file
+        if(math.isclose(geoTrans[0], 0)):
+            otherData['geoTrans'] = [0,1,0,ih,0,-1]
+        else:
+            otherData['geoTrans'] = tile_geotransform(geoTrans, x, y)
+        lf = LabelFile()
+        lf.save(
+            filename=label_file_t,
+            shapes=shapes,
+            imagePath=imagePath,
+            imageData=None,
+            imageHeight=ih,
+            imageWidth=iw,
+            lineColor=lineColor,
+            fillColor=fillColor,
+            otherData=otherData,
+            flags=flags,
+        )
+    return labels, written, []
+
+
+class TileScene(object):
+    '''one labelme json and its raster, as scheduled by the TilingEngine.'''
+
+    def __init__(self, label_file, img_file, extension, outDir):
+        self.label_file = label_file
+        self.img_file = img_file
+        self.extension = extension
+        self.base = my_splitext(osp.basename(label_file))[0]
+        self.outDir = outDir
+        self.windows = []
+        self.labels = set()
+        self.pending = 0
+        self.tasks = 1  # its band tasks are known once the first one is done
+        self.tasksDone = 0
+
+
+class _InlineExecutor(object):
+    '''runs the tasks in the calling process, used when there is a single worker.'''
+
+    def submit(self, fn, *args, **kwargs):
+        future = concurrent.futures.Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def _processPool(workers):
+    # inside RSLabel.exe sys.executable is the host application, the worker
+    # processes must be started with the python interpreter shipped next to it.
+    if sys.platform == 'win32' and \
+            not osp.basename(sys.executable).lower().startswith('python'):
+        for exe in ('pythonw.exe', 'python.exe'):
+            exe = osp.join(sys.exec_prefix, exe)
+            if osp.exists(exe):
+                multiprocessing.set_executable(exe)
+                break
+    return concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+
+
+class TilingEngine(object):
+    '''
+    split labelme json files to tiles on a pool of worker processes.
+
+    every scene is one task, scenes with more than bandSize windows are cut in
+    bands of windows that run as separate tasks. the tiles of a scene are
+    written to <outDir>/<base>/<base>_<window>.json. sampling is a Sampling,
+    or a tile size for the grid.
+    '''
+
+    def __init__(self, sampling, outDir, workers=None, bandSize=256):
+        if not isinstance(sampling, Sampling):
+            sampling = Sampling(sampling)
+        self.sampling = sampling
+        self.outDir = outDir
+        self.workers = workers or os.cpu_count() or 1
+        self.bandSize = bandSize
+        self.labels = set()
+
+    def scenes(self, label_files):
+        scenes = []
+        for label_file in label_files:
+            img_file, extension = find_image(label_file)
+            if img_file is None:
+                continue
+            base = my_splitext(osp.basename(label_file))[0]
+            scenes.append(TileScene(label_file, img_file, extension,
+                                    osp.join(self.outDir, base)))
+        return scenes
+
+    def run(self, label_files, progress=None, cancelled=None, sceneDone=None):
+        '''
+        progress(done, total) is called each time a task finishes, in hundredths
+        of a scene so that it never goes back when the bands of a big scene are
+        queued, cancelled() is
+        polled while waiting and stops the run as soon as it returns True, tasks
+        already running are finished and the queued ones dropped. sceneDone(scene)
+        is called in the calling thread once every tile of a scene is written.
+
+        return False if the run was cancelled.
+        '''
+        scenes = self.scenes(label_files)
+        for scene in scenes:
+            if not osp.exists(scene.outDir):
+                os.makedirs(scene.outDir)
+        # tasks are (scene, band), only a few of them are handed to the pool at
+        # a time so that a cancel does not have to drain a long queue.
+        tasks = collections.deque()
+        for scene in scenes:
+            tasks.append((scene, None))
+            scene.pending += 1
+        if self.workers > 1 and len(scenes) > 0:
+            executor = _processPool(self.workers)
+        else:
+            executor = _InlineExecutor()
+        pending = {}
+        done = 0  # hundredths of a scene
+        try:
+            while tasks or pending:
+                if cancelled is not None and cancelled():
+                    return False
+                while tasks and len(pending) < 2 * self.workers:
+                    scene, band = tasks.popleft()
+                    future = executor.submit(
+                        split_scene, scene.label_file, scene.outDir, self.sampling,
+                        scene.extension, band, self.bandSize)
+                    pending[future] = scene
+                finished, _ = concurrent.futures.wait(
+                    list(pending), timeout=0.1,
+                    return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    scene = pending.pop(future)
+                    scene.pending -= 1
+                    labels, windows, bands = future.result()
+                    self.labels.update(labels)
+                    scene.labels.update(labels)
+                    scene.windows.extend(windows)
+                    # bands of a big scene go first, its other tiles are waiting
+                    tasks.extendleft((scene, band) for band in reversed(bands))
+                    scene.pending += len(bands)
+                    scene.tasks += len(bands)
+                    if scene.pending == 0:
+                        scene.windows.sort(key=lambda w: (w.y, w.x))
+                        if sceneDone is not None:
+                            sceneDone(scene)
+                    # the share of a scene done only grows, its tasks are all
+                    # known after the first one
+                    before = 100 * scene.tasksDone // scene.tasks
+                    scene.tasksDone += 1
+                    done += 100 * scene.tasksDone // scene.tasks - before
+                    if progress is not None:
+                        progress(done, 100 * len(scenes))
+            return True
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
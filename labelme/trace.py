@@ -0,0 +1,134 @@
+'''
+timings of the slow steps, image open, statistics, json parse, shape build,
+save and the export stages, as chrome trace events.
+
+spans are only recorded once tracing is started, from the `trace` config key
+or the RSLABEL_TRACE environment variable, both the path of the trace file.
+the file is written when tracing stops, at exit at the latest, and opens in
+chrome://tracing or https://ui.perfetto.dev.
+
+    with span('json parse', file=filename):
+        ...
+
+the duration of every span is also logged to RSLabel.trace at debug level.
+'''
+
+import atexit
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from . import logger
+
+
+log = logger.getChild('trace')
+
+
+class Tracer(object):
+    '''the trace events of this process, safe to record from any thread.'''
+
+    def __init__(self):
+        self.filename = None
+        self._events = []
+        self._threads = set()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def start(self, filename):
+        with self._lock:
+            self.filename = filename
+            self._events = []
+            self._threads = set()
+            self._pid = os.getpid()
+
+    def stop(self):
+        '''write the trace file and stop recording.'''
+        with self._lock:
+            filename, self.filename = self.filename, None
+            events, self._events = self._events, []
+            # a forked worker inherits the tracer but does not own the file
+            if filename is None or os.getpid() != self._pid:
+                return
+            tmp = filename + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+            os.replace(tmp, filename)
+        log.info('trace written to {}'.format(filename))
+
+    def add(self, name, start, end, args):
+        '''a span from start to end, time.perf_counter() seconds.'''
+        thread = threading.current_thread()
+        with self._lock:
+            if self.filename is None:
+                return
+            tid = thread.ident
+            if tid not in self._threads:
+                self._threads.add(tid)
+                self._events.append({
+                    'name': 'thread_name', 'ph': 'M', 'pid': self._pid,
+                    'tid': tid, 'args': {'name': thread.name}})
+            self._events.append({
+                'name': name, 'cat': 'rslabel', 'ph': 'X', 'pid': self._pid,
+                'tid': tid, 'ts': start * 1e6, 'dur': (end - start) * 1e6,
+                'args': args})
+
+
+tracer = Tracer()
+
+
+class _Span(object):
+
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        tracer.add(self.name, self.start, end, self.args)
+        log.debug('{} took {:.1f} ms {}'.format(
+            self.name, (end - self.start) * 1000, self.args or ''))
+        return False
+
+
+class _NoSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_noSpan = _NoSpan()
+
+
+def span(name, **args):
+    '''a context manager timing its block, nothing when nobody listens.'''
+    if tracer.filename is None and not log.isEnabledFor(logging.DEBUG):
+        return _noSpan
+    return _Span(name, args)
+
+
+def start_trace(filename):
+    tracer.start(filename)
+    log.info('tracing to {}'.format(filename))
+
+
+def stop_trace():
+    tracer.stop()
+
+
+# the worker processes of an export would write over the trace of the main one
+if os.environ.get('RSLABEL_TRACE') and \
+        multiprocessing.current_process().name == 'MainProcess':
+    start_trace(os.environ['RSLABEL_TRACE'])
+atexit.register(stop_trace)
@@ -5,9 +5,13 @@ from ._io import lblsave
 from .image import img_arr_to_b64
 from .image import img_b64_to_arr
 
+from .shape import iter_label_strips
 from .shape import labelme_shapes_to_label
 from .shape import masks_to_bboxes
+from .shape import min_area_rects
 from .shape import polygons_to_mask
+from .shape import rasterize_shapes
+from .shape import shape_bbox
 from .shape import shape_to_mask
 from .shape import shapes_to_label
 
@@ -16,12 +20,16 @@ from .draw import draw_label
 from .draw import label_colormap
 from .draw import label2rgb
 
-from .qt import newIcon
-from .qt import newButton
-from .qt import newAction
-from .qt import addActions
-from .qt import labelValidator
-from .qt import struct
-from .qt import distance
-from .qt import distancetoline
-from .qt import fmtShortcut
+# the Qt helpers are not needed by the headless exporter (labelme.exporter)
+try:
+    from .qt import newIcon
+    from .qt import newButton
+    from .qt import newAction
+    from .qt import addActions
+    from .qt import labelValidator
+    from .qt import struct
+    from .qt import distance
+    from .qt import distancetoline
+    from .qt import fmtShortcut
+except ImportError:
+    pass
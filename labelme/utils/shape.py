@@ -10,60 +10,225 @@ def polygons_to_mask(img_shape, polygons, shape_type=None):
     return shape_to_mask(img_shape, points=polygons, shape_type=shape_type)
 
 
-def shape_to_mask(img_shape, points, shape_type=None,
-                  line_width=10, point_size=5):
-    mask = np.zeros(img_shape[:2], dtype=np.uint8)
-    mask = PIL.Image.fromarray(mask)
-    draw = PIL.ImageDraw.Draw(mask)
-    xy = [tuple(point) for point in points]
+def _draw_shape(draw, xy, shape_type, fill, line_width, point_size):
     if shape_type == 'circle':
         assert len(xy) == 2, 'Shape of shape_type=circle must have 2 points'
         (cx, cy), (px, py) = xy
         d = math.sqrt((cx - px) ** 2 + (cy - py) ** 2)
-        draw.ellipse([cx - d, cy - d, cx + d, cy + d], outline=1, fill=1)
+        draw.ellipse([cx - d, cy - d, cx + d, cy + d], outline=fill, fill=fill)
     elif shape_type == 'rectangle':
         assert len(xy) == 2, 'Shape of shape_type=rectangle must have 2 points'
-        draw.rectangle(xy, outline=1, fill=1)
+        draw.rectangle(xy, outline=fill, fill=fill)
     elif shape_type == 'line':
         assert len(xy) == 2, 'Shape of shape_type=line must have 2 points'
-        draw.line(xy=xy, fill=1, width=line_width)
+        draw.line(xy=xy, fill=fill, width=line_width)
     elif shape_type == 'linestrip':
-        draw.line(xy=xy, fill=1, width=line_width)
+        draw.line(xy=xy, fill=fill, width=line_width)
     elif shape_type == 'point':
         assert len(xy) == 1, 'Shape of shape_type=point must have 1 points'
         cx, cy = xy[0]
         r = point_size
-        draw.ellipse([cx - r, cy - r, cx + r, cy + r], outline=1, fill=1)
+        draw.ellipse([cx - r, cy - r, cx + r, cy + r], outline=fill, fill=fill)
     else:
         assert len(xy) > 2, 'Polygon must have points more than 2'
-        draw.polygon(xy=xy, outline=1, fill=1)
+        draw.polygon(xy=xy, outline=fill, fill=fill)
+
+
+def shape_to_mask(img_shape, points, shape_type=None,
+                  line_width=10, point_size=5):
+    mask = np.zeros(img_shape[:2], dtype=np.uint8)
+    mask = PIL.Image.fromarray(mask)
+    draw = PIL.ImageDraw.Draw(mask)
+    xy = [tuple(point) for point in points]
+    _draw_shape(draw, xy, shape_type, 1, line_width, point_size)
     mask = np.array(mask, dtype=bool)
     return mask
 
 
-def shapes_to_label(img_shape, shapes, label_name_to_value, type='class'):
-    assert type in ['class', 'instance']
+def shape_bbox(points, shape_type=None, line_width=10, point_size=5):
+    '''(x0, y0, x1, y1) bounding box of the pixels a shape can cover.'''
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    (x0, y0), (x1, y1) = points.min(0), points.max(0)
+    if shape_type == 'circle' and len(points) == 2:
+        d = math.sqrt(((points[0] - points[1]) ** 2).sum())
+        cx, cy = points[0]
+        x0, y0, x1, y1 = cx - d, cy - d, cx + d, cy + d
+    elif shape_type in ('line', 'linestrip'):
+        m = line_width / 2.0
+        x0, y0, x1, y1 = x0 - m, y0 - m, x1 + m, y1 + m
+    elif shape_type == 'point':
+        x0, y0, x1, y1 = x0 - point_size, y0 - point_size, \
+            x1 + point_size, y1 + point_size
+    # one pixel of slack for the rounding of PIL
+    return (int(math.floor(x0)) - 1, int(math.floor(y0)) - 1,
+            int(math.ceil(x1)) + 2, int(math.ceil(y1)) + 2)
 
-    cls = np.zeros(img_shape[:2], dtype=np.int32)
-    if type == 'instance':
-        ins = np.zeros(img_shape[:2], dtype=np.int32)
-        instance_names = ['_background_']
+
+def _convex_hull(points):
+    '''the convex hull of (k, 2) points, counter-clockwise, monotone chain.'''
+    pts = sorted(set(map(tuple, points.tolist())))
+    if len(pts) < 3:
+        return np.array(pts, dtype=np.float64).reshape(-1, 2)
+
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+    lower, upper = [], []
+    for p in pts:
+        while len(lower) >= 2 and cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(pts):
+        while len(upper) >= 2 and cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+    return np.array(lower[:-1] + upper[:-1], dtype=np.float64)
+
+
+def min_area_rects(points, counts):
+    '''
+    the minimal area rectangle around each group of points, the groups are
+    counts[i] consecutive points of points. return an (n, 4, 2) array of
+    corners, clockwise in image coordinates. a side of the rectangle lies on
+    an edge of the convex hull of the group, the edges of every group are
+    tried at once.
+    '''
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    if len(counts) == 0:
+        return np.zeros((0, 4, 2))
+    ends = np.cumsum(counts)
+    hulls = [_convex_hull(points[end - count:end])
+             for end, count in zip(ends, counts)]
+    sizes = np.array([len(h) for h in hulls])
+    hull = np.concatenate(hulls)
+    starts = np.cumsum(sizes) - sizes
+    group = np.repeat(np.arange(len(hulls)), sizes)
+    # the edges of the hulls, the last point of a hull goes back to its first
+    nxt = np.arange(1, len(hull) + 1)
+    nxt[starts + sizes - 1] = starts
+    edges = hull[nxt] - hull
+    lengths = np.hypot(edges[:, 0], edges[:, 1])
+    u = np.where(lengths[:, None] > 0, edges / np.maximum(lengths, 1e-12)[:, None],
+                 [1.0, 0.0])
+    v = np.stack([-u[:, 1], u[:, 0]], axis=1)
+    # every edge against every point of its hull
+    pairs = sizes[group]
+    pairStarts = np.cumsum(pairs) - pairs
+    edgeOf = np.repeat(np.arange(len(hull)), pairs)
+    pointOf = np.repeat(starts[group] - pairStarts, pairs) + np.arange(pairs.sum())
+    pu = (hull[pointOf] * u[edgeOf]).sum(1)
+    pv = (hull[pointOf] * v[edgeOf]).sum(1)
+    umin, umax = np.minimum.reduceat(pu, pairStarts), np.maximum.reduceat(pu, pairStarts)
+    vmin, vmax = np.minimum.reduceat(pv, pairStarts), np.maximum.reduceat(pv, pairStarts)
+    area = (umax - umin) * (vmax - vmin)
+    # the smallest rectangle of each group
+    best = np.lexsort((area, group))[starts]
+    u, v = u[best][:, None, :], v[best][:, None, :]
+    a = np.stack([umin[best], umax[best], umax[best], umin[best]], axis=1)[:, :, None]
+    b = np.stack([vmin[best], vmin[best], vmax[best], vmax[best]], axis=1)[:, :, None]
+    return a * u + b * v
+
+
+def rasterize_shapes(shapes, values, window, bboxes=None,
+                     line_width=10, point_size=5):
+    '''
+    draw shapes into one int32 label array covering window, (x0, y0, x1, y1)
+    in image pixels. shape i is drawn with values[i], in the order of the list:
+    a shape covers the shapes before it. shapes whose bounding box (bboxes, as
+    shape_bbox returns them) misses the window are not drawn at all.
+
+    the pixels are the ones the whole image would get (but for the rare
+    pixel the float offset rounds differently): PIL truncates coordinates
+    towards zero, so a shape is only moved by an offset that keeps its
+    coordinates on the same side of zero. a shape that crosses the top or
+    left edge of the window is drawn on its own bounding box window first.
+    '''
+    x0, y0, x1, y1 = window
+    canvas = PIL.Image.new('I', (x1 - x0, y1 - y0), 0)
+    draw = PIL.ImageDraw.Draw(canvas)
+    for i, shape in enumerate(shapes):
+        shape_type = shape.get('shape_type', None)
+        if bboxes is not None:
+            bx0, by0, bx1, by1 = bboxes[i]
+        else:
+            bx0, by0, bx1, by1 = shape_bbox(
+                shape['points'], shape_type, line_width, point_size)
+        if bx1 <= x0 or by1 <= y0 or bx0 >= x1 or by0 >= y1:
+            continue
+        ox = min(x0, max(bx0, 0))
+        oy = min(y0, max(by0, 0))
+        xy = [(p[0] - ox, p[1] - oy) for p in shape['points']]
+        if ox == x0 and oy == y0:
+            _draw_shape(draw, xy, shape_type, int(values[i]),
+                        line_width, point_size)
+            continue
+        # the part of the shape inside the window, drawn from (ox, oy)
+        w = min(x1, bx1) - ox
+        h = min(y1, by1) - oy
+        mask = PIL.Image.new('L', (w, h), 0)
+        _draw_shape(PIL.ImageDraw.Draw(mask), xy, shape_type, 255,
+                    line_width, point_size)
+        mask = mask.crop((x0 - ox, y0 - oy, w, h))
+        canvas.paste(int(values[i]), (0, 0) + mask.size, mask)
+    return np.array(canvas, dtype=np.int32)
+
+
+def _label_values(shapes, label_name_to_value, type):
+    cls_ids = []
+    ins_ids = []
+    instance_names = ['_background_']
     for shape in shapes:
-        points = shape['points']
         label = shape['label']
-        shape_type = shape.get('shape_type', None)
         if type == 'class':
             cls_name = label
         elif type == 'instance':
             cls_name = label.split('-')[0]
             if label not in instance_names:
                 instance_names.append(label)
-            ins_id = len(instance_names) - 1
-        cls_id = label_name_to_value[cls_name]
-        mask = shape_to_mask(img_shape[:2], points, shape_type)
-        cls[mask] = cls_id
+            ins_ids.append(len(instance_names) - 1)
+        cls_ids.append(label_name_to_value[cls_name])
+    return cls_ids, ins_ids
+
+
+def iter_label_strips(img_shape, shapes, label_name_to_value, type='class',
+                      max_memory=None):
+    '''
+    rasterize shapes_to_label in horizontal strips that fit in max_memory
+    bytes (the whole image when None). yield (row, cls) or, for type
+    'instance', (row, cls, ins), row is the first image row of the strip.
+    '''
+    assert type in ['class', 'instance']
+    height, width = img_shape[:2]
+    cls_ids, ins_ids = _label_values(shapes, label_name_to_value, type)
+    bboxes = [shape_bbox(s['points'], s.get('shape_type', None))
+              for s in shapes]
+    rows = height
+    if max_memory is not None:
+        # an int32 canvas and its numpy copy, per label array
+        per_row = width * 4 * 2 * (2 if type == 'instance' else 1)
+        rows = min(max(int(max_memory // max(per_row, 1)), 1), height)
+    for row in range(0, height, rows):
+        window = (0, row, width, min(row + rows, height))
+        cls = rasterize_shapes(shapes, cls_ids, window, bboxes)
+        if type == 'instance':
+            yield row, cls, rasterize_shapes(shapes, ins_ids, window, bboxes)
+        else:
+            yield row, cls
+
+
+def shapes_to_label(img_shape, shapes, label_name_to_value, type='class',
+                    max_memory=None):
+    assert type in ['class', 'instance']
+
+    cls = np.zeros(img_shape[:2], dtype=np.int32)
+    if type == 'instance':
+        ins = np.zeros(img_shape[:2], dtype=np.int32)
+    for strip in iter_label_strips(img_shape, shapes, label_name_to_value,
+                                   type, max_memory):
+        row = strip[0]
+        cls[row:row + len(strip[1])] = strip[1]
         if type == 'instance':
-            ins[mask] = ins_id
+            ins[row:row + len(strip[2])] = strip[2]
 
     if type == 'instance':
         return cls, ins
@@ -0,0 +1,225 @@
+'''
+every shape of a project as the features of a vector layer, through OGR, so
+that the annotations open in a GIS at once.
+
+the points of the shapes are stored in map coordinates (see geoTrans), they
+are written as they are, in the projection of the first georeferenced raster.
+the features of a raster in another projection are reprojected to it.
+'''
+
+import json
+import math
+import os.path as osp
+import struct
+
+import numpy as np
+
+from . import logger
+from .tiling import find_image
+
+try:
+    from osgeo import gdal
+    from osgeo import ogr
+    from osgeo import osr
+except ImportError:
+    import gdal
+    import ogr
+    import osr
+
+
+# the geometry family of every shape type, a shapefile holds a single one
+FAMILIES = {
+    'polygon': 'polygon',
+    'rectangle': 'polygon',
+    'slantRectangle': 'polygon',
+    'circle': 'polygon',
+    'line': 'line',
+    'linestrip': 'line',
+    'point': 'point',
+}
+
+CIRCLE_VERTICES = 64
+
+
+def shape_wkb(points, shape_type):
+    '''the little endian WKB of a shape, None when it has too few points.'''
+    family = FAMILIES.get(shape_type)
+    pts = np.asarray(points, dtype='<f8').reshape(-1, 2)
+    if family == 'point':
+        if len(pts) < 1:
+            return None
+        return struct.pack('<BI', 1, ogr.wkbPoint) + pts[0].tobytes()
+    if family == 'line':
+        if len(pts) < 2:
+            return None
+        return struct.pack('<BII', 1, ogr.wkbLineString, len(pts)) + pts.tobytes()
+    if shape_type == 'rectangle':
+        if len(pts) != 2:
+            return None
+        (x0, y0), (x1, y1) = pts
+        pts = np.array([(x0, y0), (x1, y0), (x1, y1), (x0, y1)], dtype='<f8')
+    elif shape_type == 'circle':
+        if len(pts) != 2:
+            return None
+        r = math.hypot(*(pts[1] - pts[0]))
+        t = np.linspace(0, 2 * math.pi, CIRCLE_VERTICES, endpoint=False)
+        pts = pts[0] + r * np.stack([np.cos(t), np.sin(t)], axis=1)
+    if len(pts) < 3:
+        return None
+    ring = np.concatenate([pts, pts[:1]]).astype('<f8')
+    return struct.pack('<BIII', 1, ogr.wkbPolygon, 1, len(ring)) + ring.tobytes()
+
+
+class VectorExporter(object):
+    '''
+    write the shapes of labelme json files to filename, a GeoPackage with one
+    layer, annotations, or shapefiles, one per geometry family
+    (<name>_polygon.shp, <name>_line.shp and <name>_point.shp). features get
+    the label, probability, shape_type and image of their shape.
+
+    the features are inserted in transactions of batchSize features and the
+    spatial index is built once they are all in.
+    '''
+
+    drivers = {'gpkg': 'GPKG', 'shp': 'ESRI Shapefile'}
+
+    def __init__(self, filename, format='gpkg', batchSize=20000):
+        if format not in self.drivers:
+            raise ValueError('Unsupported vector format: %s' % format)
+        self.filename = filename
+        self.format = format
+        self.batchSize = batchSize
+        self.labels = set()
+        self.count = 0
+        self._ds = {}      # layer name -> dataset
+        self._layers = {}  # layer name -> layer
+        self._srs = None
+        self._pending = 0
+
+    def write(self, label_files, progress=None, cancelled=None):
+        '''
+        write the shapes of label_files, progress(done, total) is called after
+        each file, cancelled() stops the export when it returns True. return
+        False if cancelled, what was written so far is kept.
+        '''
+        try:
+            for i, label_file in enumerate(label_files):
+                if cancelled is not None and cancelled():
+                    return False
+                self.writeFile(label_file)
+                if progress is not None:
+                    progress(i + 1, len(label_files))
+            return True
+        finally:
+            self.close()
+
+    def writeFile(self, label_file):
+        with open(label_file) as f:
+            data = json.load(f)
+        image = osp.normpath(osp.join(osp.dirname(label_file), data['imagePath']))
+        transform = self._transform(label_file)
+        for shape in data['shapes']:
+            shape_type = shape.get('shape_type') or 'polygon'
+            wkb = shape_wkb(shape['points'], shape_type)
+            if wkb is None:
+                continue
+            layer = self._layer(FAMILIES[shape_type])
+            geometry = ogr.CreateGeometryFromWkb(wkb)
+            if transform is not None:
+                geometry.Transform(transform)
+            feature = ogr.Feature(layer.GetLayerDefn())
+            feature.SetGeometryDirectly(geometry)
+            feature.SetField(0, shape['label'])
+            probability = shape.get('probability')
+            if probability is not None:
+                feature.SetField(1, float(probability))
+            feature.SetField(2, shape_type)
+            feature.SetField(3, image)
+            layer.CreateFeature(feature)
+            self.labels.add(shape['label'])
+            self.count += 1
+            self._pending += 1
+            if self._pending >= self.batchSize:
+                self._commit(begin=True)
+
+    def _transform(self, label_file):
+        '''the transformation of the raster of label_file to the layer srs.'''
+        img_file, _ = find_image(label_file)
+        if img_file is None:
+            return None
+        img = gdal.Open(img_file)
+        wkt = img.GetProjection() if img is not None else ''
+        img = None
+        if not wkt:
+            return None
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(wkt)
+        if hasattr(srs, 'SetAxisMappingStrategy'):  # GDAL 3
+            srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        if self._srs is None:
+            if self._layers:
+                logger.warn('{} is georeferenced but the features before it '
+                            'are not, the layer has no projection'.format(img_file))
+                self._srs = False
+            else:
+                self._srs = srs
+                return None
+        if not self._srs or self._srs.IsSame(srs):
+            return None
+        return osr.CoordinateTransformation(srs, self._srs)
+
+    def _layer(self, family):
+        if self.format == 'gpkg':
+            name = 'annotations'
+        else:
+            name = '{}_{}'.format(osp.splitext(osp.basename(self.filename))[0], family)
+        layer = self._layers.get(name)
+        if layer is not None:
+            return layer
+        driver = ogr.GetDriverByName(self.drivers[self.format])
+        if self.format == 'gpkg':
+            filename, geomType = self.filename, ogr.wkbUnknown
+            options = ['SPATIAL_INDEX=NO']
+        else:
+            filename = osp.join(osp.dirname(self.filename), name + '.shp')
+            geomType = {'polygon': ogr.wkbPolygon, 'line': ogr.wkbLineString,
+                        'point': ogr.wkbPoint}[family]
+            options = ['ENCODING=UTF-8']
+        if osp.exists(filename):
+            driver.DeleteDataSource(filename)
+        ds = driver.CreateDataSource(filename)
+        srs = self._srs or None
+        layer = ds.CreateLayer(name, srs, geomType, options)
+        for fieldName, fieldType in (('label', ogr.OFTString),
+                                     ('probability', ogr.OFTReal),
+                                     ('shape_type', ogr.OFTString),
+                                     ('image', ogr.OFTString)):
+            layer.CreateField(ogr.FieldDefn(fieldName, fieldType))
+        self._ds[name] = ds
+        self._layers[name] = layer
+        if ds.TestCapability(ogr.ODsCTransactions):
+            ds.StartTransaction()
+        return layer
+
+    def _commit(self, begin):
+        for ds in self._ds.values():
+            if ds.TestCapability(ogr.ODsCTransactions):
+                ds.CommitTransaction()
+                if begin:
+                    ds.StartTransaction()
+        self._pending = 0
+
+    def close(self):
+        '''commit the last features, build the spatial indexes and close.'''
+        if not self._ds:
+            return
+        self._commit(begin=False)
+        for name, ds in self._ds.items():
+            if self.format == 'gpkg':
+                geom = self._layers[name].GetGeometryColumn()
+                ds.ReleaseResultSet(ds.ExecuteSQL(
+                    "SELECT CreateSpatialIndex('{}', '{}')".format(name, geom)))
+            else:
+                ds.ExecuteSQL('CREATE SPATIAL INDEX ON {}'.format(name))
+        self._layers = {}
+        self._ds = {}
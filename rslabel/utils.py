@@ -9,8 +9,14 @@ from PyQt5.QtCore import QCoreApplication,QLocale
 import sys
 import traceback
 import glob
+import logging
 import os.path
 import re
+import time
+
+
+# a child of the RSLabel logger of the labelme plugin
+log = logging.getLogger('RSLabel.utils')
 
 
 #######################
@@ -45,9 +51,8 @@ def initInterface(pointer):
   from sip import wrapinstance
   from rslabel.gui import QgisInterface
   global iface
-  print('begin to wrap instance...')
   iface = wrapinstance(pointer, QgisInterface)
-  print('wrap instance end' )
+  log.debug('wrapped the host interface')
 
 
 #######################
@@ -91,7 +96,7 @@ def pluginMetadata(packageName, fct):
     package = sys.modules[packageName]
     return getattr(package, fct)()
   except Exception as e:
-    print('*get Plugin Meta data error',e)
+    log.warning('Failed to get the metadata %s of plugin %s: %s', fct, packageName, e)
     return "__error__"
 
 
@@ -99,12 +104,10 @@ def pluginMetadata(packageName, fct):
 def loadPlugin(packageName):
   try:
     __import__(packageName)
-    print('*load plugin ', packageName)
+    log.debug('loaded plugin %s', packageName)
     return True
   except:
-    print('*load plugin {} failed'.format(packageName))
-    exstr = traceback.format_exc()
-    print (exstr)
+    log.exception('Failed to load plugin %s', packageName)
     pass # continue...
 
   # snake in the grass, we know it's there
@@ -124,10 +127,10 @@ def loadPlugin(packageName):
 def startPlugin(packageName):
   """ initialize the plugin """
   global plugins, active_plugins, iface
-  print('*start the plugin {}'.format(packageName))
   if packageName in active_plugins: 
-    print('*the plugin {} is active , return'.format(packageName))
+    log.debug('plugin %s is already active', packageName)
     return False
+  start = time.perf_counter()
 
   package = sys.modules[packageName]
   errMsg = "Python", "Couldn't load plugin " 
@@ -135,11 +138,8 @@ def startPlugin(packageName):
   # create an instance of the plugin
   try:
     plugins[packageName] = package.classFactory(iface)
-    print('*here')
   except Exception as e:
-    print('*load the plugin {}, failed'.format(packageName))
-    exstr = traceback.format_exc()
-    print (exstr)
+    log.exception('Failed to create plugin %s', packageName)
     _unloadPluginModules(packageName)
     msg = ("Python", "%1 due an error when calling its classFactory() method")
     showException(sys.exc_type, sys.exc_value, sys.exc_traceback, msg)
@@ -149,9 +149,7 @@ def startPlugin(packageName):
   try:
     plugins[packageName].initGui()
   except Exception as e:
-    print('*load the plugin {}, init Gui, failed'.format(packageName))
-    exstr = traceback.format_exc()
-    print (exstr)
+    log.exception('Failed to init the gui of plugin %s', packageName)
     del plugins[packageName]
     _unloadPluginModules(packageName)
     msg = QCoreApplication.translate("Python", "%1 due an error when calling its initGui() method" ).arg( errMsg )
@@ -160,7 +158,8 @@ def startPlugin(packageName):
 
   # add to active plugins
   active_plugins.append(packageName)
-  print('*load the plugin {} successfully  :-)'.format(packageName))
+  log.info('started plugin %s in %.0f ms', packageName,
+           (time.perf_counter() - start) * 1000)
 
   return True
 
@@ -226,7 +225,7 @@ def _unloadPluginModules(packageName):
 
 
 def isPluginLoaded(packageName):
-  print("*find out whether plugin {} is active (i.e. has been started)".format(packageName))
+  log.debug('is plugin %s active', packageName)
   global plugins, active_plugins
   if (packageName not in plugins): 
     return False